@@ -0,0 +1,100 @@
+"""
+Benchmark de throughput de login según el número de procesos de bcrypt
+
+    python -m app.bench --workers 0,1,2,4 --logins 200 --concurrency 32
+
+workers=0 es la referencia sin pool (bcrypt en el hilo de la petición)
+Además del throughput se mide la latencia de /health durante la ráfaga:
+es lo que sufren las demás peticiones mientras bcrypt retiene el GIL
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Base de datos propia del benchmark (antes de importar la app)
+os.environ.setdefault("DATABASE_URL", "sqlite:///./auth_bench.db")
+
+from fastapi.testclient import TestClient
+from . import hashing
+from .database import SessionLocal
+from .hashing import BCRYPT_ROUNDS, PasswordHasher
+from .main import app
+from .models import User
+
+BENCH_EMAIL = "bench@auth.local"
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def ensure_bench_user(rounds: int):
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.email == BENCH_EMAIL).delete()
+        db.add(User(
+            email=BENCH_EMAIL,
+            password=hashing.hash_job(BENCH_PASSWORD, rounds),
+            name="Bench"
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(workers: int, logins: int, concurrency: int, rounds: int) -> dict:
+    hasher = PasswordHasher(workers=workers, max_pending=logins + concurrency, rounds=rounds)
+    hashing._password_hasher = hasher
+    client = TestClient(app)
+    credentials = {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+
+    # Arranque de los procesos fuera de la medición
+    for _ in range(max(workers, 1)):
+        hasher.verify(BENCH_PASSWORD, hashing.hash_job(BENCH_PASSWORD, rounds))
+
+    def login(_):
+        return client.post("/login", json=credentials).status_code
+
+    health_latencies = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = [pool.submit(login, number) for number in range(logins)]
+        while not all(future.done() for future in futures):
+            probe = time.perf_counter()
+            client.get("/health")
+            health_latencies.append((time.perf_counter() - probe) * 1000)
+        statuses = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    hasher.shutdown()
+    return {
+        "workers": workers,
+        "ok": statuses.count(200),
+        "rejected": statuses.count(503),
+        "logins_per_second": round(statuses.count(200) / elapsed, 1),
+        "health_p50_ms": round(statistics.median(health_latencies or [0.0]), 1),
+        "health_p95_ms": round(percentile(health_latencies, 0.95), 1)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Login throughput vs bcrypt worker processes")
+    parser.add_argument("--workers", default=f"0,1,{os.cpu_count() or 1}")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    args = parser.parse_args()
+
+    ensure_bench_user(args.rounds)
+    print(f"bcrypt rounds={args.rounds} logins={args.logins} concurrency={args.concurrency} cpus={os.cpu_count()}")
+    print(f"{'workers':>8} {'ok':>6} {'503':>6} {'logins/s':>10} {'health p50':>11} {'health p95':>11}")
+    for workers in dict.fromkeys(int(value) for value in args.workers.split(",")):
+        result = run(workers, args.logins, args.concurrency, args.rounds)
+        print(
+            f"{result['workers']:>8} {result['ok']:>6} {result['rejected']:>6} "
+            f"{result['logins_per_second']:>10} {result['health_p50_ms']:>10}ms {result['health_p95_ms']:>10}ms"
+        )
@@ -0,0 +1,206 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Lock
+from passlib.context import CryptContext
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Costo de bcrypt: los hashes con otro costo se actualizan al iniciar sesión
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Procesos para bcrypt (0 = en el hilo de la petición, sin pool)
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+# Trabajos admitidos a la vez (en ejecución + en cola); el resto se rechaza
+HASH_POOL_MAX_PENDING = int(os.getenv("HASH_POOL_MAX_PENDING", "64"))
+
+HASH_TIMEOUT_SECONDS = float(os.getenv("HASH_TIMEOUT_SECONDS", "10"))
+
+_contexts = {}
+
+
+def crypt_context(rounds: int) -> CryptContext:
+    """Contexto bcrypt para un costo; cualquier otro costo cuenta como desactualizado"""
+    context = _contexts.get(rounds)
+    if context is None:
+        context = _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds
+        )
+    return context
+
+
+# ========== Trabajos (se ejecutan en los procesos del pool) ==========
+def hash_job(password: str, rounds: int) -> str:
+    return crypt_context(rounds).hash(password)
+
+
+def hash_many_job(passwords: list, rounds: int) -> list:
+    context = crypt_context(rounds)
+    return [context.hash(password) for password in passwords]
+
+
+def verify_job(plain: str, hashed: str, rounds: int) -> tuple:
+    """(válida, hash nuevo o None) en una sola verificación"""
+    return crypt_context(rounds).verify_and_update(plain, hashed)
+
+
+class HashPoolBusy(Exception):
+    """El pool tiene su cola llena: la petición se rechaza sin esperar"""
+
+
+class PasswordHasher:
+    """
+    bcrypt fuera del proceso de la API: un ProcessPoolExecutor acotado
+    Un pico de logins ocupa los procesos del pool, no el GIL del servidor,
+    y pasado HASH_POOL_MAX_PENDING se rechaza de inmediato en vez de encolar
+    Las rutas usan los métodos *_async: esperan en el event loop sin ocupar
+    un hilo del threadpool, así que la cola puede llenarse hasta max_pending
+    """
+
+    def __init__(
+        self,
+        workers: int = HASH_POOL_WORKERS,
+        max_pending: int = HASH_POOL_MAX_PENDING,
+        rounds: int = BCRYPT_ROUNDS,
+        timeout: float = HASH_TIMEOUT_SECONDS
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None
+        self._lock = Lock()
+
+    def _submit(self, submit):
+        """Reserva un cupo de la cola y envía el trabajo con submit(executor)"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise HashPoolBusy(f"Password hashing queue is full ({self.pending} pending)")
+            if self._executor is None:
+                # spawn: no hereda threads ni conexiones del proceso de la API
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+                logger.info(f"🔐 Password hashing pool started with {self.workers} workers")
+            executor = self._executor
+            try:
+                future = submit(executor)
+            except BrokenProcessPool:
+                # Un worker murió: el próximo trabajo crea un pool nuevo
+                self._executor = None
+                raise
+            self.pending += 1
+
+        # Se libera el cupo cuando el trabajo termina (aunque venza el timeout)
+        future.add_done_callback(self._release)
+        return executor, future
+
+    def _discard(self, executor):
+        """El trabajo encontró el pool roto: se descarta para que el próximo cree otro"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                logger.warning("⚠️ Password hashing pool is broken, it will be recreated")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _result(self, executor, future, timeout: float):
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    async def _result_async(self, executor, future, timeout: float):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def _run(self, job, *args):
+        if self.workers <= 0:
+            return job(*args, self.rounds)
+        executor, future = self._submit(lambda executor: executor.submit(job, *args, self.rounds))
+        return self._result(executor, future, self.timeout)
+
+    async def _run_async(self, job, *args):
+        if self.workers <= 0:
+            return await asyncio.to_thread(job, *args, self.rounds)
+        executor, future = self._submit(lambda executor: executor.submit(job, *args, self.rounds))
+        return await self._result_async(executor, future, self.timeout)
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_job, password)
+
+    async def hash_async(self, password: str) -> str:
+        return await self._run_async(hash_job, password)
+
+    def _submit_chunks(self, passwords: list) -> tuple:
+        """Un trabajo por proceso del pool; cada trabajo ocupa un cupo de la cola"""
+        size = max(1, -(-len(passwords) // self.workers))
+        futures = []
+        try:
+            for start in range(0, len(passwords), size):
+                chunk = passwords[start:start + size]
+                futures.append(self._submit(lambda executor: executor.submit(hash_many_job, chunk, self.rounds)))
+        except (HashPoolBusy, BrokenProcessPool):
+            for _, future in futures:
+                future.cancel()
+            raise
+        return size, futures
+
+    def hash_many(self, passwords: list) -> list:
+        """Hashes de varias contraseñas (altas masivas) repartidos entre los procesos del pool"""
+        if self.workers <= 0:
+            return hash_many_job(passwords, self.rounds)
+
+        size, futures = self._submit_chunks(passwords)
+        hashes = []
+        for executor, future in futures:
+            hashes.extend(self._result(executor, future, self.timeout * size))
+        return hashes
+
+    async def hash_many_async(self, passwords: list) -> list:
+        if self.workers <= 0:
+            return await asyncio.to_thread(hash_many_job, passwords, self.rounds)
+
+        size, futures = self._submit_chunks(passwords)
+        hashes = []
+        for executor, future in futures:
+            hashes.extend(await self._result_async(executor, future, self.timeout * size))
+        return hashes
+
+    def verify(self, plain: str, hashed: str) -> tuple:
+        """(válida, hash nuevo si el costo guardado no es el configurado)"""
+        return self._run(verify_job, plain, hashed)
+
+    async def verify_async(self, plain: str, hashed: str) -> tuple:
+        return await self._run_async(verify_job, plain, hashed)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ========== Singleton Global ==========
+_password_hasher = None
+
+def get_password_hasher() -> PasswordHasher:
+    """Obtener la instancia singleton del hasher de contraseñas"""
+    global _password_hasher
+    if _password_hasher is None:
+        _password_hasher = PasswordHasher()
+    return _password_hasher
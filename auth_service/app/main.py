@@ -1,12 +1,26 @@
 from fastapi import FastAPI
 from .database import Base, engine
-from .routes import router
+from .routes import check_client_ip_config, router
+from .hashing import get_password_hasher
+from .faults import FAULTS_ENABLED, FaultInjectionMiddleware
+from .faults import router as faults_router
 
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Auth Service")
 
 app.include_router(router)
+app.include_router(faults_router)
+if FAULTS_ENABLED:
+    app.add_middleware(FaultInjectionMiddleware)
+
+@app.on_event("startup")
+def startup_event():
+    check_client_ip_config()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    get_password_hasher().shutdown()
 
 @app.get("/health")
 def health():
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from threading import Lock
+import os
+import time
+
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+
+def user_profile(user) -> dict:
+    """Perfil del usuario (lo que responde /me)"""
+    return {"id": user.id, "email": user.email, "name": user.name}
+
+
+def public_profile(profile: dict) -> dict:
+    """Lo que cualquier usuario autenticado puede ver de otro (sin email)"""
+    return {"id": profile["id"], "name": profile["name"]}
+
+
+class ProfileCache:
+    """
+    LRU en memoria de perfiles por user_id, con TTL
+    Se invalida al cambiar un perfil en este proceso; en las demás réplicas
+    el TTL acota cuánto puede durar un perfil desactualizado
+    """
+
+    def __init__(self, max_size: int = PROFILE_CACHE_SIZE, ttl_seconds: float = PROFILE_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._profiles = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._profiles.get(user_id)
+            if entry is None:
+                return None
+            expires_at, profile = entry
+            if time.monotonic() >= expires_at:
+                del self._profiles[user_id]
+                return None
+            self._profiles.move_to_end(user_id)
+            return profile
+
+    def get_many(self, user_ids: list) -> tuple:
+        """(perfiles encontrados por id, ids que faltan)"""
+        found, missing = {}, []
+        for user_id in user_ids:
+            profile = self.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = profile
+        return found, missing
+
+    def put(self, profile: dict):
+        with self._lock:
+            self._profiles[profile["id"]] = (time.monotonic() + self.ttl_seconds, profile)
+            self._profiles.move_to_end(profile["id"])
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+# ========== Singleton Global ==========
+_profile_cache = ProfileCache()
+
+def get_profile_cache() -> ProfileCache:
+    """Obtener la instancia singleton del cache de perfiles"""
+    return _profile_cache
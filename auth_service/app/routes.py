@@ -1,10 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+from concurrent.futures import TimeoutError as HashTimeout
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
+from typing import List
+import logging
+import math
+import os
+import socket
+import time
 
 from .database import get_db
 from .models import User
-from .security import hash_password, verify_password, create_access_token
+from .security import create_access_token, decode_token
+from .profiles import get_profile_cache, public_profile, user_profile
+from .hashing import HashPoolBusy, get_password_hasher
+from .throttle import get_login_throttle
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -17,36 +32,192 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
+class ProfileUpdate(BaseModel):
+    name: str
+
+class UserLookup(BaseModel):
+    ids: List[int]
+
+
+# Detrás del gateway la IP del cliente llega en X-Forwarded-For; solo se
+# confía en ella si la conexión viene de uno de TRUSTED_PROXIES (nombres o IPs)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "true").lower() == "true"
+TRUSTED_PROXIES = [host.strip() for host in os.getenv("TRUSTED_PROXIES", "gateway").split(",") if host.strip()]
+TRUSTED_PROXIES_TTL_SECONDS = 60
+
+# Máximo de usuarios por alta masiva
+USER_BULK_MAX = int(os.getenv("USER_BULK_MAX", "200"))
+
+# Máximo de ids por consulta masiva
+USER_LOOKUP_MAX_IDS = int(os.getenv("USER_LOOKUP_MAX_IDS", "500"))
+
+
+HASH_BUSY_RETRY_AFTER = "1"
+
+async def run_password_job(job, *args):
+    """
+    Ejecuta hash/verify en el pool; con la cola llena responde 503 al instante
+    Un trabajo que vence el timeout o un pool roto (worker muerto) también es
+    503: el hasher descarta el pool roto y el siguiente intento crea uno nuevo
+    Las rutas que hashean son async: la espera no ocupa un hilo del threadpool
+    (40 hilos), que si no acotaría la cola antes que HASH_POOL_MAX_PENDING
+    """
+    try:
+        return await job(*args)
+    except (HashPoolBusy, HashTimeout, BrokenProcessPool):
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, retry shortly",
+            headers={"Retry-After": HASH_BUSY_RETRY_AFTER}
+        )
+
+
+_trusted_proxy_ips = (0.0, frozenset())
+
+def trusted_proxy_ips() -> frozenset:
+    """IPs de TRUSTED_PROXIES; los nombres se resuelven por DNS y se cachean un minuto"""
+    global _trusted_proxy_ips
+    resolved_at, ips = _trusted_proxy_ips
+    if ips and time.monotonic() - resolved_at < TRUSTED_PROXIES_TTL_SECONDS:
+        return ips
+    resolved = set()
+    for host in TRUSTED_PROXIES:
+        try:
+            resolved.update(socket.gethostbyname_ex(host)[2])
+        except OSError:
+            continue
+    _trusted_proxy_ips = (time.monotonic(), frozenset(resolved))
+    return _trusted_proxy_ips[1]
 
-@router.post("/register")
-def register(user: UserIn, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="User already exists")
 
-    db_user = User(
-        email=user.email,
-        password=hash_password(user.password),
-        name=user.name  # ← NUEVO: guardar nombre
-    )
-    db.add(db_user)
+def check_client_ip_config():
+    """
+    Sin proxies de confianza todos los logins que pasan por el gateway
+    comparten su IP y, con ella, el mismo límite de intentos por IP
+    """
+    if get_login_throttle().limits_ip and not (TRUST_FORWARDED_FOR and TRUSTED_PROXIES):
+        logger.warning(
+            "⚠️ Per-IP login limit is on but X-Forwarded-For is not trusted "
+            "(TRUST_FORWARDED_FOR/TRUSTED_PROXIES): clients behind a proxy share one bucket"
+        )
+
+
+def client_ip(request: Request):
+    """
+    IP del cliente: la última entrada de X-Forwarded-For (la agrega el gateway)
+    solo si la conexión viene del gateway; si no, la IP de la conexión
+    """
+    peer = request.client.host if request.client else None
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUST_FORWARDED_FOR and forwarded and peer in trusted_proxy_ips():
+        return forwarded.split(",")[-1].strip()
+    return peer
+
+
+def insert_users(db: Session, rows: list) -> list:
+    """
+    INSERT ... ON CONFLICT (email) DO NOTHING RETURNING id, email (sin commit)
+    Una sola sentencia: retorna solo las filas creadas, los emails existentes
+    se omiten sin error aunque dos altas compitan por el mismo email
+    """
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(User).on_conflict_do_nothing(index_elements=["email"]).returning(User.id, User.email)
+    return db.execute(stmt, rows).all()
+
+
+def save_users(db: Session, rows: list) -> list:
+    created = insert_users(db, rows)
     db.commit()
-    db.refresh(db_user)
+    return created
+
+
+@router.post("/register")
+async def register(user: UserIn, db: Session = Depends(get_db)):
+    password = await run_password_job(get_password_hasher().hash_async, user.password)
+    created = await run_in_threadpool(save_users, db, [{
+        "email": user.email,
+        "password": password,
+        "name": user.name,  # ← NUEVO: guardar nombre
+        "role": "user"
+    }])
+
+    if not created:
+        raise HTTPException(status_code=400, detail="User already exists")
 
     return {"message": "User registered"}
 
 
+@router.post("/users/bulk")
+async def provision_users(users: List[UserIn], authorization: str = Header(None), db: Session = Depends(get_db)):
+    """
+    Alta masiva de usuarios (onboarding de equipos), solo para administradores
+    Mismo camino que /register: un único INSERT ... ON CONFLICT DO NOTHING
+    """
+    admin_id = token_user_id(authorization)
+    role = await run_in_threadpool(lambda: db.query(User.role).filter(User.id == admin_id).scalar())
+    if role != "admin":
+        raise HTTPException(status_code=403, detail="Admin role required")
+    if len(users) > USER_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {USER_BULK_MAX} users per request")
+
+    # Un email repetido dentro de la petición se da de alta una vez (el primero)
+    unique = {}
+    for user in users:
+        unique.setdefault(user.email, user)
+    unique = list(unique.values())
+    hashes = await run_password_job(get_password_hasher().hash_many_async, [user.password for user in unique])
+    created = await run_in_threadpool(save_users, db, [
+        {"email": user.email, "password": password, "name": user.name, "role": "user"}
+        for user, password in zip(unique, hashes)
+    ])
+
+    created_emails = {row.email for row in created}
+    return {
+        "created": [{"id": row.id, "email": row.email} for row in created],
+        "existing": [user.email for user in unique if user.email not in created_emails]
+    }
+
+
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def login(user: UserLogin, request: Request, db: Session = Depends(get_db)):
+    # El limitador va antes de la base de datos y de bcrypt: rechazar cuesta microsegundos
+    throttle = get_login_throttle()
+    ip = client_ip(request)
+    wait = throttle.check(user.email, ip)
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+    db_user = await run_in_threadpool(lambda: db.query(User).filter(User.email == user.email).first())
+
+    if not db_user:
+        throttle.record_failure(user.email, ip)
+        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not db_user or not verify_password(user.password, db_user.password):
+    valid, new_hash = await run_password_job(get_password_hasher().verify_async, user.password, db_user.password)
+    if not valid:
+        throttle.record_failure(user.email, ip)
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    throttle.record_success(user.email)
+
+    return await run_in_threadpool(complete_login, db, db_user, new_hash)
+
+
+def complete_login(db: Session, db_user: User, new_hash: str) -> dict:
+    # Hash guardado con otro costo de bcrypt: se actualiza con la contraseña en claro
+    if new_hash:
+        db_user.password = new_hash
+        db.commit()
 
     token = create_access_token({
         "sub": str(db_user.id),
         "name": db_user.name  # ← NUEVO: incluir nombre en token
     })
+    get_profile_cache().put(user_profile(db_user))
 
     return {
         "access_token": token,
@@ -58,23 +229,85 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     }
 
 
-# ← NUEVO: endpoint para obtener info del usuario
-@router.get("/me")
-def get_current_user(authorization: str = Depends(lambda x: x), db: Session = Depends(get_db)):
-    from .security import decode_token
+def token_user_id(authorization: str) -> int:
+    """user_id del JWT del header Authorization (sin consultar la base de datos)"""
     try:
         token = authorization.split()[1]
-        payload = decode_token(token)
-        user_id = int(payload.get("sub"))
-        
+        return int(decode_token(token).get("sub"))
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def load_profile(db: Session, user_id: int) -> dict:
+    """Perfil desde el cache; la base de datos solo se consulta en un fallo"""
+    cache = get_profile_cache()
+    profile = cache.get(user_id)
+    if profile is None:
         user = db.query(User).filter(User.id == user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        
-        return {
-            "id": user.id,
-            "email": user.email,
-            "name": user.name
-        }
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        profile = user_profile(user)
+        cache.put(profile)
+    return profile
+
+
+# ← NUEVO: endpoint para obtener info del usuario
+@router.get("/me")
+def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
+    """Usuario del token: el id sale de los claims y el perfil del cache"""
+    return load_profile(db, token_user_id(authorization))
+
+
+@router.put("/me")
+def update_current_user(profile: ProfileUpdate, authorization: str = Header(None), db: Session = Depends(get_db)):
+    """Actualiza el nombre del usuario e invalida su perfil cacheado"""
+    user_id = token_user_id(authorization)
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user.name = profile.name
+    db.commit()
+    get_profile_cache().invalidate(user_id)
+    return user_profile(user)
+
+
+def lookup_profiles(db: Session, user_ids: list) -> list:
+    """
+    Perfiles públicos ({id, name}) de muchos usuarios: primero el cache
+    compartido y los que faltan con una sola consulta IN. Los ids
+    inexistentes se omiten; el email solo lo ve su dueño en /me
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if len(user_ids) > USER_LOOKUP_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {USER_LOOKUP_MAX_IDS} ids per lookup")
+
+    cache = get_profile_cache()
+    found, missing = cache.get_many(user_ids)
+    if missing:
+        for user in db.query(User).filter(User.id.in_(missing)).all():
+            found[user.id] = user_profile(user)
+            cache.put(found[user.id])
+    return [public_profile(found[user_id]) for user_id in user_ids if user_id in found]
+
+
+@router.get("/users")
+def get_users(
+    ids: str = Query(..., description="ids separados por comas"),
+    authorization: str = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Consulta masiva de usuarios: GET /users?ids=1,2,3"""
+    token_user_id(authorization)
+    try:
+        user_ids = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be integers")
+    return lookup_profiles(db, user_ids)
+
+
+@router.post("/users/lookup")
+def post_users_lookup(lookup: UserLookup, authorization: str = Header(None), db: Session = Depends(get_db)):
+    """Consulta masiva de usuarios con los ids en el cuerpo (listas largas)"""
+    token_user_id(authorization)
+    return lookup_profiles(db, lookup.ids)
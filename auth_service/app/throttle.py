@@ -0,0 +1,133 @@
+from collections import OrderedDict, deque
+from threading import Lock
+import os
+import time
+
+LOGIN_WINDOW_SECONDS = float(os.getenv("LOGIN_WINDOW_SECONDS", "900"))
+
+# Fallos por email: los primeros son gratis, luego el retardo se duplica
+LOGIN_FREE_FAILURES = int(os.getenv("LOGIN_FREE_FAILURES", "3"))
+LOGIN_BASE_DELAY_SECONDS = float(os.getenv("LOGIN_BASE_DELAY_SECONDS", "1"))
+LOGIN_MAX_DELAY_SECONDS = float(os.getenv("LOGIN_MAX_DELAY_SECONDS", "60"))
+LOGIN_MAX_FAILURES_PER_EMAIL = int(os.getenv("LOGIN_MAX_FAILURES_PER_EMAIL", "10"))
+
+# Intentos fallidos por IP (credential stuffing prueba muchos emails desde
+# pocas IPs); los logins correctos no cuentan. 0 desactiva el límite por IP
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "100"))
+
+# Claves recordadas por ventana; las menos recientes se descartan
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+
+class SlidingWindow:
+    """
+    Marcas de tiempo por clave dentro de la ventana
+    Memoria acotada: como mucho max_keys claves (LRU) y max_events marcas por clave
+    """
+
+    def __init__(self, window: float, max_events: int, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.window = window
+        self.max_events = max_events
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+
+    def events(self, key: str, now: float) -> deque:
+        """Marcas vigentes de la clave (descarta las que salieron de la ventana)"""
+        events = self._events.get(key)
+        if events is None:
+            return deque()
+        while events and now - events[0] >= self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+        return events
+
+    def add(self, key: str, now: float):
+        events = self._events.get(key)
+        if events is None:
+            events = self._events[key] = deque(maxlen=self.max_events)
+        events.append(now)
+        self._events.move_to_end(key)
+        while len(self._events) > self.max_keys:
+            self._events.popitem(last=False)
+
+    def reset(self, key: str):
+        self._events.pop(key, None)
+
+    def __len__(self):
+        return len(self._events)
+
+
+class LoginThrottle:
+    """
+    Limitador de logins previo a la base de datos y a bcrypt
+    - Por email: retardo progresivo tras LOGIN_FREE_FAILURES fallos
+      (1s, 2s, 4s ... hasta el máximo) y bloqueo hasta que expiren los
+      fallos al llegar a LOGIN_MAX_FAILURES_PER_EMAIL
+    - Por IP: como mucho LOGIN_MAX_ATTEMPTS_PER_IP intentos fallidos por
+      ventana (detrás de un proxy sin X-Forwarded-For todos comparten la IP
+      del proxy: contar los correctos bloquearía a todos los usuarios)
+    Un intento rechazado no espera: responde con los segundos a esperar
+    """
+
+    def __init__(
+        self,
+        window: float = LOGIN_WINDOW_SECONDS,
+        free_failures: int = LOGIN_FREE_FAILURES,
+        base_delay: float = LOGIN_BASE_DELAY_SECONDS,
+        max_delay: float = LOGIN_MAX_DELAY_SECONDS,
+        max_failures: int = LOGIN_MAX_FAILURES_PER_EMAIL,
+        max_attempts_per_ip: int = LOGIN_MAX_ATTEMPTS_PER_IP,
+        max_keys: int = LOGIN_THROTTLE_MAX_KEYS,
+        clock=time.monotonic
+    ):
+        self.free_failures = free_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self._failures = SlidingWindow(window, max_failures, max_keys)
+        self._attempts = SlidingWindow(window, max_attempts_per_ip, max_keys)
+        self._lock = Lock()
+
+    @property
+    def limits_ip(self) -> bool:
+        return self._attempts.max_events > 0
+
+    def check(self, email: str, ip: str) -> float:
+        """Segundos que faltan para poder intentar (0 = permitido)"""
+        email = email.strip().lower()
+        now = self.clock()
+        with self._lock:
+            attempts = self._attempts.events(ip, now) if ip and self.limits_ip else ()
+            if attempts and len(attempts) >= self._attempts.max_events:
+                return attempts[0] + self._attempts.window - now
+
+            failures = self._failures.events(email, now)
+            if len(failures) >= self._failures.max_events:
+                return failures[0] + self._failures.window - now
+            if len(failures) >= self.free_failures:
+                delay = min(self.max_delay, self.base_delay * 2 ** (len(failures) - self.free_failures))
+                wait = failures[-1] + delay - now
+                if wait > 0:
+                    return wait
+            return 0.0
+
+    def record_failure(self, email: str, ip: str = None):
+        """Un fallo cuenta para el email y, si se conoce, para la IP"""
+        now = self.clock()
+        with self._lock:
+            self._failures.add(email.strip().lower(), now)
+            if ip and self.limits_ip:
+                self._attempts.add(ip, now)
+
+    def record_success(self, email: str):
+        with self._lock:
+            self._failures.reset(email.strip().lower())
+
+
+# ========== Singleton Global ==========
+_login_throttle = LoginThrottle()
+
+def get_login_throttle() -> LoginThrottle:
+    """Obtener la instancia singleton del limitador de logins"""
+    return _login_throttle
@@ -17,3 +17,241 @@ def test_login():
         "password": "123456"
     })
     assert response.status_code in [200, 401]
+
+def test_login_upgrades_hash_cost_and_rejects_when_pool_is_full():
+    from unittest.mock import patch
+    from app.database import SessionLocal
+    from app.models import User
+    from app.hashing import PasswordHasher
+
+    email = "rehash@test.com"
+    db = SessionLocal()
+    db.query(User).filter(User.email == email).delete()
+    db.commit()
+
+    credentials = {"email": email, "password": "123456"}
+    with patch("app.routes.get_password_hasher", return_value=PasswordHasher(workers=0, rounds=4)):
+        assert client.post("/register", json=dict(credentials, name="Rehash")).status_code == 200
+    assert db.query(User.password).filter(User.email == email).scalar().startswith("$2b$04$")
+
+    # Al subir el costo, el login válido reescribe el hash guardado
+    with patch("app.routes.get_password_hasher", return_value=PasswordHasher(workers=0, rounds=5)):
+        assert client.post("/login", json=credentials).status_code == 200
+        assert client.post("/login", json=dict(credentials, password="wrong")).status_code == 401
+    db.expire_all()
+    assert db.query(User.password).filter(User.email == email).scalar().startswith("$2b$05$")
+
+    # Con la cola llena se rechaza sin esperar a bcrypt
+    with patch("app.routes.get_password_hasher", return_value=PasswordHasher(workers=1, max_pending=0)):
+        response = client.post("/login", json=credentials)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+    # Timeout o pool roto también son 503 (no 500)
+    from concurrent.futures import TimeoutError as HashTimeout
+    from concurrent.futures.process import BrokenProcessPool
+    from unittest.mock import AsyncMock, MagicMock
+    for error in (HashTimeout(), BrokenProcessPool()):
+        with patch("app.routes.get_password_hasher", return_value=MagicMock(verify_async=AsyncMock(side_effect=error))):
+            assert client.post("/login", json=credentials).status_code == 503
+    db.close()
+
+def test_password_hasher_queue_is_bounded_by_max_pending_not_threads():
+    import asyncio
+    from app.hashing import HashPoolBusy, PasswordHasher
+
+    # Más esperas concurrentes que hilos del threadpool (40): el límite es max_pending
+    hasher = PasswordHasher(workers=1, max_pending=50, rounds=4)
+
+    async def burst():
+        return await asyncio.gather(
+            *(hasher.hash_async("secret") for _ in range(60)),
+            return_exceptions=True
+        )
+
+    try:
+        results = asyncio.run(burst())
+        assert sum(isinstance(result, HashPoolBusy) for result in results) == 10
+        assert all(result.startswith("$2b$04$") for result in results if isinstance(result, str))
+    finally:
+        hasher.shutdown()
+
+def test_password_hasher_recreates_a_broken_pool():
+    import os
+    import pytest
+    from concurrent.futures.process import BrokenProcessPool
+    from app.hashing import PasswordHasher
+
+    hasher = PasswordHasher(workers=1, rounds=4)
+    try:
+        # Un worker que muere rompe el pool: el trabajo falla y el pool se descarta
+        executor, future = hasher._submit(lambda executor: executor.submit(os._exit, 1))
+        with pytest.raises(BrokenProcessPool):
+            hasher._result(executor, future, 30)
+        assert hasher._executor is None
+
+        assert hasher.verify("secret", hasher.hash("secret"))[0]
+    finally:
+        hasher.shutdown()
+
+def test_me_reads_header_token_and_serves_profile_from_cache():
+    from unittest.mock import patch
+    from app.database import SessionLocal
+    from app.models import User
+    from app.hashing import PasswordHasher
+
+    email = "profile@test.com"
+    db = SessionLocal()
+    db.query(User).filter(User.email == email).delete()
+    db.commit()
+    db.close()
+
+    credentials = {"email": email, "password": "123456"}
+    with patch("app.routes.get_password_hasher", return_value=PasswordHasher(workers=0, rounds=4)):
+        client.post("/register", json=dict(credentials, name="Profile"))
+        login = client.post("/login", json=credentials).json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+    assert client.get("/me").status_code == 401
+    assert client.get("/me", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+    # En régimen estable /me no consulta la base de datos
+    with patch("sqlalchemy.orm.Session.query", side_effect=AssertionError("database hit")):
+        me = client.get("/me", headers=headers).json()
+    assert me == {"id": login["user"]["id"], "email": email, "name": "Profile"}
+
+    # Cambiar el perfil invalida el cache
+    assert client.put("/me", headers=headers, json={"name": "Renamed"}).status_code == 200
+    assert client.get("/me", headers=headers).json()["name"] == "Renamed"
+
+def test_bulk_user_lookup_uses_one_query_and_the_cache():
+    from unittest.mock import patch
+    from app.security import create_access_token
+    from app.profiles import get_profile_cache
+    from app.database import SessionLocal
+    from app.models import User
+
+    db = SessionLocal()
+    emails = [f"lookup{i}@test.com" for i in range(3)]
+    db.query(User).filter(User.email.in_(emails)).delete()
+    db.commit()
+    users = [User(email=email, password="x", name=f"Lookup {i}") for i, email in enumerate(emails)]
+    db.add_all(users)
+    db.commit()
+    ids = [user.id for user in users]
+    db.close()
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(ids[0])})}"}
+    assert client.get("/users?ids=1").status_code == 401
+
+    get_profile_cache().clear()
+    found = client.get(f"/users?ids={ids[0]},{ids[1]},999999", headers=headers).json()
+    assert [user["name"] for user in found] == ["Lookup 0", "Lookup 1"]
+
+    # Los dos primeros ya están en cache: solo el tercero va a la base de datos
+    from sqlalchemy.orm import Query
+    with patch.object(Query, "all", autospec=True, side_effect=Query.all) as query_all:
+        looked_up = client.post("/users/lookup", headers=headers, json={"ids": ids}).json()
+    assert query_all.call_count == 1
+    assert [user["id"] for user in looked_up] == ids
+    # Solo los datos que necesita la lista de tareas: el email no sale de /me
+    assert looked_up[2] == {"id": ids[2], "name": "Lookup 2"}
+
+def test_login_throttle_delays_progressively_and_stays_bounded():
+    from unittest.mock import patch
+    from app.throttle import LoginThrottle
+
+    now = [1000.0]
+    throttle = LoginThrottle(
+        window=60, free_failures=2, base_delay=1, max_delay=8,
+        max_failures=5, max_attempts_per_ip=50, max_keys=100, clock=lambda: now[0]
+    )
+
+    # Dos fallos gratis, luego 1s, 2s, 4s entre intentos y bloqueo al quinto
+    for delay in (0, 0, 1, 2, 4):
+        if delay:
+            assert throttle.check("Victim@test.com", "10.0.0.1") == delay
+            now[0] += delay
+        assert throttle.check("victim@test.com", "10.0.0.1") == 0
+        throttle.record_failure("victim@test.com")
+    assert throttle.check("victim@test.com", "10.0.0.2") > 0
+    now[0] += 60
+    assert throttle.check("victim@test.com", "10.0.0.2") == 0
+
+    # Por IP: los logins correctos no cuentan, los fallos con muchos emails sí
+    for i in range(60):
+        assert throttle.check(f"user{i}@test.com", "10.0.0.9") == 0
+        throttle.record_success(f"user{i}@test.com")
+    for i in range(50):
+        throttle.record_failure(f"user{i}@test.com", "10.0.0.9")
+    assert throttle.check("other@test.com", "10.0.0.9") > 0
+
+    # La memoria no crece con claves nuevas
+    for i in range(1000):
+        throttle.record_failure(f"spray{i}@test.com")
+    assert len(throttle._failures) <= 100
+
+    # El rechazo ocurre antes de consultar la base de datos
+    blocked = LoginThrottle(max_attempts_per_ip=1)
+    blocked.record_failure("someone@test.com", "testclient")
+    with patch("app.routes.get_login_throttle", return_value=blocked), \
+            patch("sqlalchemy.orm.Session.query", side_effect=AssertionError("database hit")):
+        response = client.post("/login", json={"email": "victim@test.com", "password": "x"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+    # X-Forwarded-For solo cuenta si la conexión viene de un proxy de confianza
+    from starlette.requests import Request
+    import app.routes as routes
+
+    def request_from(peer):
+        return Request({"type": "http", "headers": [(b"x-forwarded-for", b"1.2.3.4, 10.0.0.5")], "client": (peer, 1234)})
+
+    with patch("app.routes.TRUSTED_PROXIES", ["127.0.0.1"]), \
+            patch("app.routes._trusted_proxy_ips", (0.0, frozenset())):
+        assert routes.client_ip(request_from("127.0.0.1")) == "10.0.0.5"
+        assert routes.client_ip(request_from("10.0.0.9")) == "10.0.0.9"
+        with patch("app.routes.TRUST_FORWARDED_FOR", False):
+            assert routes.client_ip(request_from("127.0.0.1")) == "127.0.0.1"
+
+    # Límite por IP sin proxies de confianza: se avisa al arrancar
+    with patch("app.routes.TRUSTED_PROXIES", []), patch.object(routes.logger, "warning") as warning:
+        routes.check_client_ip_config()
+    assert warning.called
+
+def test_register_conflict_and_bulk_provisioning_use_insert_on_conflict():
+    from unittest.mock import patch
+    from app.database import SessionLocal
+    from app.models import User
+    from app.hashing import PasswordHasher
+    from app.security import create_access_token
+
+    emails = ["admin@team.com", "one@team.com", "two@team.com"]
+    db = SessionLocal()
+    db.query(User).filter(User.email.in_(emails)).delete()
+    db.commit()
+
+    with patch("app.routes.get_password_hasher", return_value=PasswordHasher(workers=0, rounds=4)):
+        user = {"email": "admin@team.com", "password": "123456", "name": "Admin"}
+        assert client.post("/register", json=user).status_code == 200
+        duplicate = client.post("/register", json=user)
+        assert duplicate.status_code == 400
+        assert duplicate.json()["detail"] == "User already exists"
+
+        admin = db.query(User).filter(User.email == "admin@team.com").one()
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': str(admin.id)})}"}
+        team = [
+            {"email": "one@team.com", "password": "p1", "name": "One"},
+            {"email": "two@team.com", "password": "p2", "name": "Two"},
+            {"email": "admin@team.com", "password": "p3", "name": "Again"}
+        ]
+        assert client.post("/users/bulk", headers=headers, json=team).status_code == 403
+
+        admin.role = "admin"
+        db.commit()
+        result = client.post("/users/bulk", headers=headers, json=team).json()
+
+    assert sorted(row["email"] for row in result["created"]) == ["one@team.com", "two@team.com"]
+    assert result["existing"] == ["admin@team.com"]
+    assert db.query(User).filter(User.email.in_(emails)).count() == 3
+    db.close()
@@ -4,12 +4,26 @@ const api = axios.create({
   baseURL: "/api", // Changed to use proxy
 });
 
+// Marca de la última escritura: con ella task_service lee del primario
+// aunque la lectura llegue a otra instancia
+let lastWrite = null;
+
 api.interceptors.request.use((config) => {
   const token = localStorage.getItem("token");
   if (token) {
     config.headers.Authorization = `Bearer ${token}`;
   }
+  if (lastWrite) {
+    config.headers["X-Last-Write"] = lastWrite;
+  }
   return config;
 });
 
-export default api;
\ No newline at end of file
+api.interceptors.response.use((response) => {
+  if (response.headers["x-last-write"]) {
+    lastWrite = response.headers["x-last-write"];
+  }
+  return response;
+});
+
+export default api;
@@ -0,0 +1,66 @@
+// Eventos en tiempo real del gateway (Server-Sent Events)
+// Una sola conexión EventSource compartida por todos los componentes
+
+const EVENT_TYPES = [
+  "task_created",
+  "task_updated",
+  "task_deleted",
+  "task_confirmed",
+  "task_compensated",
+  "notification_sent",
+  "notification_failed",
+  "resync"
+];
+
+const listeners = new Set();
+let source = null;
+let connected = false;
+
+const dispatch = (event) => {
+  listeners.forEach((listener) => listener(event));
+};
+
+const openStream = () => {
+  const token = localStorage.getItem("token");
+  if (!token) return;
+
+  source = new EventSource(`/api/events/stream?token=${encodeURIComponent(token)}`);
+
+  EVENT_TYPES.forEach((type) => {
+    source.addEventListener(type, (e) => {
+      try {
+        dispatch(JSON.parse(e.data));
+      } catch (err) {
+        console.error("Invalid stream event:", err);
+      }
+    });
+  });
+
+  // Pseudo-eventos para reflejar el estado de la conexión
+  source.onopen = () => {
+    connected = true;
+    dispatch({ type: "stream_open", payload: {} });
+  };
+  source.onerror = () => {
+    connected = false;
+    dispatch({ type: "stream_error", payload: {} });
+  };
+};
+
+export function subscribeToEvents(listener) {
+  listeners.add(listener);
+  if (!source) {
+    openStream();
+  } else if (connected) {
+    listener({ type: "stream_open", payload: {} });
+  }
+
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0 && source) {
+      source.close();
+      source = null;
+      connected = false;
+    }
+  };
+}
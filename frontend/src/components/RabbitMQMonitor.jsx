@@ -1,4 +1,6 @@
 import { useEffect, useState } from "react";
+import { subscribeToEvents } from "../api/events";
+import api from "../api/api";
 import {
   Box,
   Paper,
@@ -14,35 +16,78 @@ import RefreshIcon from "@mui/icons-material/Refresh";
 import ExpandMoreIcon from "@mui/icons-material/ExpandMore";
 import ExpandLessIcon from "@mui/icons-material/ExpandLess";
 
+const CONSUMERS_POLL_MS = 5000;
+
+const QUEUES = [
+  { service: "notification_service", label: "notification_service_tasks" },
+  { service: "task_service", label: "task_service_notifications" }
+];
+
+const INITIAL_STATS = {
+  taskEvents: { published: 0, consumed: 0 },
+  notificationEvents: { published: 0, consumed: 0 },
+  pendingMessages: 0
+};
+
 export default function RabbitMQMonitor() {
   const [expanded, setExpanded] = useState(false);
-  const [stats, setStats] = useState({
-    taskEvents: { published: 0, consumed: 0 },
-    notificationEvents: { published: 0, consumed: 0 },
-    pendingMessages: 0
-  });
-
-  // En una implementación real, estos datos vendrían de la API de RabbitMQ
-  // Para este ejemplo, simularemos los stats
-  const refreshStats = () => {
-    // Simular stats (en producción, esto vendría de RabbitMQ Management API)
-    setStats({
-      taskEvents: { 
-        published: Math.floor(Math.random() * 100), 
-        consumed: Math.floor(Math.random() * 100) 
-      },
-      notificationEvents: { 
-        published: Math.floor(Math.random() * 100), 
-        consumed: Math.floor(Math.random() * 100) 
-      },
-      pendingMessages: Math.floor(Math.random() * 5)
+  const [connected, setConnected] = useState(false);
+  const [stats, setStats] = useState(INITIAL_STATS);
+  const [consumers, setConsumers] = useState({});
+
+  // Contadores alimentados por el stream SSE del gateway (sin sondeo):
+  // - task_events consumidos = tareas que ya recibieron respuesta del Notification Service
+  // - notification_events consumidos = respuestas ya procesadas por el Task Service
+  const applyEvent = (event) => {
+    setStats(prev => {
+      const next = {
+        taskEvents: { ...prev.taskEvents },
+        notificationEvents: { ...prev.notificationEvents },
+        pendingMessages: prev.pendingMessages
+      };
+
+      if (event.type.startsWith("task_")) {
+        next.taskEvents.published += 1;
+      }
+      if (event.type === "task_created") {
+        next.pendingMessages += 1;
+      }
+      if (event.type.startsWith("notification_")) {
+        next.notificationEvents.published += 1;
+        next.taskEvents.consumed += 1;
+      }
+      if (event.type === "task_confirmed" || event.type === "task_compensated") {
+        next.notificationEvents.consumed += 1;
+        next.pendingMessages = Math.max(0, next.pendingMessages - 1);
+      }
+      return next;
     });
   };
 
+  const resetStats = () => setStats(INITIAL_STATS);
+
+  // Métricas reales de las colas (profundidad, msg/s, latencia, unacked),
+  // solo mientras el panel está abierto
   useEffect(() => {
-    refreshStats();
-    const interval = setInterval(refreshStats, 5000);
-    return () => clearInterval(interval);
+    if (!expanded) return undefined;
+    const load = () => api.get("/monitor/consumers")
+      .then(res => setConsumers(res.data))
+      .catch(() => setConsumers({}));
+    load();
+    const timer = setInterval(load, CONSUMERS_POLL_MS);
+    return () => clearInterval(timer);
+  }, [expanded]);
+
+  useEffect(() => {
+    return subscribeToEvents((event) => {
+      if (event.type === "stream_open") {
+        setConnected(true);
+      } else if (event.type === "stream_error") {
+        setConnected(false);
+      } else if (event.type !== "resync") {
+        applyEvent(event);
+      }
+    });
   }, []);
 
   return (
@@ -61,16 +106,16 @@ export default function RabbitMQMonitor() {
             RabbitMQ Status
           </Typography>
           <Chip 
-            label="Connected" 
+            label={connected ? "Connected" : "Reconnecting"} 
             size="small" 
-            color="success"
+            color={connected ? "success" : "warning"}
             sx={{ fontSize: "0.7rem" }}
           />
         </Box>
         
         <Box sx={{ display: "flex", gap: 1 }}>
-          <Tooltip title="Actualizar estadísticas">
-            <IconButton size="small" onClick={refreshStats}>
+          <Tooltip title="Reiniciar contadores">
+            <IconButton size="small" onClick={resetStats}>
               <RefreshIcon fontSize="small" />
             </IconButton>
           </Tooltip>
@@ -189,6 +234,47 @@ export default function RabbitMQMonitor() {
             </Grid>
           </Grid>
 
+          {/* Consumidores: datos del /health de cada servicio */}
+          <Grid container spacing={2} sx={{ mt: 0 }}>
+            {QUEUES.map(({ service, label }) => {
+              const consumer = consumers[service];
+              return (
+                <Grid item xs={12} md={6} key={service}>
+                  <Paper sx={{ p: 2, backgroundColor: "white" }} elevation={1}>
+                    <Box sx={{ display: "flex", justifyContent: "space-between", alignItems: "center", mb: 1 }}>
+                      <Typography variant="subtitle2" sx={{ fontWeight: "bold" }}>
+                        📊 {label}
+                      </Typography>
+                      <Chip
+                        label={!consumer ? "Sin datos" : consumer.ready ? "Ready" : "Lag"}
+                        size="small"
+                        color={!consumer ? "default" : consumer.ready ? "success" : "error"}
+                      />
+                    </Box>
+                    {consumer && [
+                      ["En cola", consumer.depth ?? "-"],
+                      ["Consumidores", consumer.consumers ?? "-"],
+                      ["Mensajes/s", consumer.messages_per_second],
+                      ["Sin ACK", consumer.unacked],
+                      ["Latencia p95", consumer.handler_latency_ms.p95 != null ? `≤ ${consumer.handler_latency_ms.p95} ms` : "-"],
+                      ["Lag estimado", consumer.lag_seconds != null ? `${consumer.lag_seconds} s` : "-"]
+                    ].map(([name, value]) => (
+                      <Box key={name} sx={{ display: "flex", justifyContent: "space-between" }}>
+                        <Typography variant="body2">{name}</Typography>
+                        <Typography variant="body2" sx={{ fontWeight: "bold" }}>{value}</Typography>
+                      </Box>
+                    ))}
+                    {consumer && !consumer.ready && (
+                      <Typography variant="caption" color="error">
+                        {consumer.not_ready_reasons.join(" · ")}
+                      </Typography>
+                    )}
+                  </Paper>
+                </Grid>
+              );
+            })}
+          </Grid>
+
           {/* Info Box */}
           <Box sx={{ mt: 2, p: 1.5, backgroundColor: "#e3f2fd", borderRadius: 1 }}>
             <Typography variant="caption" sx={{ display: "block", mb: 0.5 }}>
@@ -1,5 +1,6 @@
 import { useEffect, useState } from "react";
 import api from "../api/api";
+import { subscribeToEvents } from "../api/events";
 import {
   Box,
   Paper,
@@ -31,8 +32,28 @@ export default function SagaLogs() {
     }
   };
 
+  // Trae solo el timeline de una saga y lo coloca al inicio del historial
+  const refreshSaga = async (sagaId) => {
+    try {
+      const res = await api.get(`/tasks/sagas/${sagaId}`);
+      const timeline = [...(res.data.timeline || [])].reverse();
+      setLogs(prev => [...timeline, ...prev.filter(log => log.saga_id !== sagaId)]);
+    } catch (err) {
+      console.error("Error loading SAGA timeline:", err);
+    }
+  };
+
   useEffect(() => {
     loadLogs();
+
+    return subscribeToEvents((event) => {
+      const sagaEvents = ["task_created", "task_confirmed", "task_compensated"];
+      if (sagaEvents.includes(event.type) && event.payload?.saga_id) {
+        refreshSaga(event.payload.saga_id);
+      } else if (event.type === "resync") {
+        loadLogs();
+      }
+    });
   }, []);
 
   const getStatusColor = (status) => {
@@ -41,6 +62,7 @@ export default function SagaLogs() {
       "TASK_CREATED": "primary",
       "COMPLETED": "success",
       "COMPENSATED": "warning",
+      "TIMED_OUT": "warning",
       "FAILED": "error",
       "COMPENSATION_FAILED": "error"
     };
@@ -53,6 +75,7 @@ export default function SagaLogs() {
       "TASK_CREATED": "📝",
       "COMPLETED": "✅",
       "COMPENSATED": "🔄",
+      "TIMED_OUT": "⏰",
       "FAILED": "❌",
       "COMPENSATION_FAILED": "💥"
     };
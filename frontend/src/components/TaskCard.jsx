@@ -58,6 +58,9 @@ const categoryColors = {
 export default function TaskCard({ task, onUpdate, isPending = false }) {
   const [deleting, setDeleting] = useState(false);
   const [editDialogOpen, setEditDialogOpen] = useState(false);
+  // La versión viaja en If-Match: si otra pestaña cambió la tarea, el servidor responde 409
+  const versionHeaders = task.version ? { "If-Match": `"${task.version}"` } : {};
+
   const [editData, setEditData] = useState({
     title: task.title,
     description: task.description || "",
@@ -73,11 +76,16 @@ export default function TaskCard({ task, onUpdate, isPending = false }) {
 
     try {
       setDeleting(true);
-      await api.delete(`/tasks/${task.id}`);
+      await api.delete(`/tasks/${task.id}`, { headers: versionHeaders });
       onUpdate();
     } catch (err) {
       console.error("Error deleting task:", err);
-      alert("Error al eliminar la tarea");
+      if (err.response?.status === 409) {
+        alert("La tarea fue modificada en otra sesión. Recarga para ver los cambios.");
+        onUpdate();
+      } else {
+        alert("Error al eliminar la tarea");
+      }
     } finally {
       setDeleting(false);
     }
@@ -85,12 +93,17 @@ export default function TaskCard({ task, onUpdate, isPending = false }) {
 
   const updateTask = async () => {
     try {
-      await api.put(`/tasks/${task.id}`, editData);
+      await api.put(`/tasks/${task.id}`, editData, { headers: versionHeaders });
       setEditDialogOpen(false);
       onUpdate();
     } catch (err) {
       console.error("Error updating task:", err);
-      alert("Error al actualizar la tarea");
+      if (err.response?.status === 409) {
+        alert("La tarea fue modificada en otra sesión. Recarga para ver los cambios.");
+        onUpdate();
+      } else {
+        alert("Error al actualizar la tarea");
+      }
     }
   };
 
@@ -1,6 +1,7 @@
-import { useEffect, useState, useContext } from "react";
+import { useEffect, useState, useContext, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import api from "../api/api";
+import { subscribeToEvents } from "../api/events";
 import { AuthContext } from "../context/AuthContext";
 import {
   Container,
@@ -50,6 +51,18 @@ export default function Dashboard() {
   const [statusFilter, setStatusFilter] = useState("");
   const [categoryFilter, setCategoryFilter] = useState("");
   const [priorityFilter, setPriorityFilter] = useState("");
+  const [streamConnected, setStreamConnected] = useState(false);
+  const [stats, setStats] = useState({ total: 0, status: {}, category: {}, priority: {} });
+
+  // Contadores del servidor: independientes de los filtros y de cuántas tareas se cargaron
+  const loadStats = async () => {
+    try {
+      const res = await api.get("/tasks/stats");
+      setStats(res.data);
+    } catch (err) {
+      console.error("Error loading stats:", err);
+    }
+  };
 
   const loadTasks = async () => {
     try {
@@ -69,6 +82,7 @@ export default function Dashboard() {
 
       setTasks(data);
       setError("");
+      loadStats();
     } catch (err) {
       console.error(err);
       setError("No se pudieron cargar las tareas");
@@ -77,24 +91,99 @@ export default function Dashboard() {
     }
   };
 
+  // ¿La tarea coincide con los filtros activos? (para aplicar eventos en local)
+  const matchesFilters = (task) => {
+    if (statusFilter && task.status !== statusFilter) return false;
+    if (categoryFilter && task.category !== categoryFilter) return false;
+    if (priorityFilter && task.priority !== priorityFilter) return false;
+    if (searchTerm) {
+      const term = searchTerm.toLowerCase();
+      const text = `${task.title || ""} ${task.description || ""}`.toLowerCase();
+      if (!text.includes(term)) return false;
+    }
+    return true;
+  };
+
+  const upsertTask = (task) => {
+    setTasks(prev => {
+      const exists = prev.some(t => t.id === task.id);
+      if (!matchesFilters(task)) {
+        return exists ? prev.filter(t => t.id !== task.id) : prev;
+      }
+      return exists
+        ? prev.map(t => (t.id === task.id ? { ...t, ...task } : t))
+        : [task, ...prev];
+    });
+  };
+
+  const clearPending = (taskId) => {
+    setPendingTasks(prev => {
+      const updated = new Set(prev);
+      updated.delete(taskId);
+      return updated;
+    });
+  };
+
+  // Los handlers del stream siempre usan los filtros y funciones del último render
+  const streamHandlers = useRef({});
+  streamHandlers.current = { loadTasks, loadStats, upsertTask, clearPending };
+
+  useEffect(() => {
+    return subscribeToEvents((event) => {
+      const payload = event.payload || {};
+      const handlers = streamHandlers.current;
+
+      if (event.type.startsWith("task_") && event.type !== "task_confirmed") {
+        handlers.loadStats();
+      }
+
+      switch (event.type) {
+        case "stream_open":
+          setStreamConnected(true);
+          break;
+        case "stream_error":
+          setStreamConnected(false);
+          break;
+        case "task_created":
+        case "task_updated":
+          handlers.upsertTask(payload);
+          break;
+        case "task_deleted":
+          setTasks(prev => prev.filter(t => t.id !== payload.task_id));
+          break;
+        case "task_compensated":
+          setTasks(prev => prev.filter(t => t.id !== payload.task_id));
+          handlers.clearPending(payload.task_id);
+          break;
+        case "task_confirmed":
+          handlers.clearPending(payload.task_id);
+          break;
+        case "resync":
+          handlers.loadTasks();
+          break;
+        default:
+          break;
+      }
+    });
+  }, []);
+
   const handleTaskCreated = (success, taskData, message) => {
     if (success) {
       setSagaError(null);
       
       if (taskData && taskData.id) {
+        // Queda "procesando" hasta que el stream confirme o compense la saga
         setPendingTasks(prev => new Set([...prev, taskData.id]));
+        upsertTask(taskData);
         
-        setTimeout(async () => {
-          await loadTasks();
-          setPendingTasks(prev => {
-            const updated = new Set(prev);
-            updated.delete(taskData.id);
-            return updated;
-          });
-        }, 3000);
+        if (!streamConnected) {
+          // Sin stream: recargar tras unos segundos como antes
+          setTimeout(async () => {
+            await loadTasks();
+            clearPending(taskData.id);
+          }, 3000);
+        }
       }
-      
-      loadTasks();
     } else {
       setSagaError({
         type: "error",
@@ -141,11 +230,11 @@ export default function Dashboard() {
 
   // Stats
   const taskStats = {
-    total: tasks.length,
-    todo: tasks.filter(t => t.status === "todo").length,
-    doing: tasks.filter(t => t.status === "doing").length,
-    done: tasks.filter(t => t.status === "done").length,
-    highPriority: tasks.filter(t => t.priority === "Alta").length
+    total: stats.total,
+    todo: stats.status.todo || 0,
+    doing: stats.status.doing || 0,
+    done: stats.status.done || 0,
+    highPriority: stats.priority.Alta || 0
   };
 
   return (
@@ -444,7 +533,7 @@ export default function Dashboard() {
             <TaskCard
               key={task.id}
               task={task}
-              onUpdate={loadTasks}
+              onUpdate={streamConnected ? () => {} : loadTasks}
               isPending={pendingTasks.has(task.id)}
             />
           ))}
@@ -1,8 +1,13 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from .router import router
+from .router import router, close_events_client
+from .event_stream import broker_listener
+from .faults import FAULTS_ENABLED, FaultInjectionMiddleware
+from .faults import router as faults_router
+import asyncio
 import logging
+import os
 import uuid
 import time
 
@@ -15,6 +20,8 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="API Gateway")
 
+EVENT_STREAM_ENABLED = os.getenv("EVENT_STREAM_ENABLED", "true").lower() == "true"
+
 class RequestIdMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         request_id = request.headers.get("X-Request-ID", str(uuid.uuid4()))
@@ -28,6 +35,9 @@ class RequestIdMiddleware(BaseHTTPMiddleware):
         response.headers["X-Request-ID"] = request_id
         return response
 
+if FAULTS_ENABLED:
+    app.add_middleware(FaultInjectionMiddleware)
+
 app.add_middleware(RequestIdMiddleware)
 
 app.add_middleware(
@@ -38,8 +48,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(faults_router)
 app.include_router(router)
 
+
+@app.on_event("startup")
+async def startup_event():
+    """Iniciar el listener del broker que alimenta los streams SSE"""
+    if EVENT_STREAM_ENABLED:
+        broker_listener.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    broker_listener.stop()
+    await close_events_client()
+
+
 @app.get("/health")
 def health():
     return {"status": "gateway running"}
\ No newline at end of file
@@ -1,5 +1,9 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import Response, JSONResponse
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import Response, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from .event_stream import event_hub, stream_events
+from .security import decode_user_id, validate_token
+import asyncio
 import httpx
 import logging
 
@@ -8,32 +12,90 @@ logger = logging.getLogger(__name__)
 
 AUTH_SERVICE_URL = "http://auth_service:8000"
 TASK_SERVICE_URL = "http://task_service:8000"
+NOTIFICATION_SERVICE_URL = "http://notification_service:8000"
+
+# Cliente compartido para la ingesta de eventos, el monitoreo y los perfiles
+# de las listas de tareas (conexiones reutilizadas)
+events_client = None
+
+
+def get_events_client() -> httpx.AsyncClient:
+    global events_client
+    if events_client is None:
+        events_client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=5.0))
+    return events_client
+
+
+async def close_events_client():
+    global events_client
+    if events_client is not None:
+        await events_client.aclose()
+        events_client = None
 
 
 def forward_headers(request: Request):
     headers = {}
     if "authorization" in request.headers:
         headers["Authorization"] = request.headers["authorization"]
+    if "if-match" in request.headers:
+        headers["If-Match"] = request.headers["if-match"]
+    # Marca de read-your-writes de task_service: la lleva el cliente
+    if "x-last-write" in request.headers:
+        headers["X-Last-Write"] = request.headers["x-last-write"]
     return headers
 
 
 async def proxy_response(r: httpx.Response):
+    headers = {name: r.headers[name] for name in ("ETag", "X-Last-Write") if name in r.headers} or None
     return Response(
         content=r.content,
         status_code=r.status_code,
-        media_type=r.headers.get("content-type")
+        media_type=r.headers.get("content-type"),
+        headers=headers
     )
 
 
+async def attach_users(items: list, request: Request) -> list:
+    """
+    Agrega a cada tarea el perfil público de su usuario ({id, name}) con una
+    sola consulta masiva a auth_service, sin una llamada por usuario
+    Si auth no responde, las tareas se devuelven sin enriquecer
+    """
+    user_ids = sorted({item["user_id"] for item in items if item.get("user_id") is not None})
+    if not user_ids:
+        return items
+    try:
+        r = await get_events_client().post(
+            f"{AUTH_SERVICE_URL}/users/lookup",
+            headers=forward_headers(request),
+            json={"ids": user_ids}
+        )
+        r.raise_for_status()
+        users = {user["id"]: user for user in r.json()}
+    except Exception as e:
+        logger.warning(f"User lookup failed, tasks returned without users: {str(e)}")
+        return items
+
+    for item in items:
+        item["user"] = users.get(item.get("user_id"))
+    return items
+
+
 @router.post("/login")
 async def login(request: Request):
     try:
         body = await request.json()
         logger.info(f"Login attempt for: {body.get('email')}")
         
+        # auth_service limita los intentos por IP del cliente
+        forwarded = request.headers.get("x-forwarded-for")
+        client_host = request.client.host if request.client else "unknown"
+        headers = {"X-Forwarded-For": f"{forwarded}, {client_host}" if forwarded else client_host}
+        
         async with httpx.AsyncClient() as client:
             r = await client.post(
                 f"{AUTH_SERVICE_URL}/login",
+                headers=headers,
                 json=body
             )
         return await proxy_response(r)
@@ -65,13 +127,19 @@ async def register(request: Request):
         )
 
 
-@router.get("/me")
+@router.api_route("/me", methods=["GET", "PUT"])
 async def get_me(request: Request):
     try:
+        body = None
+        if request.method == "PUT":
+            body = await request.json()
+        
         async with httpx.AsyncClient() as client:
-            r = await client.get(
+            r = await client.request(
+                request.method,
                 f"{AUTH_SERVICE_URL}/me",
-                headers=forward_headers(request)
+                headers=forward_headers(request),
+                json=body
             )
         return await proxy_response(r)
     except Exception as e:
@@ -90,6 +158,8 @@ async def tasks(request: Request):
             body = await request.json()
         
         query_params = dict(request.query_params)
+        # ?include=users agrega el perfil del usuario de cada tarea
+        include_users = "users" in query_params.pop("include", "").split(",")
         
         async with httpx.AsyncClient() as client:
             r = await client.request(
@@ -99,6 +169,8 @@ async def tasks(request: Request):
                 json=body,
                 params=query_params
             )
+        if include_users and request.method == "GET" and r.status_code == 200:
+            return JSONResponse(content=await attach_users(r.json(), request))
         return await proxy_response(r)
     except Exception as e:
         logger.error(f"Tasks error: {str(e)}")
@@ -133,7 +205,8 @@ async def saga_logs(request: Request):
         async with httpx.AsyncClient() as client:
             r = await client.get(
                 f"{TASK_SERVICE_URL}/tasks/saga-logs",
-                headers=forward_headers(request)
+                headers=forward_headers(request),
+                params=dict(request.query_params)
             )
         logger.info(f"SAGA logs response status: {r.status_code}")
         return await proxy_response(r)
@@ -145,6 +218,135 @@ async def saga_logs(request: Request):
         )
 
 
+@router.get("/tasks/sagas")
+async def sagas(request: Request):
+    try:
+        async with httpx.AsyncClient() as client:
+            r = await client.get(
+                f"{TASK_SERVICE_URL}/tasks/sagas",
+                headers=forward_headers(request),
+                params=dict(request.query_params)
+            )
+        return await proxy_response(r)
+    except Exception as e:
+        logger.error(f"Sagas error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+
+@router.get("/tasks/sagas/{saga_id}")
+async def saga_timeline(saga_id: str, request: Request):
+    try:
+        async with httpx.AsyncClient() as client:
+            r = await client.get(
+                f"{TASK_SERVICE_URL}/tasks/sagas/{saga_id}",
+                headers=forward_headers(request)
+            )
+        return await proxy_response(r)
+    except Exception as e:
+        logger.error(f"Saga timeline error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+
+@router.get("/tasks/stats")
+async def task_stats(request: Request):
+    try:
+        async with httpx.AsyncClient() as client:
+            r = await client.get(
+                f"{TASK_SERVICE_URL}/tasks/stats",
+                headers=forward_headers(request)
+            )
+        return await proxy_response(r)
+    except Exception as e:
+        logger.error(f"Task stats error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+
+@router.get("/tasks/changes")
+async def task_changes(request: Request):
+    try:
+        async with httpx.AsyncClient() as client:
+            r = await client.get(
+                f"{TASK_SERVICE_URL}/tasks/changes",
+                headers=forward_headers(request),
+                params=dict(request.query_params)
+            )
+        return await proxy_response(r)
+    except Exception as e:
+        logger.error(f"Task changes error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+
+@router.get("/tasks/export")
+async def export_tasks(request: Request):
+    # Se reenvía en streaming: el gateway no acumula la exportación en memoria
+    client = httpx.AsyncClient(timeout=None)
+    try:
+        r = await client.send(
+            client.build_request(
+                "GET",
+                f"{TASK_SERVICE_URL}/tasks/export",
+                headers=forward_headers(request),
+                params=dict(request.query_params)
+            ),
+            stream=True
+        )
+    except Exception as e:
+        await client.aclose()
+        logger.error(f"Task export error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+    async def close():
+        await r.aclose()
+        await client.aclose()
+
+    headers = {
+        name: r.headers[name] for name in ("content-disposition",) if name in r.headers
+    }
+    return StreamingResponse(
+        r.aiter_raw(),
+        status_code=r.status_code,
+        media_type=r.headers.get("content-type"),
+        headers=headers,
+        background=BackgroundTask(close)
+    )
+
+
+@router.post("/tasks/import")
+async def import_tasks(request: Request):
+    try:
+        headers = forward_headers(request)
+        headers["Content-Type"] = request.headers.get("content-type", "application/x-ndjson")
+        async with httpx.AsyncClient(timeout=None) as client:
+            r = await client.post(
+                f"{TASK_SERVICE_URL}/tasks/import",
+                headers=headers,
+                params=dict(request.query_params),
+                content=request.stream()
+            )
+        return await proxy_response(r)
+    except Exception as e:
+        logger.error(f"Task import error: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"detail": f"Gateway error: {str(e)}"}
+        )
+
+
 @router.get("/tasks/{task_id}")
 async def get_task(task_id: int, request: Request):
     try:
@@ -187,18 +389,69 @@ async def task_detail(task_id: int, request: Request):
 
 @router.post("/tasks/events")
 async def task_events(request: Request):
+    """
+    Reenvía un evento JSON o un lote NDJSON tal como llega, en streaming,
+    con un cliente compartido en lugar de abrir una conexión por petición
+    """
     try:
-        body = await request.json()
-        async with httpx.AsyncClient() as client:
-            r = await client.post(
-                f"{TASK_SERVICE_URL}/tasks/events",
-                headers=forward_headers(request),
-                json=body
-            )
+        headers = forward_headers(request)
+        headers["Content-Type"] = request.headers.get("content-type", "application/json")
+        r = await get_events_client().post(
+            f"{TASK_SERVICE_URL}/tasks/events",
+            headers=headers,
+            content=request.stream()
+        )
         return await proxy_response(r)
     except Exception as e:
         logger.error(f"Task events error: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"detail": f"Gateway error: {str(e)}"}
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/events/stream")
+async def events_stream(request: Request, token: str = None):
+    """
+    Server-Sent Events: cambios de tareas y transiciones de saga del usuario
+    EventSource no permite cabeceras, así que el token también se acepta por query
+    """
+    authorization = request.headers.get("authorization")
+    if authorization:
+        try:
+            token = authorization.split()[1]
+        except IndexError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Missing token")
+
+    user_id = decode_user_id(token)
+    logger.info(f"Event stream opened for user {user_id}")
+
+    return StreamingResponse(
+        stream_events(event_hub, user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/monitor/consumers")
+async def monitor_consumers(user_id: str = Depends(validate_token)):
+    """
+    Estado de los consumidores de RabbitMQ (profundidad de cola, consumidores,
+    mensajes/s, latencias y unacked) según el /health de cada servicio
+    """
+    async def consumer(name: str, url: str):
+        try:
+            r = await get_events_client().get(f"{url}/health", timeout=5.0)
+            r.raise_for_status()
+            return name, r.json().get("consumer")
+        except Exception as e:
+            logger.warning(f"Health of {name} unavailable: {str(e)}")
+            return name, None
+
+    results = await asyncio.gather(
+        consumer("task_service", TASK_SERVICE_URL),
+        consumer("notification_service", NOTIFICATION_SERVICE_URL)
+    )
+    return dict(results)
@@ -15,3 +15,16 @@ def validate_token(authorization: str = Header(None)):
         return payload.get("sub")
     except (JWTError, ValueError):
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def decode_user_id(token: str) -> str:
+    """Valida un JWT y devuelve su user_id (claim sub)"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return str(user_id)
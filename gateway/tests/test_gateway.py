@@ -10,3 +10,57 @@ def test_health_check():
     # Verify Tracing: X-Request-ID header should be present
     assert "X-Request-ID" in response.headers
     assert len(response.headers["X-Request-ID"]) > 0
+
+def test_event_stream_requires_token():
+    response = client.get("/events/stream")
+    assert response.status_code == 401
+
+def test_event_hub_routes_events_per_user():
+    import asyncio
+    from app.event_stream import EventHub
+
+    async def scenario():
+        hub = EventHub(queue_size=2)
+        alice = hub.subscribe("1")
+        bob = hub.subscribe("2")
+
+        hub.publish({"type": "task_updated", "payload": {"user_id": 1, "task_id": 10}})
+        assert alice.get_nowait()["payload"]["task_id"] == 10
+        assert bob.empty()
+
+        # Un cliente lento recibe un único evento de resync en lugar de bloquear el fan-out
+        for task_id in range(3):
+            hub.publish({"type": "task_updated", "payload": {"user_id": 2, "task_id": task_id}})
+        assert bob.get_nowait()["type"] == "resync"
+
+        hub.unsubscribe("1", alice)
+        hub.unsubscribe("2", bob)
+        assert hub.connection_count() == 0
+
+    asyncio.run(scenario())
+
+def test_task_list_is_enriched_with_one_user_lookup():
+    from unittest.mock import AsyncMock, MagicMock, patch
+
+    tasks_response = MagicMock(status_code=200)
+    tasks_response.json.return_value = [
+        {"id": 1, "user_id": 7}, {"id": 2, "user_id": 8}, {"id": 3, "user_id": 7}
+    ]
+    users_response = MagicMock(status_code=200)
+    users_response.json.return_value = [{"id": 7, "name": "Ana"}, {"id": 8, "name": "Luis"}]
+
+    http = MagicMock()
+    http.request = AsyncMock(return_value=tasks_response)
+    shared = MagicMock()
+    shared.post = AsyncMock(return_value=users_response)
+    with patch("app.router.httpx.AsyncClient") as MockClient, \
+            patch("app.router.get_events_client", return_value=shared):
+        MockClient.return_value.__aenter__.return_value = http
+        response = client.get("/tasks/?include=users&status=todo")
+
+    assert response.status_code == 200
+    assert [task["user"]["name"] for task in response.json()] == ["Ana", "Luis", "Ana"]
+    # El lookup usa el cliente compartido, no uno nuevo por petición
+    assert shared.post.await_count == 1 and not http.post.called
+    assert shared.post.call_args.kwargs["json"] == {"ids": [7, 8]}
+    assert http.request.call_args.kwargs["params"] == {"status": "todo"}
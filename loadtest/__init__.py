@@ -0,0 +1 @@
+"""Prueba de carga de punta a punta con los servicios en proceso (ver loadtest.run)"""
@@ -0,0 +1,266 @@
+"""
+Broker en memoria con la semántica de RabbitMQ que usan los servicios
+- exchanges topic: routing keys con * y #
+- publish con mandatory: False si ninguna cola está vinculada
+- ACK al terminar el callback; una excepción devuelve el mensaje a la cola
+- consumo mensaje a mensaje o en micro-lotes (batch_size / batch_timeout)
+"""
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# Espera antes de reintentar un mensaje rechazado (evita un bucle en caliente)
+REDELIVERY_DELAY_SECONDS = 0.05
+
+
+def topic_matches(binding_key: str, routing_key: str) -> bool:
+    """¿La routing key coincide con el binding topic? (* = una palabra, # = cero o más)"""
+    def match(pattern: list, words: list) -> bool:
+        if not pattern:
+            return not words
+        head, rest = pattern[0], pattern[1:]
+        if head == "#":
+            return any(match(rest, words[index:]) for index in range(len(words) + 1))
+        return bool(words) and head in ("*", words[0]) and match(rest, words[1:])
+
+    return match(binding_key.split("."), routing_key.split("."))
+
+
+class MemoryQueue:
+    """Cola con mensajes listos y contador de entregados sin confirmar"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ready = deque()
+        self.unacked = 0
+        self.consumers = 0
+        self.condition = Condition()
+
+    def put(self, message: dict):
+        with self.condition:
+            self.ready.append(message)
+            self.condition.notify()
+
+    def take(self, batch_size: int, batch_timeout: float, stop: Event) -> list:
+        """Hasta batch_size mensajes; con el primero empieza a correr batch_timeout"""
+        with self.condition:
+            while not self.ready:
+                if stop.is_set():
+                    return []
+                self.condition.wait(0.1)
+            batch = [self.ready.popleft()]
+            deadline = time.monotonic() + batch_timeout
+            while len(batch) < batch_size:
+                if not self.ready:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or stop.is_set():
+                        break
+                    self.condition.wait(remaining)
+                    continue
+                batch.append(self.ready.popleft())
+            self.unacked += len(batch)
+            return batch
+
+    def settle(self, messages: list, requeue: bool):
+        with self.condition:
+            self.unacked -= len(messages)
+            if requeue:
+                self.ready.extendleft(reversed(messages))
+                self.condition.notify()
+
+
+class InMemoryBroker:
+    """
+    Exchanges topic, colas y consumidores en threads del mismo proceso
+    Los observadores reciben cada publicación y cada lote confirmado:
+    con eso se mide la latencia de las sagas sin tocar los servicios
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.bindings = []  # (exchange, routing key, cola)
+        self.published = 0
+        self.unroutable = 0
+        self._observers = []
+        self._threads = []
+        self._stop = Event()
+        self._lock = Lock()
+
+    # ========== Topología ==========
+    def declare_queue(self, queue_name: str) -> MemoryQueue:
+        with self._lock:
+            if queue_name not in self.queues:
+                self.queues[queue_name] = MemoryQueue(queue_name)
+            return self.queues[queue_name]
+
+    def bind(self, queue_name: str, exchange: str, routing_key: str):
+        self.declare_queue(queue_name)
+        with self._lock:
+            if (exchange, routing_key, queue_name) not in self.bindings:
+                self.bindings.append((exchange, routing_key, queue_name))
+
+    # ========== Publicación ==========
+    def publish(self, exchange: str, routing_key: str, message: dict) -> bool:
+        """Encola una copia del mensaje en cada cola vinculada (False si no hay ninguna)"""
+        with self._lock:
+            targets = list(dict.fromkeys(
+                queue for bound_exchange, key, queue in self.bindings
+                if bound_exchange == exchange and topic_matches(key, routing_key)
+            ))
+        # Igual que el broker real: cada cola recibe el mensaje serializado
+        body = json.dumps(message)
+        for observer in self._observers:
+            observer.on_publish(exchange, routing_key, message)
+        if not targets:
+            self.unroutable += 1
+            return False
+        self.published += 1
+        for queue in targets:
+            self.queues[queue].put(json.loads(body))
+        return True
+
+    # ========== Consumo ==========
+    def consume(
+        self,
+        queue_name: str,
+        callback,
+        routing_keys: list = None,
+        batch_size: int = 1,
+        batch_timeout: float = 0.0,
+        metrics=None
+    ) -> Thread:
+        """
+        Consumidor en un thread: callback(mensaje) o, con batch_size > 1,
+        callback(lista); metrics es el ConsumerMetrics del servicio
+        """
+        queue = self.declare_queue(queue_name)
+        for exchange, key in routing_keys or []:
+            self.bind(queue_name, exchange, key)
+
+        def run():
+            queue.consumers += 1
+            try:
+                while not self._stop.is_set():
+                    messages = queue.take(batch_size, batch_timeout, self._stop)
+                    if not messages:
+                        continue
+                    if metrics is not None:
+                        metrics.received(len(messages))
+                    started = time.perf_counter()
+                    try:
+                        callback(messages if batch_size > 1 else messages[0])
+                    except Exception as e:
+                        logger.error(f"💥 Error processing {len(messages)} messages from {queue_name}: {str(e)}")
+                        queue.settle(messages, requeue=True)
+                        if metrics is not None:
+                            metrics.settled(len(messages), time.perf_counter() - started, ok=False)
+                        self._stop.wait(REDELIVERY_DELAY_SECONDS)
+                        continue
+                    queue.settle(messages, requeue=False)
+                    if metrics is not None:
+                        metrics.settled(len(messages), time.perf_counter() - started)
+                    for observer in self._observers:
+                        observer.on_ack(queue_name, messages)
+            finally:
+                queue.consumers -= 1
+
+        thread = Thread(target=run, name=f"consumer-{queue_name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def observe(self, observer):
+        """observer.on_publish(exchange, routing_key, message) y observer.on_ack(cola, mensajes)"""
+        self._observers.append(observer)
+
+    def queue_state(self, queue_name: str) -> dict:
+        queue = self.queues.get(queue_name)
+        if queue is None:
+            return {"depth": None, "consumers": None, "error": f"queue {queue_name} not found"}
+        return {"depth": len(queue.ready), "consumers": queue.consumers}
+
+    def pending(self) -> int:
+        """Mensajes listos o en proceso en todas las colas"""
+        return sum(len(queue.ready) + queue.unacked for queue in self.queues.values())
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+class MemoryConnection:
+    """Lo único que los servicios leen de la conexión de pika"""
+    is_closed = False
+
+
+class InMemoryRabbitMQClient:
+    """
+    Reemplazo de RabbitMQClient (mismos métodos y atributos) sobre InMemoryBroker
+    metrics_factory es la clase ConsumerMetrics del servicio que lo usa
+    """
+
+    def __init__(self, broker: InMemoryBroker, metrics_factory, rabbitmq_url: str = "memory://"):
+        self.broker = broker
+        self.metrics_factory = metrics_factory
+        self.rabbitmq_url = rabbitmq_url
+        self.connection = None
+        self.channel = None
+        self.is_consuming = False
+        self.metrics = {}
+
+    def connect(self, max_retries: int = 5, retry_delay: int = 5):
+        self.connection = MemoryConnection()
+        return True
+
+    def publish(self, exchange: str, routing_key: str, message: dict) -> bool:
+        if not message.get("message_id"):
+            message["message_id"] = uuid.uuid4().hex
+        return self.broker.publish(exchange, routing_key, message)
+
+    def consumer_metrics(self, queue_name: str):
+        if queue_name not in self.metrics:
+            self.metrics[queue_name] = self.metrics_factory(queue_name)
+        return self.metrics[queue_name]
+
+    def start_consuming_background(self, queue_name: str, callback, routing_keys: list = None):
+        self.broker.consume(queue_name, callback, routing_keys, metrics=self.consumer_metrics(queue_name))
+        self.is_consuming = True
+
+    def start_batch_consuming_background(
+        self,
+        queue_name: str,
+        callback,
+        routing_keys: list = None,
+        batch_size: int = 50,
+        batch_timeout: float = 0.2
+    ):
+        self.broker.consume(
+            queue_name, callback, routing_keys, batch_size, batch_timeout,
+            metrics=self.consumer_metrics(queue_name)
+        )
+        self.is_consuming = True
+
+    def stop_consuming(self):
+        self.is_consuming = False
+
+    def close(self):
+        self.is_consuming = False
+
+
+class InMemoryQueueProbe:
+    """Reemplazo de QueueProbe: la profundidad sale del broker en memoria"""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+
+    def queue_state(self, queue_name: str) -> dict:
+        return self.broker.queue_state(queue_name)
+
+    def close(self):
+        pass
@@ -0,0 +1,81 @@
+"""
+Compara dos resultados de loadtest.run (por ejemplo, de dos commits)
+
+    python -m loadtest.compare loadtest/results/antes.json loadtest/results/despues.json --threshold 10
+
+Muestra req/s y p50/p95/p99 por ruta y de las sagas con la variación en %
+Con --threshold retorna 1 si algún p95 empeora más de ese porcentaje
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+METRICS = ["requests_per_second", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def change(before, after) -> float:
+    """Variación porcentual (None si no hay base)"""
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(before: dict, after: dict) -> dict:
+    """{fila: {métrica: (antes, después, %)}} para cada ruta y las sagas"""
+    rows = {}
+    for route in dict.fromkeys([*before["routes"], *after["routes"]]):
+        old, new = before["routes"].get(route, {}), after["routes"].get(route, {})
+        rows[route] = {metric: (old.get(metric), new.get(metric), change(old.get(metric), new.get(metric))) for metric in METRICS}
+    rows["saga completion"] = {
+        metric: (before["sagas"].get(metric), after["sagas"].get(metric), change(before["sagas"].get(metric), after["sagas"].get(metric)))
+        for metric in METRICS[1:]
+    }
+    return rows
+
+
+def regressions(rows: dict, threshold: float) -> list:
+    """Filas cuyo p95 empeoró más de threshold %"""
+    return [row for row, metrics in rows.items() if (metrics["p95_ms"][2] or 0) > threshold]
+
+
+def describe(result: dict) -> str:
+    meta = result["meta"]
+    config = meta["config"]
+    commit = (meta.get("commit") or "unknown")[:8] + (" (dirty)" if meta.get("dirty") else "")
+    return f"{commit} {meta['timestamp']} | {config['users']} users, {config['duration_s']}s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two load test results")
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument("--threshold", type=float, default=None, help="% de empeora del p95 que hace fallar")
+    args = parser.parse_args(argv)
+
+    before, after = json.loads(args.before.read_text()), json.loads(args.after.read_text())
+    if before["meta"]["config"] != after["meta"]["config"]:
+        print("⚠️ The runs used different configurations: compare with care", file=sys.stderr)
+
+    print(f"before: {describe(before)}")
+    print(f"after:  {describe(after)}\n")
+    print(f"{'':<18}" + "".join(f"{metric:>30}" for metric in METRICS))
+    rows = compare(before, after)
+    for row, metrics in rows.items():
+        cells = []
+        for metric in METRICS:
+            old, new, delta = metrics.get(metric, (None, None, None))
+            cells.append(f"{old if old is not None else '-':>10} -> {new if new is not None else '-':<9}"
+                         f"{f'{delta:+.1f}%' if delta is not None else '':>7}")
+        print(f"{row:<18}" + "".join(f"{cell:>30}" for cell in cells))
+
+    if args.threshold is not None:
+        failed = regressions(rows, args.threshold)
+        if failed:
+            print(f"\n❌ p95 regressed more than {args.threshold}%: {', '.join(failed)}")
+            sys.exit(1)
+        print(f"\n✅ No p95 regression above {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
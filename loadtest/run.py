@@ -0,0 +1,374 @@
+"""
+Prueba de carga de punta a punta: gateway -> auth / task -> broker -> notification -> task
+
+    python -m loadtest.run --users 20 --duration 60 --mix login=1,list=5,create=2,update=2,delete=1
+
+Usuarios virtuales en lazo cerrado (cada uno espera su respuesta antes de la
+siguiente petición) contra el gateway, con los cuatro servicios en el mismo
+proceso (ver loadtest.services). Reporta throughput y p50/p95/p99 por ruta y
+la latencia de las sagas de creación, y guarda el resultado en JSON para
+compararlo entre commits con python -m loadtest.compare
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .services import BASE_ENV, ROOT, ServiceStack
+
+RESULTS_DIR = ROOT / "loadtest" / "results"
+
+DEFAULT_MIX = "login=1,list=5,create=2,update=2,delete=1"
+
+ROUTES = {
+    "login": "POST /login",
+    "list": "GET /tasks/",
+    "create": "POST /tasks/",
+    "update": "PUT /tasks/{id}",
+    "delete": "DELETE /tasks/{id}"
+}
+
+STATUSES = ["todo", "doing", "done"]
+CATEGORIES = ["Frontend", "Backend", "Full Stack", "Product Owner", "Scrum", "Mixto", "QA"]
+PRIORITIES = ["Alta", "Media", "Baja"]
+
+PASSWORD = "load-password"
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def latency_summary(latencies_ms: list) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies_ms, 0.50), 2),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 2),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 2),
+        "max_ms": round(max(latencies_ms, default=0.0), 2),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 2) if latencies_ms else 0.0
+    }
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}' (expected {', '.join(ROUTES)})")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs at least one operation with weight > 0")
+    return mix
+
+
+def parse_env(values: list) -> dict:
+    env = {}
+    for value in values:
+        key, separator, setting = value.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"--env expects KEY=VALUE, got '{value}'")
+        env[key] = setting
+    return env
+
+
+# ========== Métricas ==========
+class RouteStats:
+    """Latencias y códigos de una ruta; los errores son excepciones y respuestas 5xx"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def record(self, latency_ms: float, status):
+        self.latencies_ms.append(latency_ms)
+        self.statuses[str(status)] += 1
+        if status == "exception" or status >= 500:
+            self.errors += 1
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "count": len(self.latencies_ms),
+            "errors": self.errors,
+            "statuses": dict(sorted(self.statuses.items())),
+            "requests_per_second": round(len(self.latencies_ms) / elapsed, 2) if elapsed else 0.0,
+            **latency_summary(self.latencies_ms)
+        }
+
+
+class SagaTracker:
+    """
+    Observador del broker: una saga empieza cuando se publica su task.created
+    y termina cuando el Task Service confirma (ACK) el resultado de la
+    notificación, ya aplicado en la DB (notification_sent o compensación)
+    Se identifican por task_id (los resultados agrupados traen payload.items)
+    """
+
+    RESULTS_QUEUE = "task_service_notifications"
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = {}
+        self.completed_ms = []
+        self.compensated_ms = []
+
+    def on_publish(self, exchange: str, routing_key: str, message: dict):
+        if exchange == "task_events" and routing_key == "task.created":
+            self.started.setdefault(message.get("payload", {}).get("task_id"), self.clock())
+
+    def on_ack(self, queue_name: str, messages: list):
+        if queue_name != self.RESULTS_QUEUE:
+            return
+        now = self.clock()
+        for message in messages:
+            payload = message.get("payload", {})
+            for item in payload.get("items", [payload]):
+                started = self.started.pop(item.get("task_id"), None)
+                if started is None:
+                    continue  # resultado repetido
+                latencies = self.completed_ms if message.get("type") == "notification_sent" else self.compensated_ms
+                latencies.append((now - started) * 1000)
+
+    def report(self) -> dict:
+        finished = self.completed_ms + self.compensated_ms
+        return {
+            "started": len(finished) + len(self.started),
+            "completed": len(self.completed_ms),
+            "compensated": len(self.compensated_ms),
+            "pending": len(self.started),
+            **latency_summary(finished),
+            "completed_latency": latency_summary(self.completed_ms),
+            "compensated_latency": latency_summary(self.compensated_ms)
+        }
+
+
+# ========== Usuarios virtuales ==========
+class VirtualUser:
+    """Un usuario con su token y las tareas que conoce, eligiendo operaciones según el mix"""
+
+    def __init__(self, number: int, client, stats: dict, mix: dict, seed, run_id: str):
+        self.client = client
+        self.stats = stats
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.rng = random.Random(f"{seed}:{number}" if seed is not None else None)
+        self.email = f"load-{run_id}-{number}@loadtest.local"
+        self.headers = {}
+        self.task_ids = []
+        self.operations_by_name = {
+            "login": self.login,
+            "list": self.list_tasks,
+            "create": self.create_task,
+            "update": self.update_task,
+            "delete": self.delete_task
+        }
+
+    async def setup(self):
+        """Registro e inicio de sesión inicial (fuera de la medición)"""
+        r = await self.client.post("/register", json={"email": self.email, "password": PASSWORD, "name": "Load"})
+        if r.status_code >= 400:
+            raise RuntimeError(f"Register failed for {self.email}: {r.status_code} {r.text}")
+        r = await self.client.post("/login", json={"email": self.email, "password": PASSWORD})
+        if r.status_code != 200:
+            raise RuntimeError(f"Login failed for {self.email}: {r.status_code} {r.text}")
+        self.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    async def request(self, operation: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            r = await self.client.request(method, url, **kwargs)
+        except Exception:
+            self.stats[operation].record((time.perf_counter() - started) * 1000, "exception")
+            return None
+        self.stats[operation].record((time.perf_counter() - started) * 1000, r.status_code)
+        return r
+
+    async def run(self, deadline: float, think_time: float):
+        while time.perf_counter() < deadline:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            # Sin tareas conocidas, editar o borrar empieza por crear una
+            if operation in ("update", "delete") and not self.task_ids:
+                operation = "create"
+            await self.operations_by_name[operation]()
+            if think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / think_time))
+
+    async def login(self):
+        r = await self.request("login", "POST", "/login", json={"email": self.email, "password": PASSWORD})
+        if r is not None and r.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    async def list_tasks(self):
+        filters = {
+            "status": self.rng.choice(STATUSES),
+            "category": self.rng.choice(CATEGORIES),
+            "priority": self.rng.choice(PRIORITIES),
+            "search": "Load"
+        }
+        params = dict(self.rng.sample(sorted(filters.items()), self.rng.randint(0, 2)))
+        r = await self.request("list", "GET", "/tasks/", headers=self.headers, params=params)
+        if r is not None and r.status_code == 200 and not params:
+            # Sin filtros la respuesta trae todas sus tareas (las compensadas ya no están)
+            self.task_ids = [task["id"] for task in r.json()]
+
+    async def create_task(self):
+        body = {
+            "title": f"Load task {self.rng.randrange(1_000_000)}",
+            "description": "Created by the load test",
+            "category": self.rng.choice(CATEGORIES),
+            "priority": self.rng.choice(PRIORITIES)
+        }
+        r = await self.request("create", "POST", "/tasks/", headers=self.headers, json=body)
+        if r is not None and r.status_code < 300:
+            self.task_ids.append(r.json()["id"])
+
+    async def update_task(self):
+        task_id = self.rng.choice(self.task_ids)
+        body = {"status": self.rng.choice(STATUSES), "priority": self.rng.choice(PRIORITIES)}
+        r = await self.request("update", "PUT", f"/tasks/{task_id}", headers=self.headers, json=body)
+        if r is not None and r.status_code == 404:
+            # Compensada por la saga o borrada
+            self.task_ids.remove(task_id)
+
+    async def delete_task(self):
+        task_id = self.task_ids.pop(self.rng.randrange(len(self.task_ids)))
+        await self.request("delete", "DELETE", f"/tasks/{task_id}", headers=self.headers)
+
+
+# ========== Ejecución ==========
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return ""
+
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+async def drain(stack: ServiceStack, tracker: SagaTracker, timeout: float) -> float:
+    """Espera a que el broker se vacíe y no queden sagas abiertas; retorna lo que tardó"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if not stack.broker.pending() and not tracker.started:
+            break
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def run_load(args) -> dict:
+    env = parse_env(args.env)
+    run_id = f"{int(time.time())}{random.randrange(1000):03d}"
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        stack = ServiceStack(Path(workdir), env=env, failure_rate=args.failure_rate)
+        tracker = SagaTracker()
+        stack.broker.observe(tracker)
+        stats = {operation: RouteStats() for operation in ROUTES}
+
+        async with stack:
+            async with stack.client(timeout=args.timeout) as client:
+                users = [VirtualUser(number, client, stats, args.mix, args.seed, run_id) for number in range(args.users)]
+                await asyncio.gather(*(user.setup() for user in users))
+
+                print(f"🚀 {args.users} users for {args.duration}s | mix {args.mix}", file=sys.stderr)
+                started = time.perf_counter()
+                await asyncio.gather(*(user.run(started + args.duration, args.think_time) for user in users))
+                elapsed = time.perf_counter() - started
+
+                drained = await drain(stack, tracker, args.drain)
+                consumers = stack.consumers()
+
+    total = sum(len(route.latencies_ms) for route in stats.values())
+    return {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "users": args.users,
+                "duration_s": args.duration,
+                "think_time_s": args.think_time,
+                "mix": args.mix,
+                "seed": args.seed,
+                "failure_rate": stack.notification.FAILURE_RATE,
+                "env": stack.env
+            }
+        },
+        "totals": {
+            "requests": total,
+            "errors": sum(route.errors for route in stats.values()),
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_second": round(total / elapsed, 2),
+            "drain_s": round(drained, 3)
+        },
+        "routes": {ROUTES[operation]: route.report(elapsed) for operation, route in stats.items() if route.latencies_ms},
+        "sagas": tracker.report(),
+        "broker": {"published": stack.broker.published, "unroutable": stack.broker.unroutable},
+        "consumers": consumers
+    }
+
+
+def print_report(result: dict):
+    totals = result["totals"]
+    print(f"\n{'route':<18} {'count':>7} {'err':>5} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, report in result["routes"].items():
+        print(
+            f"{route:<18} {report['count']:>7} {report['errors']:>5} {report['requests_per_second']:>8} "
+            f"{report['p50_ms']:>7}ms {report['p95_ms']:>7}ms {report['p99_ms']:>7}ms"
+        )
+    print(f"{'total':<18} {totals['requests']:>7} {totals['errors']:>5} {totals['requests_per_second']:>8}")
+
+    sagas = result["sagas"]
+    print(
+        f"\nsagas: {sagas['started']} started, {sagas['completed']} completed, "
+        f"{sagas['compensated']} compensated, {sagas['pending']} pending | "
+        f"p50 {sagas['p50_ms']}ms p95 {sagas['p95_ms']}ms p99 {sagas['p99_ms']}ms"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test of the gateway and the three services")
+    parser.add_argument("--users", type=int, default=10, help="usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga medida")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"pesos por operación ({DEFAULT_MIX})")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pausa media entre peticiones de un usuario (s)")
+    parser.add_argument("--seed", type=int, default=None, help="semilla de las decisiones de los usuarios")
+    parser.add_argument("--failure-rate", type=float, default=None, help="FAILURE_RATE del Notification Service")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help=f"configuración de los servicios (por defecto {', '.join(BASE_ENV)})")
+    parser.add_argument("--timeout", type=float, default=30, help="timeout de cada petición (s)")
+    parser.add_argument("--drain", type=float, default=30, help="máximo a esperar que terminen las sagas (s)")
+    parser.add_argument("--output", type=Path, default=None, help=f"archivo JSON (por defecto en {RESULTS_DIR})")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    # Antes de importar los servicios: su logging.basicConfig ya no tiene efecto
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    result = asyncio.run(run_load(args))
+    print_report(result)
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{(result['meta']['commit'] or 'nogit')[:8]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\n💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Los cuatro servicios en un solo proceso, sin Docker
+- cada paquete app se importa con un alias propio (auth_app, task_app, ...)
+  para que convivan; notification_service conserva "app" porque sus
+  módulos se importan con rutas absolutas (from app.x import ...)
+- PostgreSQL -> SQLite en un directorio temporal
+- RabbitMQ -> InMemoryBroker
+- HTTP entre servicios -> httpx.ASGITransport por nombre de host
+"""
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import types
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+
+from .broker import InMemoryBroker, InMemoryQueueProbe, InMemoryRabbitMQClient
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Servicio -> alias de su paquete app
+PACKAGES = {
+    "auth_service": "auth_app",
+    "task_service": "task_app",
+    "notification_service": "app",
+    "gateway": "gateway_app"
+}
+
+# Configuración común (los valores de --env la reemplazan)
+BASE_ENV = {
+    # Un pool de procesos "spawn" no puede importar los alias: bcrypt en el hilo
+    "HASH_POOL_WORKERS": "0",
+    "BCRYPT_ROUNDS": "4",
+    # Todos los usuarios virtuales entran desde la misma IP
+    "LOGIN_MAX_ATTEMPTS_PER_IP": "1000000000",
+    # El stream SSE del gateway y el mantenimiento de particiones hablan con
+    # RabbitMQ / PostgreSQL directamente
+    "EVENT_STREAM_ENABLED": "false",
+    "SAGA_LOG_MAINTENANCE_ENABLED": "false",
+    "TASK_ARCHIVE_ENABLED": "false",
+    "RABBITMQ_URL": "memory://"
+}
+
+
+def load_package(alias: str, directory: Path):
+    """Registra el directorio app de un servicio como paquete con otro nombre"""
+    spec = importlib.machinery.ModuleSpec(alias, None, is_package=True)
+    spec.submodule_search_locations = [str(directory)]
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[alias] = package
+    return package
+
+
+def import_service(service: str, env: dict):
+    """Importa <alias>.main con env aplicado (los servicios leen su configuración al importarse)"""
+    alias = PACKAGES[service]
+    if alias in sys.modules:
+        raise RuntimeError(f"Package {alias} is already imported: run the load test in a fresh process")
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    try:
+        load_package(alias, ROOT / service / "app")
+        return importlib.import_module(f"{alias}.main")
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+class ServiceTransport(httpx.AsyncBaseTransport):
+    """Transporte del gateway: cada host de servicio va a su app ASGI"""
+
+    def __init__(self, apps: dict):
+        self.transports = {host: httpx.ASGITransport(app=app) for host, app in apps.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        transport = self.transports.get(request.url.host)
+        if transport is None:
+            raise httpx.ConnectError(f"Unknown service host: {request.url.host}", request=request)
+        return await transport.handle_async_request(request)
+
+
+def routed_httpx(transport: httpx.AsyncBaseTransport) -> types.ModuleType:
+    """Copia del módulo httpx cuyo AsyncClient usa transport por defecto"""
+    module = types.ModuleType("httpx")
+    module.__dict__.update(vars(httpx))
+
+    class AsyncClient(httpx.AsyncClient):
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault("transport", transport)
+            super().__init__(*args, **kwargs)
+
+    module.AsyncClient = AsyncClient
+    return module
+
+
+class MemoryCacheInvalidation:
+    """Reemplazo de CacheInvalidationListener: las invalidaciones llegan por el broker en memoria"""
+
+    def __init__(self, broker: InMemoryBroker, cache, bindings: list):
+        self.broker = broker
+        self.cache = cache
+        self.bindings = bindings
+
+    def start_background(self):
+        def on_message(message: dict):
+            try:
+                self.cache.handle_event(message)
+            except ValueError:
+                return
+
+        self.broker.consume("task_cache_invalidation", on_message, self.bindings)
+
+    def stop(self):
+        pass
+
+
+class ServiceStack:
+    """
+    Gateway + auth + task + notification sobre SQLite y el broker en memoria
+
+        async with ServiceStack(workdir) as stack:
+            async with stack.client() as client:  # contra el gateway
+                ...
+    """
+
+    def __init__(self, workdir: Path, env: dict = None, failure_rate: float = None):
+        self.workdir = Path(workdir)
+        self.broker = InMemoryBroker()
+        env = dict(BASE_ENV, **(env or {}))
+        self.env = env
+
+        self.auth = import_service("auth_service", dict(env, DATABASE_URL=f"sqlite:///{self.workdir / 'auth.db'}"))
+        self.task = import_service("task_service", dict(env, DATABASE_URL=f"sqlite:///{self.workdir / 'task.db'}"))
+        self.notification = import_service("notification_service", env)
+        self.gateway = import_service("gateway", env)
+
+        # Task Service: el singleton de RabbitMQ, la sonda de la cola y las invalidaciones del cache
+        task_rabbitmq = sys.modules["task_app.rabbitmq_client"]
+        task_metrics = sys.modules["task_app.consumer_metrics"].ConsumerMetrics
+        task_rabbitmq._rabbitmq_client = InMemoryRabbitMQClient(self.broker, task_metrics)
+        task_rabbitmq._rabbitmq_client.connect()
+        self.task.QueueProbe = lambda url: InMemoryQueueProbe(self.broker)
+        task_cache = sys.modules["task_app.cache"]
+        self.task.cache_invalidation = MemoryCacheInvalidation(
+            self.broker, task_cache.get_task_cache(), task_cache.INVALIDATION_BINDINGS
+        )
+
+        # Notification Service: crea su propio cliente al arrancar
+        notification_metrics = sys.modules["app.consumer_metrics"].ConsumerMetrics
+        self.notification.RabbitMQClient = lambda: InMemoryRabbitMQClient(self.broker, notification_metrics)
+        self.notification.QueueProbe = lambda url: InMemoryQueueProbe(self.broker)
+        if failure_rate is not None:
+            self.notification.FAILURE_RATE = failure_rate
+
+        # Gateway: las URLs http://<servicio>:8000 se resuelven en proceso
+        gateway_router = sys.modules["gateway_app.router"]
+        gateway_router.httpx = routed_httpx(ServiceTransport({
+            "auth_service": self.auth.app,
+            "task_service": self.task.app,
+            "notification_service": self.notification.app
+        }))
+
+    async def __aenter__(self):
+        """Ejecuta el startup de las cuatro apps (httpx.ASGITransport no lo hace)"""
+        self._lifespans = AsyncExitStack()
+        for app in [self.auth.app, self.task.app, self.notification.app, self.gateway.app]:
+            await self._lifespans.enter_async_context(app.router.lifespan_context(app))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            await self._lifespans.aclose()
+        finally:
+            self.broker.stop()
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        """Cliente contra el gateway, como el frontend"""
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.gateway.app),
+            base_url="http://gateway",
+            **kwargs
+        )
+
+    def consumers(self) -> dict:
+        """Snapshot de las métricas de consumo que cada servicio expone en /health"""
+        task_client = sys.modules["task_app.rabbitmq_client"]._rabbitmq_client
+        notification_client = self.notification.rabbitmq_client
+        return {
+            "task_service": {name: metrics.snapshot() for name, metrics in task_client.metrics.items()},
+            "notification_service": {
+                name: metrics.snapshot() for name, metrics in (notification_client.metrics if notification_client else {}).items()
+            }
+        }
@@ -0,0 +1,430 @@
+import asyncio
+import logging
+import os
+import smtplib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from functools import lru_cache, partial
+from string import Formatter
+from threading import Lock
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Canales activos, en orden: inbox, webhook, smtp
+NOTIFICATION_CHANNELS = [
+    name.strip() for name in os.getenv("NOTIFICATION_CHANNELS", "inbox").split(",") if name.strip()
+]
+
+# Canales obligatorios: un digest cuenta como entregado (notification_sent)
+# cuando lo entregaron todos ellos; el resto es best effort y no se espera
+NOTIFICATION_REQUIRED_CHANNELS = [
+    name.strip() for name in os.getenv("NOTIFICATION_REQUIRED_CHANNELS", "inbox").split(",") if name.strip()
+]
+
+INBOX_SIZE = int(os.getenv("INBOX_SIZE", "50"))
+INBOX_MAX_USERS = int(os.getenv("INBOX_MAX_USERS", "10000"))
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+
+# Un servidor SMTP local de pruebas (MailHog en docker-compose) acepta todo sin TLS
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "false").lower() == "true"
+SMTP_FROM = os.getenv("SMTP_FROM", "notifications@taskmanager.local")
+SMTP_RECIPIENT = os.getenv("SMTP_RECIPIENT", "user-{user_id}@taskmanager.local")
+
+# Plantillas por canal; se compilan una vez y se reutilizan
+TEMPLATES = {
+    "inbox": {
+        "body": "{message}"
+    },
+    "webhook": {
+        "subject": "{count} task(s) created",
+        "body": "{message}"
+    },
+    "smtp": {
+        "subject": "[TaskManager] {count} task(s) created",
+        "body": "Hello user {user_id},\n\n{message}\n\nTasks: {tasks}\n"
+    }
+}
+
+
+def channel_setting(channel: str, name: str, default: str) -> str:
+    """Configuración propia de cada canal: SMTP_CONCURRENCY, WEBHOOK_TIMEOUT_SECONDS..."""
+    return os.getenv(f"{channel.upper()}_{name}", default)
+
+
+@lru_cache(maxsize=256)
+def compile_template(text: str):
+    """
+    Compila una plantilla con campos {nombre} a una lista de partes
+    El texto se analiza una sola vez; render solo concatena
+    """
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(text):
+        parts.append((literal, field, spec or "", conversion))
+
+    def render(context: dict) -> str:
+        out = []
+        for literal, field, spec, conversion in parts:
+            out.append(literal)
+            if field is not None:
+                value = context[field]
+                if conversion == "r":
+                    value = repr(value)
+                out.append(format(value, spec))
+        return "".join(out)
+
+    return render
+
+
+class ChannelBusy(Exception):
+    """La cola del canal está llena: el digest falla sin esperar"""
+
+
+class Channel:
+    """
+    Canal de entrega con sus propios workers asíncronos
+    - concurrency: workers (entregas simultáneas) del canal
+    - max_pending: digests en cola; pasado el límite se rechaza de inmediato
+    - timeout: tiempo máximo de una entrega, incluida la espera en cola
+    Cada canal tiene su cola: uno lento no retrasa a los demás
+    """
+
+    name = "channel"
+
+    def __init__(self, concurrency: int = None, timeout: float = None, max_pending: int = None):
+        self.concurrency = concurrency or int(channel_setting(self.name, "CONCURRENCY", "4"))
+        self.timeout = timeout or float(channel_setting(self.name, "TIMEOUT_SECONDS", "5"))
+        self.max_pending = max_pending or int(channel_setting(self.name, "MAX_PENDING", "1000"))
+        self.sent = 0
+        self.failed = 0
+        self._queue = None
+        self._workers = []
+
+    def render(self, context: dict) -> dict:
+        """Asunto y cuerpo del digest según las plantillas del canal"""
+        return {
+            part: compile_template(text)(context)
+            for part, text in TEMPLATES.get(self.name, TEMPLATES["inbox"]).items()
+        }
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_pending)
+        await self.open()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.close()
+
+    async def deliver(self, context: dict):
+        """Encola el digest y espera su entrega (lanza excepción si falla)"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((context, future))
+        except asyncio.QueueFull:
+            self.failed += 1
+            raise ChannelBusy(f"{self.name} queue is full ({self._queue.qsize()} pending)")
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.failed += 1
+            raise TimeoutError(f"{self.name} delivery timed out after {self.timeout}s")
+
+    async def _worker(self):
+        while True:
+            context, future = await self._queue.get()
+            try:
+                # Vencido mientras esperaba en la cola: no se envía
+                if future.done():
+                    continue
+                try:
+                    await self.send(context["user_id"], self.render(context))
+                except Exception as e:
+                    # Si ya venció el timeout, deliver contó el fallo
+                    if not future.done():
+                        self.failed += 1
+                        future.set_exception(e)
+                else:
+                    self.sent += 1
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "sent": self.sent,
+            "failed": self.failed
+        }
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send(self, user_id, message: dict):
+        raise NotImplementedError
+
+
+class InboxChannel(Channel):
+    """Bandeja en memoria: los últimos INBOX_SIZE mensajes de cada usuario"""
+
+    name = "inbox"
+
+    def __init__(self, size: int = INBOX_SIZE, max_users: int = INBOX_MAX_USERS, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self.max_users = max_users
+        self._messages = OrderedDict()
+
+    async def send(self, user_id, message: dict):
+        inbox = self._messages.get(user_id)
+        if inbox is None:
+            inbox = self._messages[user_id] = deque(maxlen=self.size)
+        inbox.appendleft(message)
+        self._messages.move_to_end(user_id)
+        while len(self._messages) > self.max_users:
+            self._messages.popitem(last=False)
+
+    def messages(self, user_id) -> list:
+        return list(self._messages.get(user_id, ()))
+
+
+class WebhookChannel(Channel):
+    """POST JSON a WEBHOOK_URL con un cliente HTTP compartido (keep-alive)"""
+
+    name = "webhook"
+
+    def __init__(self, url: str = WEBHOOK_URL, **kwargs):
+        super().__init__(**kwargs)
+        if not url:
+            raise ValueError("WEBHOOK_URL is required for the webhook channel")
+        self.url = url
+        self._client = None
+
+    async def open(self):
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def send(self, user_id, message: dict):
+        response = await self._client.post(self.url, json=dict(message, user_id=user_id))
+        response.raise_for_status()
+
+
+class SmtpChannel(Channel):
+    """
+    Correo por SMTP; smtplib es bloqueante, así que corre en un pool de
+    threads propio del canal (tantos como su concurrencia)
+    Las conexiones se reutilizan entre envíos y se reabren si el servidor las cerró
+    """
+
+    name = "smtp"
+
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        sender: str = SMTP_FROM,
+        recipient: str = SMTP_RECIPIENT,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipient = recipient
+        self._executor = None
+        self._idle = []
+        self._lock = Lock()
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="smtp")
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            connections, self._idle = self._idle, []
+        for connection in connections:
+            self._quit(connection)
+
+    async def send(self, user_id, message: dict):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = compile_template(self.recipient)({"user_id": user_id})
+        email["Subject"] = message.get("subject", "")
+        email.set_content(message["body"])
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._send_blocking, email)
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if SMTP_STARTTLS:
+            connection.starttls()
+        if SMTP_USER:
+            connection.login(SMTP_USER, SMTP_PASSWORD)
+        return connection
+
+    def _send_blocking(self, email: EmailMessage):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        reused = connection is not None
+        if connection is None:
+            connection = self._connect()
+        try:
+            connection.send_message(email)
+        except smtplib.SMTPServerDisconnected:
+            # La conexión reutilizada expiró en el servidor: un reintento con una nueva
+            self._quit(connection)
+            if not reused:
+                raise
+            connection = self._connect()
+            try:
+                connection.send_message(email)
+            except Exception:
+                self._quit(connection)
+                raise
+        except Exception:
+            self._quit(connection)
+            raise
+        with self._lock:
+            self._idle.append(connection)
+
+    @staticmethod
+    def _quit(connection: smtplib.SMTP):
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+
+CHANNEL_TYPES = {
+    "inbox": InboxChannel,
+    "webhook": WebhookChannel,
+    "smtp": SmtpChannel
+}
+
+
+class NotificationDispatcher:
+    """
+    Entrega los digests por todos los canales activos
+    Los canales viven en un event loop propio (thread en background) y el
+    consumidor de RabbitMQ, que es síncrono, espera el resultado del lote
+    Política de fallos:
+    - Canales obligatorios (NOTIFICATION_REQUIRED_CHANNELS, o el primero si
+      ninguno está activo): el consumidor espera su entrega y un fallo es
+      notification_failed
+    - Canales best effort (webhook, smtp...): se encolan sin esperarlos; su
+      fallo solo se registra, así un canal lento no retrasa el lote
+    """
+
+    def __init__(self, channels: list = None, required: list = None):
+        self.channels = channels if channels is not None else [
+            CHANNEL_TYPES[name]() for name in NOTIFICATION_CHANNELS
+        ]
+        required = NOTIFICATION_REQUIRED_CHANNELS if required is None else required
+        self.required = [channel for channel in self.channels if channel.name in required] or self.channels[:1]
+        self.best_effort = [channel for channel in self.channels if channel not in self.required]
+        self._background = set()
+        self._loop = None
+        self._thread = None
+        self._lock = Lock()
+
+    def channel(self, name: str):
+        return next((channel for channel in self.channels if channel.name == name), None)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="notification-channels", daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(self._start_channels(), loop).result()
+            self._loop, self._thread = loop, thread
+            logger.info(f"📬 Notification channels started: {', '.join(c.name for c in self.channels)}")
+            return loop
+
+    async def _start_channels(self):
+        await asyncio.gather(*(channel.start() for channel in self.channels))
+
+    async def _stop_channels(self):
+        await asyncio.gather(*(channel.stop() for channel in self.channels))
+
+    async def _deliver_one(self, context: dict):
+        """None si los canales obligatorios entregaron; si no, el motivo del fallo"""
+        for channel in self.best_effort:
+            task = asyncio.create_task(channel.deliver(context))
+            task.add_done_callback(partial(self._best_effort_done, channel, context["user_id"]))
+            self._background.add(task)
+
+        results = await asyncio.gather(
+            *(channel.deliver(context) for channel in self.required), return_exceptions=True
+        )
+        errors = [
+            f"{channel.name}: {result}"
+            for channel, result in zip(self.required, results)
+            if isinstance(result, BaseException)
+        ]
+        return "; ".join(errors) or None
+
+    def _best_effort_done(self, channel, user_id, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ {channel.name} delivery to user {user_id} failed (best effort): {task.exception()}")
+
+    async def _deliver_all(self, digests: dict) -> dict:
+        reasons = await asyncio.gather(*(self._deliver_one(context) for context in digests.values()))
+        return dict(zip(digests, reasons))
+
+    def deliver(self, digests: dict) -> dict:
+        """
+        digests: {user_id: contexto de plantilla}
+        Retorna {user_id: motivo del fallo o None}; solo espera a los canales obligatorios
+        """
+        if not digests or not self.channels:
+            return {user_id: None for user_id in digests}
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._deliver_all(digests), loop).result()
+
+    def stats(self) -> dict:
+        return {channel.name: channel.stats() for channel in self.channels}
+
+    def shutdown(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop_channels(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout=10)
+
+
+# ========== Singleton Global ==========
+_dispatcher = None
+
+def get_dispatcher() -> NotificationDispatcher:
+    """Obtener la instancia singleton del despachador de notificaciones"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = NotificationDispatcher()
+    return _dispatcher
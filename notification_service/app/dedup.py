@@ -0,0 +1,32 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+
+
+class ProcessedMessageCache:
+    """
+    Dedup store en memoria (LRU acotado) para consumidores idempotentes
+    El Notification Service no tiene base de datos: un duplicado reciente
+    se descarta con una búsqueda en memoria
+    """
+
+    def __init__(self, max_size: int = DEDUP_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, message_id: str) -> bool:
+        with self._lock:
+            if message_id in self._items:
+                self._items.move_to_end(message_id)
+                return True
+            return False
+
+    def add(self, message_id: str):
+        with self._lock:
+            self._items[message_id] = None
+            self._items.move_to_end(message_id)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
@@ -0,0 +1,44 @@
+import os
+import uuid
+from collections import OrderedDict
+
+# Un digest junta los task_created que llegan dentro de la ventana o hasta el máximo
+NOTIFICATION_DIGEST_WINDOW_SECONDS = float(os.getenv("NOTIFICATION_DIGEST_WINDOW_SECONDS", "2"))
+NOTIFICATION_DIGEST_MAX_EVENTS = int(os.getenv("NOTIFICATION_DIGEST_MAX_EVENTS", "100"))
+
+RESULT_ROUTING_KEYS = {
+    "notification_sent": "notification.sent",
+    "notification_failed": "notification.failed"
+}
+
+
+def group_by_user(items: list) -> OrderedDict:
+    """Agrupa los items de saga por usuario, en orden de llegada"""
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(item.get("user_id"), []).append(item)
+    return groups
+
+
+def render_digest(user_id, items: list) -> str:
+    """Texto del digest de un usuario: una línea por tarea creada"""
+    if len(items) == 1:
+        return f"User {user_id} - Task {items[0]['task_id']} created successfully"
+    tasks = ", ".join(str(item["task_id"]) for item in items)
+    return f"User {user_id} - {len(items)} tasks created successfully: {tasks}"
+
+
+def result_message(event_type: str, items: list) -> dict:
+    """
+    Mensaje con los resultados de varias sagas en una sola publicación
+    Con un solo item se usa el formato de siempre; con más, los items van en
+    payload.items y cada uno conserva su message_id para la deduplicación
+    """
+    if len(items) == 1:
+        item = dict(items[0])
+        return {"type": event_type, "message_id": item.pop("message_id", None), "payload": item}
+    return {
+        "type": event_type,
+        "message_id": uuid.uuid4().hex,
+        "payload": {"items": items}
+    }
@@ -1,41 +1,100 @@
 import httpx
 import logging
+import os
 from typing import Dict, Any
+from app.ndjson import to_ndjson
 
 logger = logging.getLogger(__name__)
 
-TASK_SERVICE_URL = "http://task_service:8000"
+TASK_SERVICE_URL = os.getenv("TASK_SERVICE_URL", "http://task_service:8000")
+
+# Eventos por petición NDJSON y timeout de cada petición
+EVENT_PUBLISH_BATCH_SIZE = int(os.getenv("EVENT_PUBLISH_BATCH_SIZE", "500"))
+EVENT_PUBLISH_TIMEOUT_SECONDS = float(os.getenv("EVENT_PUBLISH_TIMEOUT_SECONDS", "5"))
+
+NDJSON_HEADERS = {"Content-Type": "application/x-ndjson"}
+
+# Clientes compartidos: las conexiones con el Task Service se reutilizan
+_client = None
+_async_client = None
+
+
+def get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        _client = httpx.Client(timeout=EVENT_PUBLISH_TIMEOUT_SECONDS)
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(timeout=EVENT_PUBLISH_TIMEOUT_SECONDS)
+    return _async_client
+
 
 async def publish_event_to_task_service(event_type: str, payload: Dict[Any, Any]) -> bool:
     """
     Publica un evento HACIA el Task Service
     Usado para notificar éxito o fallo de la notificación
-    
+
     Esta es la parte "coreografiada" donde el Notification Service
     le comunica al Task Service el resultado de su operación
     """
     try:
         logger.info(f"📤 Publishing event to Task Service: {event_type}")
-        
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.post(
-                f"{TASK_SERVICE_URL}/tasks/events",
-                json={
-                    "type": event_type,
-                    "payload": payload
-                }
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"✅ Event {event_type} delivered to Task Service")
-                return True
-            else:
-                logger.error(f"❌ Failed to deliver {event_type}: {response.status_code}")
-                return False
-                
+
+        response = await get_async_client().post(
+            f"{TASK_SERVICE_URL}/tasks/events",
+            json={
+                "type": event_type,
+                "payload": payload
+            }
+        )
+
+        if response.status_code == 200:
+            logger.info(f"✅ Event {event_type} delivered to Task Service")
+            return True
+        else:
+            logger.error(f"❌ Failed to deliver {event_type}: {response.status_code}")
+            return False
+
     except httpx.TimeoutException:
         logger.error(f"⏱️ Timeout publishing event {event_type} to Task Service")
         return False
     except Exception as e:
         logger.error(f"💥 Error publishing to Task Service: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def publish_events_to_task_service(events: list) -> bool:
+    """
+    Publica varios eventos al Task Service en cuerpos NDJSON de hasta
+    EVENT_PUBLISH_BATCH_SIZE eventos (síncrono: lo usan los consumidores)
+    Retorna True si todos los lotes fueron aceptados
+    """
+    delivered = True
+    for start in range(0, len(events), EVENT_PUBLISH_BATCH_SIZE):
+        batch = events[start:start + EVENT_PUBLISH_BATCH_SIZE]
+        try:
+            response = get_client().post(
+                f"{TASK_SERVICE_URL}/tasks/events",
+                content=to_ndjson(batch),
+                headers=NDJSON_HEADERS
+            )
+            response.raise_for_status()
+            logger.info(f"✅ {len(batch)} events delivered to Task Service via HTTP")
+        except Exception as e:
+            logger.error(f"💥 Error publishing {len(batch)} events to Task Service: {str(e)}")
+            delivered = False
+    return delivered
+
+
+async def close_clients():
+    global _client, _async_client
+    if _client is not None:
+        _client.close()
+        _client = None
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
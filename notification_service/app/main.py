@@ -1,4 +1,6 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 import random
 import logging
 import sys
@@ -8,99 +10,166 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.rabbitmq_client import RabbitMQClient
+from app.dedup import ProcessedMessageCache
+from app.channels import get_dispatcher
+from app.event_publisher import close_clients, publish_events_to_task_service
+from app.ndjson import iter_ndjson
+from app.consumer_metrics import QueueProbe, consumer_report
+from app.faults import FAULTS_ENABLED, FaultInjectionMiddleware, InjectedFault, get_fault_injector
+from app.faults import router as faults_router
+from app.digest import (
+    NOTIFICATION_DIGEST_MAX_EVENTS,
+    NOTIFICATION_DIGEST_WINDOW_SECONDS,
+    RESULT_ROUTING_KEYS,
+    group_by_user,
+    render_digest,
+    result_message
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Notification Service")
 
+app.include_router(faults_router)
+if FAULTS_ENABLED:
+    app.add_middleware(FaultInjectionMiddleware)
+
 # Cliente RabbitMQ
 rabbitmq_client = None
 
+# Cola consumida y sonda de su profundidad (la lee /health)
+TASKS_QUEUE = "notification_service_tasks"
+queue_probe = None
+
 # Variable para simular fallos
 FAILURE_RATE = 0.3  # 30% de probabilidad de fallo
 
+# Mensajes ya procesados (descarta redeliveries)
+processed_messages = ProcessedMessageCache()
+
+# Resultados cuyo digest ya se entregó: si publicar el resultado falla y el
+# mensaje se reprocesa, se publica notification_sent sin entregarlo de nuevo
+delivered_messages = ProcessedMessageCache()
+
 
 # ========== Procesador de Eventos ==========
 def process_task_event(message: dict):
     """
     Callback para procesar eventos de Task Service
     """
-    event_type = message.get("type")
-    payload = message.get("payload", {})
-    
-    task_id = payload.get("task_id")
-    saga_id = payload.get("saga_id", "unknown")
-    user_id = payload.get("user_id")
-    
-    logger.info(f"📨 Processing task event: {event_type} | Task: {task_id} | SAGA: {saga_id}")
-    
-    if event_type != "task_created":
-        logger.warning(f"⚠️ Ignoring event type: {event_type}")
-        return
+    process_task_events([message])
+
+
+def process_task_events(messages: list):
+    """
+    Callback por lotes: un digest por usuario con todas sus tareas creadas
+    y los resultados por saga agrupados en como mucho dos publicaciones
+    """
+    items = []
+    seen = set()
+    for message in messages:
+        event_type = message.get("type")
+        payload = message.get("payload", {})
+        message_id = message.get("message_id")
+        saga_id = payload.get("saga_id", "unknown")
+        
+        logger.info(f"📨 Processing task event: {event_type} | Task: {payload.get('task_id')} | SAGA: {saga_id}")
+        
+        if event_type != "task_created":
+            logger.warning(f"⚠️ Ignoring event type: {event_type}")
+            continue
+        
+        if message_id and (message_id in processed_messages or message_id in seen):
+            logger.info(f"♻️ Duplicate message {message_id} ignored | SAGA: {saga_id}")
+            continue
+        seen.add(message_id)
+        
+        # El resultado hereda un ID derivado del mensaje original: si el mensaje
+        # se reprocesa tras un reinicio, el Task Service descarta el segundo resultado
+        items.append({
+            "message_id": f"{message_id}.result" if message_id else None,
+            "task_id": payload.get("task_id"),
+            "saga_id": saga_id,
+            "user_id": payload.get("user_id")
+        })
     
-    # 🎲 Simular procesamiento (puede fallar)
-    try:
+    results = {"notification_sent": [], "notification_failed": []}
+    for item in items:
+        if item["message_id"] in delivered_messages:
+            logger.info(f"♻️ Digest for {item['message_id']} already delivered | SAGA: {item['saga_id']}")
+            results["notification_sent"].append(item)
+    groups = group_by_user([item for item in items if item["message_id"] not in delivered_messages])
+    digests = {}
+    for user_id, user_items in groups.items():
+        # 🎲 Simular envío del digest (puede fallar: fallan todas sus sagas)
         if random.random() < FAILURE_RATE:
-            # FALLO SIMULADO
-            logger.error(f"💥 SIMULATED FAILURE for SAGA {saga_id}")
-            
-            # Publicar evento de fallo a RabbitMQ
-            rabbitmq_client.publish(
-                exchange="notification_events",
-                routing_key="notification.failed",
-                message={
-                    "type": "notification_failed",
-                    "payload": {
-                        "task_id": task_id,
-                        "saga_id": saga_id,
-                        "reason": "Notification service temporarily unavailable (simulated)",
-                        "user_id": user_id
-                    }
-                }
-            )
-            
-            logger.info(f"📤 Published 'notification_failed' to RabbitMQ")
-            
-        else:
-            # ÉXITO
-            logger.info(f"📧 Notification Service | User {user_id} - Task {task_id} created successfully")
-            logger.info(f"✅ Notification sent successfully | SAGA: {saga_id}")
-            
-            # Publicar evento de éxito a RabbitMQ
-            rabbitmq_client.publish(
-                exchange="notification_events",
-                routing_key="notification.sent",
-                message={
-                    "type": "notification_sent",
-                    "payload": {
-                        "task_id": task_id,
-                        "saga_id": saga_id,
-                        "user_id": user_id
-                    }
-                }
-            )
-            
-            logger.info(f"📤 Published 'notification_sent' to RabbitMQ")
+            logger.error(f"💥 SIMULATED FAILURE for digest of user {user_id} ({len(user_items)} sagas)")
+            reason = "Notification service temporarily unavailable (simulated)"
+            results["notification_failed"].extend(dict(item, reason=reason) for item in user_items)
+            continue
+        
+        # 🧪 Reglas de inyección para task_created (latencia y fallos)
+        try:
+            get_fault_injector().inject_event("task_created")
+        except InjectedFault as e:
+            logger.error(f"💥 {str(e)} | digest of user {user_id}")
+            results["notification_failed"].extend(dict(item, reason=str(e)) for item in user_items)
+            continue
+        
+        message = render_digest(user_id, user_items)
+        logger.info(f"📧 Notification Service | {message}")
+        digests[user_id] = {
+            "user_id": user_id,
+            "count": len(user_items),
+            "tasks": ", ".join(str(item["task_id"]) for item in user_items),
+            "message": message
+        }
     
+    # Entrega por los canales: todos los digests del lote a la vez
+    try:
+        failures = get_dispatcher().deliver(digests)
     except Exception as e:
         # Error inesperado
         logger.error(f"💥 Unexpected error in notification service: {str(e)}")
-        
-        # Publicar evento de fallo
-        rabbitmq_client.publish(
+        failures = {user_id: f"Unexpected error: {str(e)}" for user_id in digests}
+    
+    for user_id, user_items in groups.items():
+        if user_id not in digests:
+            continue
+        reason = failures.get(user_id)
+        if reason:
+            logger.error(f"❌ Digest for user {user_id} failed | {reason}")
+            results["notification_failed"].extend(dict(item, reason=reason) for item in user_items)
+        else:
+            logger.info(f"✅ Digest sent to user {user_id} | {len(user_items)} sagas")
+            results["notification_sent"].extend(user_items)
+            for item in user_items:
+                if item["message_id"]:
+                    delivered_messages.add(item["message_id"])
+    
+    # Sin RabbitMQ los resultados van al Task Service por HTTP (NDJSON)
+    unpublished = []
+    for event_type, result_items in results.items():
+        if not result_items:
+            continue
+        message = result_message(event_type, result_items)
+        if rabbitmq_client is None or not rabbitmq_client.publish(
             exchange="notification_events",
-            routing_key="notification.failed",
-            message={
-                "type": "notification_failed",
-                "payload": {
-                    "task_id": task_id,
-                    "saga_id": saga_id,
-                    "reason": f"Unexpected error: {str(e)}",
-                    "user_id": user_id
-                }
-            }
-        )
+            routing_key=RESULT_ROUTING_KEYS[event_type],
+            message=message
+        ):
+            unpublished.append(message)
+            continue
+        logger.info(f"📤 Published '{event_type}' for {len(result_items)} sagas to RabbitMQ")
+    
+    if unpublished and not publish_events_to_task_service(unpublished):
+        # Los mensajes no se marcan como procesados: un reintento los repite
+        raise RuntimeError(f"Could not deliver {len(unpublished)} result messages to Task Service")
+    
+    for message_id in seen:
+        if message_id:
+            processed_messages.add(message_id)
 
 
 # ========== Eventos del ciclo de vida ==========
@@ -109,7 +178,7 @@ def startup_event():
     """
     Iniciar consumidor de RabbitMQ al arrancar
     """
-    global rabbitmq_client
+    global rabbitmq_client, queue_probe
     
     try:
         logger.info("🚀 Starting Notification Service...")
@@ -117,15 +186,27 @@ def startup_event():
         # Conectar a RabbitMQ
         rabbitmq_client = RabbitMQClient()
         rabbitmq_client.connect()
+        queue_probe = QueueProbe(rabbitmq_client.rabbitmq_url)
         
-        # Iniciar consumidor en background
-        rabbitmq_client.start_consuming_background(
-            queue_name="notification_service_tasks",
-            callback=process_task_event,
-            routing_keys=[
-                ("task_events", "task.created")
-            ]
-        )
+        # Iniciar consumidor en background (por lotes: digest por usuario)
+        if NOTIFICATION_DIGEST_MAX_EVENTS > 1:
+            rabbitmq_client.start_batch_consuming_background(
+                queue_name=TASKS_QUEUE,
+                callback=process_task_events,
+                routing_keys=[
+                    ("task_events", "task.created")
+                ],
+                batch_size=NOTIFICATION_DIGEST_MAX_EVENTS,
+                batch_timeout=NOTIFICATION_DIGEST_WINDOW_SECONDS
+            )
+        else:
+            rabbitmq_client.start_consuming_background(
+                queue_name=TASKS_QUEUE,
+                callback=process_task_event,
+                routing_keys=[
+                    ("task_events", "task.created")
+                ]
+            )
         
         logger.info("✅ RabbitMQ consumer started successfully")
         
@@ -135,29 +216,70 @@ def startup_event():
 
 
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     """
     Cerrar conexiones al detener
     """
     try:
+        if queue_probe:
+            queue_probe.close()
         if rabbitmq_client:
             rabbitmq_client.close()
         logger.info("👋 RabbitMQ connection closed")
+        get_dispatcher().shutdown()
+        await close_clients()
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}")
 
 
 # ========== Endpoints ==========
+def consumer_status() -> dict:
+    """Profundidad, consumidores, throughput, latencias y unacked de la cola de tareas"""
+    if rabbitmq_client is None or queue_probe is None:
+        return None
+    return consumer_report(
+        rabbitmq_client.consumer_metrics(TASKS_QUEUE),
+        queue_probe.queue_state(TASKS_QUEUE),
+        rabbitmq_client.is_consuming
+    )
+
+
 @app.get("/health")
 def health():
     rabbitmq_status = "connected" if rabbitmq_client and rabbitmq_client.connection and not rabbitmq_client.connection.is_closed else "disconnected"
     return {
         "status": "notification service running",
         "rabbitmq": rabbitmq_status,
-        "failure_rate": f"{FAILURE_RATE * 100}%"
+        "failure_rate": f"{FAILURE_RATE * 100}%",
+        "channels": get_dispatcher().stats(),
+        "consumer": consumer_status()
     }
 
 
+@app.get("/ready")
+def ready():
+    """
+    Readiness: falla (503) sin consumidor o si la cola acumula más lag del
+    permitido (CONSUMER_LAG_MAX_MESSAGES / CONSUMER_LAG_MAX_SECONDS)
+    """
+    status = consumer_status()
+    if status is None or not status["ready"]:
+        reasons = status["not_ready_reasons"] if status else ["RabbitMQ consumer not started"]
+        return JSONResponse(status_code=503, content={"ready": False, "reasons": reasons, "consumer": status})
+    return {"ready": True, "consumer": status}
+
+
+@app.get("/inbox/{user_id}")
+def get_inbox(user_id: int):
+    """
+    Últimas notificaciones del usuario en la bandeja en memoria
+    """
+    inbox = get_dispatcher().channel("inbox")
+    if inbox is None:
+        raise HTTPException(status_code=404, detail="Inbox channel is not enabled")
+    return inbox.messages(user_id)
+
+
 @app.post("/config/failure-rate")
 def set_failure_rate(rate: float):
     """
@@ -178,16 +300,43 @@ def set_failure_rate(rate: float):
 
 
 # ========== Endpoint legacy (opcional) ==========
+NDJSON_BATCH_SIZE = max(NOTIFICATION_DIGEST_MAX_EVENTS, 1)
+NDJSON_MAX_ERRORS = 100
+
+
 @app.post("/events")
-async def receive_event(event: dict):
+async def receive_event(request: Request):
     """
-    Endpoint HTTP legacy para compatibilidad
-    En producción, solo usarías RabbitMQ
+    Endpoint HTTP legacy para compatibilidad (o cuando RabbitMQ no está disponible)
+    - JSON: un evento
+    - NDJSON (application/x-ndjson): un evento por línea, leído en streaming
+      y procesado en lotes como los del consumidor (un digest por usuario)
     """
     logger.info("⚠️ Received event via HTTP (legacy mode)")
-    logger.info("💡 Tip: Use RabbitMQ for production")
     
-    # Procesar igual que un mensaje de RabbitMQ
-    process_task_event(event)
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            event = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        # Procesar igual que un mensaje de RabbitMQ
+        await run_in_threadpool(process_task_event, event)
+        return {"status": "processed via HTTP (legacy)"}
+    
+    received, batch, errors = 0, [], []
+    async for number, event in iter_ndjson(request.stream()):
+        if isinstance(event, Exception):
+            if len(errors) < NDJSON_MAX_ERRORS:
+                errors.append({"line": number, "error": str(event)})
+            continue
+        batch.append(event)
+        if len(batch) >= NDJSON_BATCH_SIZE:
+            received += len(batch)
+            await run_in_threadpool(process_task_events, batch)
+            batch = []
+    if batch:
+        received += len(batch)
+        await run_in_threadpool(process_task_events, batch)
     
-    return {"status": "processed via HTTP (legacy)"}
\ No newline at end of file
+    logger.info(f"📥 Processed {received} events via HTTP ({len(errors)} invalid lines)")
+    return {"status": "batch processed via HTTP", "received": received, "errors": errors}
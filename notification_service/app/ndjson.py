@@ -0,0 +1,48 @@
+import json
+import os
+
+# Líneas más largas se rechazan sin acumularlas en memoria
+NDJSON_MAX_LINE_BYTES = int(os.getenv("NDJSON_MAX_LINE_BYTES", "65536"))
+
+
+def to_ndjson(events: list) -> bytes:
+    return "".join(json.dumps(event) + "\n" for event in events).encode()
+
+
+async def iter_ndjson(chunks, max_line_bytes: int = NDJSON_MAX_LINE_BYTES):
+    """
+    Eventos (número de línea, dict o error) de un cuerpo NDJSON a medida que llega
+    Las líneas vacías se ignoran; una inválida se entrega como ValueError
+    """
+    pending = b""
+    oversized = False
+    number = 0
+
+    def parse(line: bytes):
+        try:
+            event = json.loads(line)
+            if not isinstance(event, dict):
+                raise ValueError("Each line must be a JSON object")
+            return event
+        except ValueError as e:
+            return ValueError(f"Invalid JSON: {str(e)}")
+
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if oversized:
+                oversized = False
+                number += 1
+                yield number, ValueError("Line too long")
+            elif line.strip():
+                number += 1
+                yield number, parse(line)
+        if len(pending) > max_line_bytes:
+            pending = b""
+            oversized = True
+    if oversized:
+        number += 1
+        yield number, ValueError("Line too long")
+    elif pending.strip():
+        yield number + 1, parse(pending)
@@ -3,11 +3,17 @@ import json
 import logging
 import os
 from typing import Callable, Dict, Any
-from threading import Thread
+from threading import Lock, Thread, local
 import time
+import uuid
+from app.consumer_metrics import ConsumerMetrics
 
 logger = logging.getLogger(__name__)
 
+# Tras no poder conectar para publicar, las publicaciones fallan al instante
+# durante este tiempo: con el broker caído las peticiones no pagan el timeout
+PUBLISH_CIRCUIT_OPEN_SECONDS = float(os.getenv("PUBLISH_CIRCUIT_OPEN_SECONDS", "30"))
+
 class RabbitMQClient:
     """
     Cliente para RabbitMQ - Versión para Notification Service
@@ -22,6 +28,16 @@ class RabbitMQClient:
         self.channel = None
         self.is_consuming = False
         
+        # pika no es thread-safe: cada thread publica por su propia conexión,
+        # nunca por la del consumidor (que está dentro de start_consuming)
+        self._publisher = local()
+        self._publisher_connections = []
+        self._publisher_lock = Lock()
+        self._publish_circuit_open_until = 0.0
+        
+        # Métricas por cola consumida (las lee /health desde otro thread)
+        self.metrics = {}
+        
         # Exchanges
         self.TASK_EVENTS_EXCHANGE = "task_events"
         self.NOTIFICATION_EVENTS_EXCHANGE = "notification_events"
@@ -64,33 +80,83 @@ class RabbitMQClient:
         return False
     
     def publish(self, exchange: str, routing_key: str, message: Dict[Any, Any]):
-        """Publicar mensaje en RabbitMQ"""
+        """
+        Publicar mensaje en RabbitMQ por la conexión de publicación del thread
+        (el endpoint HTTP legacy publica desde el threadpool, no desde el consumidor)
+        """
+        if time.monotonic() < self._publish_circuit_open_until:
+            logger.warning(f"⚡ RabbitMQ unavailable, publish to {exchange}/{routing_key} skipped")
+            return False
+        
         try:
-            if not self.channel or self.channel.is_closed:
-                logger.warning("⚠️ Channel closed, reconnecting...")
-                self.connect()
-            
-            self.channel.confirm_delivery()
-            
+            # Cada mensaje lleva un ID para que los consumidores puedan deduplicar
+            if not message.get("message_id"):
+                message["message_id"] = uuid.uuid4().hex
             body = json.dumps(message)
             
-            self.channel.basic_publish(
-                exchange=exchange,
-                routing_key=routing_key,
-                body=body,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,
-                    content_type='application/json'
-                ),
-                mandatory=True
-            )
+            for attempt in range(2):
+                channel = getattr(self._publisher, "channel", None)
+                reused = channel is not None and channel.is_open
+                try:
+                    self._publish_channel().basic_publish(
+                        exchange=exchange,
+                        routing_key=routing_key,
+                        body=body,
+                        properties=pika.BasicProperties(
+                            delivery_mode=2,
+                            content_type='application/json',
+                            message_id=message["message_id"]
+                        ),
+                        mandatory=True
+                    )
+                    break
+                except pika.exceptions.UnroutableError:
+                    raise
+                except Exception as e:
+                    self._drop_publish_channel()
+                    # Solo una conexión reutilizada se reintenta; una nueva que falla es el broker
+                    if attempt or not reused:
+                        raise
+                    logger.warning(f"⚠️ Publish connection lost ({str(e)}), reconnecting...")
             
             logger.info(f"📤 Published to {exchange}/{routing_key}")
             return True
             
+        except pika.exceptions.AMQPConnectionError as e:
+            self._publish_circuit_open_until = time.monotonic() + PUBLISH_CIRCUIT_OPEN_SECONDS
+            logger.error(f"💥 Failed to publish message: {str(e)} (publishing paused {PUBLISH_CIRCUIT_OPEN_SECONDS}s)")
+            return False
         except Exception as e:
             logger.error(f"💥 Failed to publish message: {str(e)}")
             return False
+
+    def _publish_channel(self):
+        """Canal de publicación del thread actual (con confirmaciones); se crea la primera vez"""
+        channel = getattr(self._publisher, "channel", None)
+        if channel is not None and channel.is_open:
+            return channel
+        connection = pika.BlockingConnection(pika.URLParameters(self.rabbitmq_url))
+        channel = connection.channel()
+        channel.confirm_delivery()
+        with self._publisher_lock:
+            self._publisher_connections.append(connection)
+        self._publisher.connection, self._publisher.channel = connection, channel
+        return channel
+    
+    def _drop_publish_channel(self):
+        """Descarta la conexión de publicación del thread (la próxima publicación reconecta)"""
+        connection = getattr(self._publisher, "connection", None)
+        self._publisher.connection = self._publisher.channel = None
+        if connection is None:
+            return
+        with self._publisher_lock:
+            if connection in self._publisher_connections:
+                self._publisher_connections.remove(connection)
+        try:
+            if connection.is_open:
+                connection.close()
+        except Exception:
+            pass
     
     def consume(self, queue_name: str, callback: Callable, routing_keys: list = None):
         """Consumir mensajes de una cola"""
@@ -98,35 +164,34 @@ class RabbitMQClient:
             if not self.channel or self.channel.is_closed:
                 self.connect()
             
-            self.channel.queue_declare(queue=queue_name, durable=True)
-            
-            if routing_keys:
-                for exchange, key in routing_keys:
-                    self.channel.queue_bind(
-                        queue=queue_name,
-                        exchange=exchange,
-                        routing_key=key
-                    )
-                    logger.info(f"🔗 Bound {queue_name} to {exchange}/{key}")
+            self._declare_queue(queue_name, routing_keys)
+            metrics = self.consumer_metrics(queue_name)
             
             self.channel.basic_qos(prefetch_count=1)
             
             def callback_wrapper(ch, method, properties, body):
+                metrics.received()
+                started = time.perf_counter()
                 try:
                     message = json.loads(body)
+                    if properties.message_id and "message_id" not in message:
+                        message["message_id"] = properties.message_id
                     logger.info(f"📨 Received from {queue_name}")
                     
                     callback(message)
                     
                     ch.basic_ack(delivery_tag=method.delivery_tag)
+                    metrics.settled(1, time.perf_counter() - started)
                     
                 except json.JSONDecodeError as e:
                     logger.error(f"❌ Invalid JSON: {str(e)}")
                     ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                    metrics.settled(1, ok=False)
                     
                 except Exception as e:
                     logger.error(f"💥 Error processing message: {str(e)}")
                     ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                    metrics.settled(1, time.perf_counter() - started, ok=False)
             
             self.channel.basic_consume(
                 queue=queue_name,
@@ -143,8 +208,119 @@ class RabbitMQClient:
             self.stop_consuming()
         except Exception as e:
             logger.error(f"💥 Consumer error: {str(e)}")
+            self.is_consuming = False
+            raise
+    
+    def consume_batch(
+        self,
+        queue_name: str,
+        callback: Callable,
+        routing_keys: list = None,
+        batch_size: int = 50,
+        batch_timeout: float = 0.2
+    ):
+        """
+        Consumir mensajes en lotes acotados por cantidad y por tiempo
+        El callback recibe una lista de mensajes; el ACK se envía por lote (multiple=True)
+        """
+        try:
+            if not self.channel or self.channel.is_closed:
+                self.connect()
+            
+            self._declare_queue(queue_name, routing_keys)
+            metrics = self.consumer_metrics(queue_name)
+            
+            # El prefetch debe cubrir el lote completo
+            self.channel.basic_qos(prefetch_count=batch_size)
+            
+            batch = []  # (delivery_tag, message)
+            timer = None
+            
+            def flush():
+                nonlocal timer
+                if timer is not None:
+                    self.connection.remove_timeout(timer)
+                    timer = None
+                if not batch:
+                    return
+                
+                messages = [message for _, message in batch]
+                last_tag = batch[-1][0]
+                batch.clear()
+                
+                started = time.perf_counter()
+                try:
+                    callback(messages)
+                    # Un solo ACK confirma todo el lote
+                    self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                    metrics.settled(len(messages), time.perf_counter() - started)
+                    logger.info(f"✅ Batch ACK sent for {len(messages)} messages from {queue_name}")
+                except Exception as e:
+                    logger.error(f"💥 Error processing batch: {str(e)}")
+                    self.channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+                    metrics.settled(len(messages), time.perf_counter() - started, ok=False)
+            
+            def on_timeout():
+                nonlocal timer
+                timer = None
+                flush()
+            
+            def callback_wrapper(ch, method, properties, body):
+                nonlocal timer
+                metrics.received()
+                try:
+                    message = json.loads(body)
+                except json.JSONDecodeError as e:
+                    logger.error(f"❌ Invalid JSON: {str(e)}")
+                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                    metrics.settled(1, ok=False)
+                    return
+                
+                if properties.message_id and "message_id" not in message:
+                    message["message_id"] = properties.message_id
+                batch.append((method.delivery_tag, message))
+                
+                if len(batch) >= batch_size:
+                    flush()
+                elif timer is None:
+                    timer = self.connection.call_later(batch_timeout, on_timeout)
+            
+            self.channel.basic_consume(
+                queue=queue_name,
+                on_message_callback=callback_wrapper,
+                auto_ack=False
+            )
+            
+            logger.info(f"👂 Listening on queue: {queue_name} (batch size {batch_size}, timeout {batch_timeout}s)")
+            self.is_consuming = True
+            self.channel.start_consuming()
+            
+        except KeyboardInterrupt:
+            logger.info("⏹️ Stopping consumer...")
+            self.stop_consuming()
+        except Exception as e:
+            logger.error(f"💥 Consumer error: {str(e)}")
+            self.is_consuming = False
             raise
     
+    def consumer_metrics(self, queue_name: str) -> ConsumerMetrics:
+        if queue_name not in self.metrics:
+            self.metrics[queue_name] = ConsumerMetrics(queue_name)
+        return self.metrics[queue_name]
+    
+    def _declare_queue(self, queue_name: str, routing_keys: list = None):
+        """Declarar cola durable y vincularla a sus routing keys"""
+        self.channel.queue_declare(queue=queue_name, durable=True)
+        
+        if routing_keys:
+            for exchange, key in routing_keys:
+                self.channel.queue_bind(
+                    queue=queue_name,
+                    exchange=exchange,
+                    routing_key=key
+                )
+                logger.info(f"🔗 Bound {queue_name} to {exchange}/{key}")
+    
     def start_consuming_background(self, queue_name: str, callback: Callable, routing_keys: list = None):
         """Iniciar consumidor en thread separado"""
         def consume_thread():
@@ -157,6 +333,25 @@ class RabbitMQClient:
         thread.start()
         logger.info(f"🚀 Background consumer started for {queue_name}")
     
+    def start_batch_consuming_background(
+        self,
+        queue_name: str,
+        callback: Callable,
+        routing_keys: list = None,
+        batch_size: int = 50,
+        batch_timeout: float = 0.2
+    ):
+        """Iniciar consumidor por lotes en thread separado"""
+        def consume_thread():
+            try:
+                self.consume_batch(queue_name, callback, routing_keys, batch_size, batch_timeout)
+            except Exception as e:
+                logger.error(f"💥 Background batch consumer error: {str(e)}")
+        
+        thread = Thread(target=consume_thread, daemon=True)
+        thread.start()
+        logger.info(f"🚀 Background batch consumer started for {queue_name}")
+    
     def stop_consuming(self):
         """Detener el consumidor"""
         if self.is_consuming and self.channel:
@@ -165,7 +360,15 @@ class RabbitMQClient:
             logger.info("⏹️ Consumer stopped")
     
     def close(self):
-        """Cerrar conexión"""
+        """Cerrar conexión (la del consumidor y las de publicación)"""
+        with self._publisher_lock:
+            publishers, self._publisher_connections = self._publisher_connections, []
+        for connection in publishers:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except Exception:
+                pass
         try:
             if self.channel and not self.channel.is_closed:
                 self.channel.close()
@@ -7,3 +7,215 @@ def test_health_check():
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "notification service running"
+
+def test_duplicate_task_event_is_processed_once():
+    from unittest.mock import patch
+    from app.main import process_task_event
+
+    message = {
+        "type": "task_created",
+        "message_id": "dup-test-message",
+        "payload": {"task_id": 1, "saga_id": "test-saga-id", "user_id": 1}
+    }
+
+    with patch("app.main.rabbitmq_client") as mock_client:
+        process_task_event(message)
+        process_task_event(message)
+        assert mock_client.publish.call_count == 1
+        published = mock_client.publish.call_args.kwargs["message"]
+        assert published["message_id"] == "dup-test-message.result"
+
+def test_task_events_are_sent_as_one_digest_per_user():
+    from unittest.mock import patch
+    from app.digest import render_digest
+    from app.main import process_task_events
+
+    messages = [
+        {"type": "task_created", "message_id": f"digest-{i}",
+         "payload": {"task_id": 100 + i, "saga_id": f"saga-{i}", "user_id": user_id}}
+        for i, user_id in enumerate([1, 2, 1, 1, 2])
+    ]
+    messages.append(dict(messages[0]))  # redelivery dentro del mismo lote
+
+    # El digest del usuario 1 se envía y el del usuario 2 falla
+    with patch("app.main.rabbitmq_client") as mock_client, \
+            patch("app.main.random.random", side_effect=[0.9, 0.0]), \
+            patch("app.main.render_digest", wraps=render_digest) as digest:
+        process_task_events(messages)
+
+    assert [call.args[0] for call in digest.call_args_list] == [1]
+    assert len(digest.call_args.args[1]) == 3
+
+    # Una publicación por tipo de resultado, con un item por saga
+    published = {call.kwargs["routing_key"]: call.kwargs["message"] for call in mock_client.publish.call_args_list}
+    assert set(published) == {"notification.sent", "notification.failed"}
+    sent = published["notification.sent"]["payload"]["items"]
+    failed = published["notification.failed"]["payload"]["items"]
+    assert [item["saga_id"] for item in sent] == ["saga-0", "saga-2", "saga-3"]
+    assert [item["saga_id"] for item in failed] == ["saga-1", "saga-4"]
+    assert sent[0]["message_id"] == "digest-0.result"
+
+def test_required_channels_decide_the_result_and_best_effort_ones_are_not_awaited():
+    import asyncio
+    import socketserver
+    import threading
+    import time
+    from unittest.mock import patch
+    from app.channels import Channel, InboxChannel, NotificationDispatcher, SmtpChannel
+    from app.main import process_task_events
+
+    # Servidor SMTP mínimo de pruebas: guarda los mensajes recibidos
+    received, connections = [], []
+
+    class SMTPHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            connections.append(self.client_address)
+            self.wfile.write(b"220 test\r\n")
+            for line in self.rfile:
+                command = line.strip().upper()
+                if command == b"DATA":
+                    self.wfile.write(b"354 go\r\n")
+                    received.append(b"".join(iter(self.rfile.readline, b".\r\n")).decode())
+                elif command == b"QUIT":
+                    self.wfile.write(b"221 bye\r\n")
+                    return
+                self.wfile.write(b"250 ok\r\n")
+
+    class SlowChannel(Channel):
+        name = "slow"
+
+        async def send(self, user_id, message):
+            await asyncio.sleep(5)
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    inbox = InboxChannel(concurrency=2)
+    smtp = SmtpChannel(host="127.0.0.1", port=server.server_address[1], concurrency=1, timeout=2)
+    slow = SlowChannel(concurrency=1, timeout=0.2)
+    # Solo el inbox es obligatorio: smtp y el canal lento son best effort
+    dispatcher = NotificationDispatcher([inbox, smtp, slow], required=["inbox"])
+    required_slow = NotificationDispatcher([SlowChannel(concurrency=1, timeout=0.2)], required=["slow"])
+    messages = [
+        {"type": "task_created", "message_id": f"channel-{i}",
+         "payload": {"task_id": 200 + i, "saga_id": f"channel-saga-{i}", "user_id": 10 + i}}
+        for i in range(2)
+    ]
+
+    try:
+        with patch("app.main.get_dispatcher", return_value=dispatcher), \
+                patch("app.main.rabbitmq_client") as mock_client, \
+                patch("app.main.publish_events_to_task_service", return_value=False), \
+                patch("app.main.FAILURE_RATE", 0):
+            # Publicar el resultado falla: el lote se reprocesa sin duplicar el inbox
+            mock_client.publish.return_value = False
+            try:
+                process_task_events(messages)
+            except RuntimeError:
+                pass
+            mock_client.publish.return_value = True
+            started = time.monotonic()
+            process_task_events(messages)
+            elapsed = time.monotonic() - started
+            published = mock_client.publish.call_args.kwargs
+            wait_for(lambda: smtp.sent == 2 and slow.failed == 2)
+            failures = required_slow.deliver({20: {"user_id": 20, "count": 1, "tasks": "1", "message": "hi"}})
+    finally:
+        dispatcher.shutdown()
+        required_slow.shutdown()
+        server.shutdown()
+        server.server_close()
+
+    # El consumidor no espera a los canales best effort (el lento vence su timeout)
+    assert elapsed < 0.2
+    assert [message["body"] for message in inbox.messages(10)] == ["User 10 - Task 200 created successfully"]
+    assert len(received) == 2 and "Subject: [TaskManager] 1 task(s) created" in received[0]
+    assert len(connections) == 1  # la conexión SMTP se reutiliza
+    assert slow.stats()["failed"] == 2
+
+    # Con el inbox entregado el resultado es notification_sent aunque fallen los demás
+    assert published["routing_key"] == "notification.sent"
+    items = published["message"]["payload"]["items"]
+    assert [item["saga_id"] for item in items] == ["channel-saga-0", "channel-saga-1"]
+
+    # El fallo de un canal obligatorio sí termina en notification_failed con su motivo
+    assert "slow:" in failures[20] and "timed out" in failures[20]
+
+def test_fault_injection_rules_are_seeded_windowed_and_reach_the_saga():
+    from unittest.mock import patch
+    from fastapi import FastAPI
+    from app.faults import FaultInjectionMiddleware, FaultInjector
+    from app.main import process_task_events
+
+    now = [0.0]
+    config = {"seed": 7, "rules": [
+        {"match": "event:task_created", "failure_rate": 1, "window": {"start_s": 10, "duration_s": 5, "every_s": 60}},
+        {"match": "route:GET /slow*", "latency": {"distribution": "long_tail", "median_ms": 20, "p99_ms": 400}},
+        {"match": "route:POST *", "failure_rate": 0.5, "status_code": 502}
+    ]}
+
+    def samples(target, count=20):
+        injector = FaultInjector(enabled=True, clock=lambda: now[0])
+        injector.configure(config)
+        return [injector.decide(target)[:2] for _ in range(count)]
+
+    # Misma semilla, misma secuencia; retardos acotados y con cola larga
+    assert samples("route:GET /slow/1") == samples("route:GET /slow/1")
+    delays = [delay for delay, _ in samples("route:GET /slow/1", 500)]
+    assert all(0 < delay <= 4 for delay in delays) and max(delays) > 5 * sorted(delays)[250]
+
+    # La regla de eventos solo actúa dentro de su ventana periódica
+    injector = FaultInjector(enabled=True, clock=lambda: now[0])
+    injector.configure(config)
+    assert injector.decide("event:task_created") is None
+    now[0] = 72
+    assert injector.decide("event:task_created")[1] is True
+    assert injector.decide("event:task_updated") is None
+
+    message = {"type": "task_created", "message_id": "fault-test",
+               "payload": {"task_id": 300, "saga_id": "fault-saga", "user_id": 30}}
+    with patch("app.main.get_fault_injector", return_value=injector), \
+            patch("app.main.rabbitmq_client") as mock_client, \
+            patch("app.main.FAILURE_RATE", 0):
+        process_task_events([message])
+    published = mock_client.publish.call_args.kwargs
+    assert published["routing_key"] == "notification.failed"
+    assert "Injected fault" in published["message"]["payload"]["reason"]
+
+    # Las reglas de rutas responden antes de llegar al endpoint
+    app = FastAPI()
+    app.add_middleware(FaultInjectionMiddleware)
+    app.post("/echo")(lambda: {"ok": True})
+    with patch("app.faults.get_fault_injector", return_value=injector):
+        statuses = [TestClient(app).post("/echo").status_code for _ in range(40)]
+    assert set(statuses) == {200, 502}
+
+def test_ndjson_events_are_processed_in_batches_and_fall_back_to_http():
+    import json
+    from unittest.mock import patch
+
+    events = [
+        {"type": "task_created", "message_id": f"ndjson-{i}",
+         "payload": {"task_id": 400 + i, "saga_id": f"ndjson-saga-{i}", "user_id": 40 + i % 2}}
+        for i in range(5)
+    ]
+    body = "\n".join(json.dumps(event) for event in events) + "\n[1, 2]\n"
+
+    # Sin RabbitMQ los resultados del lote van al Task Service en un envío NDJSON
+    with patch("app.main.rabbitmq_client", None), \
+            patch("app.main.FAILURE_RATE", 0), \
+            patch("app.main.NDJSON_BATCH_SIZE", 10), \
+            patch("app.main.publish_events_to_task_service", return_value=True) as publish:
+        response = client.post("/events", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert response.json()["received"] == 5
+    assert response.json()["errors"] == [{"line": 6, "error": "Invalid JSON: Each line must be a JSON object"}]
+    assert publish.call_count == 1
+    (results,) = publish.call_args.args
+    assert [message["type"] for message in results] == ["notification_sent"]
+    assert len(results[0]["payload"]["items"]) == 5
@@ -0,0 +1,115 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from sqlalchemy import delete, insert, literal, select
+from .models import Task, TaskArchive
+from .sync import record_task_changes
+from .cache import get_task_cache
+from .events import publish_event
+
+logger = logging.getLogger(__name__)
+
+TASK_ARCHIVE_AFTER_DAYS = int(os.getenv("TASK_ARCHIVE_AFTER_DAYS", "30"))
+TASK_ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "500"))
+TASK_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("TASK_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# Columnas compartidas por tasks y tasks_archive
+TASK_COLUMNS = [column.name for column in Task.__table__.columns]
+
+
+class TaskArchiver:
+    """
+    Mueve las tareas hechas más antiguas que la edad configurada a tasks_archive
+    Cada lote es INSERT ... SELECT + DELETE en una transacción, con las filas
+    bloqueadas (FOR UPDATE SKIP LOCKED) para no perder una edición concurrente
+    Los contadores de stats no cambian: archivar no es eliminar (una tarea
+    archivada se puede eliminar y entonces sí se descuenta)
+    Por cada tarea se publica task_deleted (archived=True): los caches de
+    las demás réplicas y los clientes la sacan del conjunto activo
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        age_days: int = TASK_ARCHIVE_AFTER_DAYS,
+        batch_size: int = TASK_ARCHIVE_BATCH_SIZE,
+        interval: float = TASK_ARCHIVE_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.age_days = age_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def archive_once(self, now: datetime = None) -> int:
+        """Archiva un lote. Retorna cuántas tareas se movieron"""
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=self.age_days)
+        db = self.session_factory()
+        try:
+            candidates = db.execute(
+                select(Task.id, Task.user_id).where(
+                    Task.status == "done",
+                    Task.updated_at < cutoff
+                ).order_by(Task.updated_at).limit(self.batch_size).with_for_update(skip_locked=True)
+            ).all()
+            if not candidates:
+                db.rollback()
+                return 0
+
+            ids = [row.id for row in candidates]
+            columns = [getattr(Task, name) for name in TASK_COLUMNS]
+            db.execute(
+                insert(TaskArchive).from_select(
+                    TASK_COLUMNS + ["archived_at"],
+                    select(*columns, literal(now)).where(Task.id.in_(ids))
+                )
+            )
+            db.execute(delete(Task).where(Task.id.in_(ids)), execution_options={"synchronize_session": False})
+            # Para la sincronización incremental la tarea sale del conjunto activo
+            record_task_changes(db, [(row.user_id, row.id, "delete") for row in candidates])
+            db.commit()
+
+            cache = get_task_cache()
+            for row in candidates:
+                cache.invalidate(row.id)
+                publish_event("task_deleted", {"task_id": row.id, "user_id": row.user_id, "archived": True})
+
+            logger.info(f"🗄️ Archived {len(ids)} done tasks older than {self.age_days} days")
+            return len(ids)
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"💥 Task archiving failed: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def run(self):
+        """Bucle del archivado: vacía los lotes pendientes y espera el intervalo"""
+        logger.info(f"🗄️ Task archiver running every {self.interval}s")
+        while not self._stop.is_set():
+            while self.archive_once() >= self.batch_size and not self._stop.is_set():
+                pass
+            self._stop.wait(self.interval)
+
+    def start_background(self):
+        """Iniciar el archivado en thread separado (no bloquea FastAPI)"""
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    # python -m app.archive  →  archiva todo lo pendiente una vez
+    from .database import get_shard_router
+
+    logging.basicConfig(level=logging.INFO)
+    for factory in get_shard_router().session_factories:
+        archiver = TaskArchiver(factory)
+        while archiver.archive_once() >= archiver.batch_size:
+            pass
@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime
+from pydantic import ValidationError
+from sqlalchemy import insert, literal, select, union_all
+from .database import get_shard_router, read_session
+from .models import Task, TaskArchive
+from .schemas import TaskCreate, TaskUpdate
+from .saga import allocate_task_ids, generate_task_code
+from .stats import apply_stat_deltas, stat_deltas, task_row
+from .sync import record_task_changes
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", "65536"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+EXPORT_COLUMNS = [
+    "id", "code", "title", "description", "status",
+    "category", "priority", "version", "created_at", "updated_at"
+]
+# Las tareas archivadas también se exportan, marcadas con archived
+EXPORT_FIELDS = EXPORT_COLUMNS + ["archived"]
+IMPORT_FIELDS = ("title", "description", "status", "category", "priority")
+
+
+# ========== Exportación ==========
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_tasks(user_id: int, fmt: str = "ndjson", batch_size: int = EXPORT_BATCH_SIZE, last_write: str = None):
+    """
+    Generador de la exportación: cursor del lado del servidor (stream_results)
+    leído por lotes, así la memoria no depende del número de tareas
+    Incluye tasks_archive (archived=True) en la misma consulta
+    La sesión vive dentro del generador, durante todo el streaming
+    """
+    db = read_session(user_id, last_write)
+    try:
+        combined = union_all(
+            select(*[getattr(Task, name) for name in EXPORT_COLUMNS], literal(False).label("archived"))
+            .where(Task.user_id == user_id),
+            select(*[getattr(TaskArchive, name) for name in EXPORT_COLUMNS], literal(True).label("archived"))
+            .where(TaskArchive.user_id == user_id)
+        ).subquery()
+        result = db.execute(
+            select(combined).order_by(combined.c.id),
+            execution_options={"stream_results": True, "yield_per": batch_size}
+        )
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            for rows in result.partitions():
+                writer.writerows([[_export_value(value) for value in row] for row in rows])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for rows in result.partitions():
+                yield "".join(
+                    json.dumps({name: _export_value(value) for name, value in zip(EXPORT_FIELDS, row)}) + "\n"
+                    for row in rows
+                )
+    finally:
+        db.close()
+
+
+# ========== Importación ==========
+async def iter_lines(chunks, max_line_bytes: int = IMPORT_MAX_LINE_BYTES):
+    """
+    Corta el cuerpo recibido en líneas a medida que llega
+    Una línea más larga que el límite se entrega como None (error de esa fila)
+    """
+    pending = b""
+    oversized = False
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if oversized:
+                oversized = False
+                yield None
+            else:
+                yield line.decode("utf-8", errors="replace").rstrip("\r")
+        if len(pending) > max_line_bytes:
+            pending = b""
+            oversized = True
+    if oversized:
+        yield None
+    elif pending.strip():
+        yield pending.decode("utf-8", errors="replace").rstrip("\r")
+
+
+async def iter_records(chunks, fmt: str = "ndjson"):
+    """
+    Registros (número, dict o error) del cuerpo en streaming
+    En CSV un registro puede ocupar varias líneas (campos entre comillas):
+    se completa cuando el número de comillas acumulado es par
+    """
+    header = None
+    record_lines = []
+    number = 0
+
+    async for line in iter_lines(chunks):
+        if line is None:
+            number += 1
+            record_lines = []
+            yield number, ValueError("Line too long")
+            continue
+
+        if fmt != "csv":
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("Each line must be a JSON object")
+                yield number, data
+            except ValueError as e:
+                yield number, ValueError(f"Invalid JSON: {str(e)}")
+            continue
+
+        record_lines.append(line)
+        record = "\n".join(record_lines)
+        if record.count('"') % 2:
+            continue
+        record_lines = []
+        if not record.strip():
+            continue
+
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        number += 1
+        yield number, dict(zip(header, values))
+
+    if record_lines:
+        yield number + 1, ValueError("Unterminated quoted field")
+
+
+def validate_import_row(data: dict) -> dict:
+    """Valida una fila con los mismos esquemas de la API. Lanza ValueError"""
+    fields = {
+        key: data[key] for key in IMPORT_FIELDS
+        if data.get(key) not in (None, "")
+    }
+    status = fields.pop("status", None)
+    try:
+        row = TaskCreate(**fields).dict()
+        row["status"] = TaskUpdate(status=status).status or "todo"
+    except ValidationError as e:
+        raise ValueError("; ".join(error["msg"] for error in e.errors()))
+
+    code = (data.get("code") or "").strip().upper()
+    row["code"] = code or None
+    created_at = data.get("created_at")
+    if created_at:
+        row["created_at"] = datetime.fromisoformat(created_at)
+    return row
+
+
+class TaskImporter:
+    """
+    Carga de una importación por lotes: cada lote es un INSERT multi-fila con
+    RETURNING (más los contadores y el registro de cambios) en una transacción
+    """
+
+    def __init__(self, user_id: int, batch_size: int = IMPORT_BATCH_SIZE, max_errors: int = IMPORT_MAX_ERRORS):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.pending = []
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": number, "error": message})
+
+    def add(self, number: int, data: dict) -> bool:
+        """Valida y encola una fila. True si el lote quedó listo para cargar"""
+        try:
+            self.pending.append((number, validate_import_row(data)))
+        except ValueError as e:
+            self.add_error(number, str(e))
+        return len(self.pending) >= self.batch_size
+
+    def flush(self):
+        """Inserta las filas encoladas (se llama desde un threadpool)"""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        db = None
+        try:
+            db = get_shard_router().session(self.user_id, write=True)
+            self._assign_codes(db, batch)
+            now = datetime.utcnow()
+            rows = [
+                dict(row, user_id=self.user_id, created_at=row.get("created_at") or now, updated_at=now)
+                for _, row in batch
+            ]
+            ids = allocate_task_ids(len(rows))
+            if ids[0] is not None:
+                for row, task_id in zip(rows, ids):
+                    row["id"] = task_id
+            inserted = db.execute(
+                insert(Task).returning(Task.id, Task.user_id, Task.status, Task.category, Task.priority),
+                rows
+            ).all()
+            apply_stat_deltas(db, stat_deltas(added=[task_row(row) for row in inserted]))
+            record_task_changes(db, [(self.user_id, row.id, "upsert") for row in inserted])
+            db.commit()
+            self.imported += len(inserted)
+        except Exception as e:
+            if db is not None:
+                db.rollback()
+            logger.error(f"💥 Import batch failed: {str(e)}")
+            for number, _ in batch:
+                self.add_error(number, f"Batch insert failed: {str(e)}")
+        finally:
+            if db is not None:
+                db.close()
+
+    def _assign_codes(self, db, batch: list):
+        """
+        Conserva el código importado si está libre; genera uno nuevo para
+        las filas sin código o cuyo código ya existe (una consulta por ronda)
+        """
+        seen = set()
+        for _, row in batch:
+            if not row["code"] or row["code"] in seen:
+                row["code"] = generate_task_code()
+            seen.add(row["code"])
+
+        while True:
+            codes = [row["code"] for _, row in batch]
+            taken = set(db.scalars(select(Task.code).where(Task.code.in_(codes))))
+            taken |= set(db.scalars(select(TaskArchive.code).where(TaskArchive.code.in_(codes))))
+            if not taken:
+                return
+            for _, row in batch:
+                if row["code"] in taken:
+                    row["code"] = generate_task_code()
+
+    def summary(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
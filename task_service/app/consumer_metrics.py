@@ -0,0 +1,183 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+import pika
+
+logger = logging.getLogger(__name__)
+
+# Ventana para el throughput (mensajes por segundo)
+CONSUMER_METRICS_WINDOW_SECONDS = float(os.getenv("CONSUMER_METRICS_WINDOW_SECONDS", "60"))
+
+# Límites del histograma de latencia del handler (ms); el último bucket es +inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Readiness: el servicio deja de estar listo si la cola acumula más que esto
+CONSUMER_LAG_MAX_MESSAGES = int(os.getenv("CONSUMER_LAG_MAX_MESSAGES", "1000"))
+CONSUMER_LAG_MAX_SECONDS = float(os.getenv("CONSUMER_LAG_MAX_SECONDS", "60"))
+
+# La profundidad de la cola se consulta al broker como mucho cada tantos segundos
+QUEUE_PROBE_TTL_SECONDS = float(os.getenv("QUEUE_PROBE_TTL_SECONDS", "2"))
+
+
+class ConsumerMetrics:
+    """
+    Métricas de un consumidor, actualizadas desde el thread de pika
+    - received / acked / nacked: contadores de mensajes
+    - unacked: recibidos y aún sin ACK/NACK (en proceso o esperando su lote)
+    - throughput: mensajes confirmados por segundo en la ventana
+    - histograma de latencia del handler (una observación por llamada)
+    """
+
+    def __init__(self, queue_name: str, window: float = CONSUMER_METRICS_WINDOW_SECONDS, clock=time.monotonic):
+        self.queue_name = queue_name
+        self.window = window
+        self.clock = clock
+        self.received_total = 0
+        self.acked_total = 0
+        self.nacked_total = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum_ms = 0.0
+        self.last_message_at = None
+        self._acked = deque()  # (instante, mensajes)
+        self._lock = Lock()
+
+    def received(self, count: int = 1):
+        with self._lock:
+            self.received_total += count
+            self.last_message_at = time.time()
+
+    def settled(self, count: int, seconds: float = None, ok: bool = True):
+        """count mensajes confirmados (ok) o rechazados, y la latencia del handler"""
+        now = self.clock()
+        with self._lock:
+            if ok:
+                self.acked_total += count
+                self._acked.append((now, count))
+            else:
+                self.nacked_total += count
+            if seconds is not None:
+                ms = seconds * 1000
+                self.buckets[bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+                self.latency_sum_ms += ms
+            self._trim(now)
+
+    def _trim(self, now: float):
+        while self._acked and now - self._acked[0][0] > self.window:
+            self._acked.popleft()
+
+    def throughput(self) -> float:
+        with self._lock:
+            self._trim(self.clock())
+            return sum(count for _, count in self._acked) / self.window
+
+    def latency_percentile(self, fraction: float):
+        """Límite superior del bucket que contiene el percentil (None sin datos)"""
+        total = sum(self.buckets)
+        if not total:
+            return None
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= total * fraction:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else "+Inf"
+
+    def snapshot(self) -> dict:
+        throughput = self.throughput()
+        with self._lock:
+            observations = sum(self.buckets)
+            return {
+                "received": self.received_total,
+                "acked": self.acked_total,
+                "nacked": self.nacked_total,
+                "unacked": self.received_total - self.acked_total - self.nacked_total,
+                "messages_per_second": round(throughput, 2),
+                "last_message_at": self.last_message_at,
+                "handler_latency_ms": {
+                    "count": observations,
+                    "avg": round(self.latency_sum_ms / observations, 2) if observations else None,
+                    "p50": self.latency_percentile(0.5),
+                    "p95": self.latency_percentile(0.95),
+                    "p99": self.latency_percentile(0.99),
+                    "buckets": dict(zip([*map(str, LATENCY_BUCKETS_MS), "+Inf"], self.buckets))
+                }
+            }
+
+
+class QueueProbe:
+    """
+    Profundidad y consumidores de una cola consultados al broker con una
+    conexión propia (la del consumidor no se puede usar desde otro thread)
+    El resultado se reutiliza durante QUEUE_PROBE_TTL_SECONDS
+    """
+
+    def __init__(self, rabbitmq_url: str, ttl: float = QUEUE_PROBE_TTL_SECONDS):
+        self.rabbitmq_url = rabbitmq_url
+        self.ttl = ttl
+        self._connection = None
+        self._channel = None
+        self._cache = {}
+        self._lock = Lock()
+
+    def queue_state(self, queue_name: str) -> dict:
+        with self._lock:
+            cached = self._cache.get(queue_name)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            try:
+                if self._channel is None or self._channel.is_closed:
+                    if self._connection is None or self._connection.is_closed:
+                        # Un solo intento corto: /health no debe quedarse esperando al broker
+                        parameters = pika.URLParameters(self.rabbitmq_url)
+                        parameters.connection_attempts = 1
+                        parameters.socket_timeout = 2
+                        self._connection = pika.BlockingConnection(parameters)
+                    self._channel = self._connection.channel()
+                method = self._channel.queue_declare(queue=queue_name, passive=True).method
+                state = {"depth": method.message_count, "consumers": method.consumer_count}
+            except Exception as e:
+                # Una cola inexistente cierra el canal: se reabre en la próxima consulta
+                self._channel = None
+                state = {"depth": None, "consumers": None, "error": str(e)}
+            self._cache[queue_name] = (time.monotonic(), state)
+            return state
+
+    def close(self):
+        with self._lock:
+            try:
+                if self._connection and not self._connection.is_closed:
+                    self._connection.close()
+            except Exception as e:
+                logger.error(f"Error closing queue probe: {str(e)}")
+            self._connection = self._channel = None
+
+
+def consumer_report(metrics: ConsumerMetrics, queue: dict, consuming: bool) -> dict:
+    """
+    Estado del consumidor de una cola, con readiness
+    lag_seconds estima cuánto tarda en vaciarse la cola al ritmo actual
+    Con mensajes esperando y ninguno confirmado en la ventana el lag no tiene
+    límite: lag_seconds es None, stalled es True y el consumidor no está listo
+    """
+    report = dict(metrics.snapshot(), queue=metrics.queue_name, consuming=consuming, **queue)
+    depth = queue.get("depth")
+    throughput = report["messages_per_second"]
+    report["lag_seconds"] = round(depth / throughput, 1) if depth is not None and throughput else None
+    report["stalled"] = bool(depth) and not throughput
+
+    reasons = []
+    if not consuming:
+        reasons.append("consumer is not running")
+    if depth is None:
+        reasons.append(f"queue depth unavailable: {queue.get('error', 'unknown')}")
+    elif depth > CONSUMER_LAG_MAX_MESSAGES:
+        reasons.append(f"{depth} messages waiting (max {CONSUMER_LAG_MAX_MESSAGES})")
+    elif report["stalled"]:
+        reasons.append(f"{depth} messages waiting and none acknowledged in the last {metrics.window:g}s")
+    elif report["lag_seconds"] is not None and report["lag_seconds"] > CONSUMER_LAG_MAX_SECONDS:
+        reasons.append(f"lag of {report['lag_seconds']}s (max {CONSUMER_LAG_MAX_SECONDS}s)")
+    report["ready"] = not reasons
+    report["not_ready_reasons"] = reasons
+    return report
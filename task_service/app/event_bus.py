@@ -1,76 +1,135 @@
 import httpx
+import json
 import logging
+import os
+import uuid
+from collections import deque
 from typing import Dict, Any
-import asyncio
-from threading import Thread
+from threading import Event, Lock, Thread
 
 logger = logging.getLogger(__name__)
 
+# Eventos encolados que se envían juntos en un cuerpo NDJSON
+EVENT_BUS_BATCH_SIZE = int(os.getenv("EVENT_BUS_BATCH_SIZE", "500"))
+EVENT_BUS_FLUSH_SECONDS = float(os.getenv("EVENT_BUS_FLUSH_SECONDS", "0.2"))
+EVENT_BUS_MAX_PENDING = int(os.getenv("EVENT_BUS_MAX_PENDING", "10000"))
+EVENT_BUS_TIMEOUT_SECONDS = float(os.getenv("EVENT_BUS_TIMEOUT_SECONDS", "5"))
+
+NDJSON_HEADERS = {"Content-Type": "application/x-ndjson"}
+
+
+def to_ndjson(events: list) -> bytes:
+    return "".join(json.dumps(event) + "\n" for event in events).encode()
+
+
 class EventBus:
     """
     Event Bus para Coreografía Pura
     Publicación asíncrona sin esperar respuesta (fire-and-forget)
+    Los eventos se acumulan y un thread los envía por lotes NDJSON
+    reutilizando las conexiones de un cliente HTTP compartido
     """
-    
-    NOTIFICATION_SERVICE_URL = "http://notification_service:8000"
-    
-    @staticmethod
-    def publish_async_fire_and_forget(event_type: str, payload: Dict[Any, Any]):
+
+    NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification_service:8000")
+    TASK_SERVICE_URL = os.getenv("TASK_SERVICE_URL", "http://task_service:8000")
+
+    _pending = deque()
+    _lock = Lock()
+    _wakeup = Event()
+    _thread = None
+    _client = None
+    _async_client = None
+
+    @classmethod
+    def publish_async_fire_and_forget(cls, event_type: str, payload: Dict[Any, Any]) -> bool:
         """
         Publica un evento de forma asíncrona sin esperar respuesta
         Fire-and-forget: el emisor no espera confirmación
+        Retorna False si el buffer está lleno y el evento se descarta
         """
-        def _publish():
+        with cls._lock:
+            if len(cls._pending) >= EVENT_BUS_MAX_PENDING:
+                logger.warning(f"⚠️ Event {event_type} dropped: {len(cls._pending)} events pending")
+                return False
+            # Con message_id el receptor descarta los reenvíos
+            cls._pending.append({"type": event_type, "message_id": uuid.uuid4().hex, "payload": payload})
+            if cls._thread is None:
+                cls._thread = Thread(target=cls._flush_loop, name="event-bus", daemon=True)
+                cls._thread.start()
+            if len(cls._pending) >= EVENT_BUS_BATCH_SIZE:
+                cls._wakeup.set()
+
+        logger.info(f"🚀 Event {event_type} dispatched asynchronously")
+        return True
+
+    @classmethod
+    def _flush_loop(cls):
+        while True:
+            cls._wakeup.wait(EVENT_BUS_FLUSH_SECONDS)
+            cls._wakeup.clear()
+            cls.flush()
+
+    @classmethod
+    def flush(cls) -> int:
+        """Envía lo pendiente en lotes de EVENT_BUS_BATCH_SIZE. Retorna los eventos entregados"""
+        delivered = 0
+        while True:
+            with cls._lock:
+                batch = [cls._pending.popleft() for _ in range(min(EVENT_BUS_BATCH_SIZE, len(cls._pending)))]
+            if not batch:
+                return delivered
             try:
-                logger.info(f"📤 Publishing event (fire-and-forget): {event_type}")
-                
-                # Usar requests en thread separado para no bloquear
-                import requests
-                requests.post(
-                    f"{EventBus.NOTIFICATION_SERVICE_URL}/events",
-                    json={
-                        "type": event_type,
-                        "payload": payload
-                    },
-                    timeout=2  # Timeout corto, no esperamos respuesta larga
+                response = cls.client().post(
+                    f"{cls.NOTIFICATION_SERVICE_URL}/events",
+                    content=to_ndjson(batch),
+                    headers=NDJSON_HEADERS
                 )
-                
-                logger.info(f"✅ Event {event_type} published (fire-and-forget)")
-                
+                response.raise_for_status()
+                delivered += len(batch)
+                logger.info(f"✅ {len(batch)} events published (fire-and-forget)")
             except Exception as e:
                 # En coreografía pura, los errores NO detienen el flujo
-                logger.warning(f"⚠️ Event {event_type} publish failed (expected in choreography): {str(e)}")
-        
-        # Ejecutar en thread separado para no bloquear
-        thread = Thread(target=_publish, daemon=True)
-        thread.start()
-        logger.info(f"🚀 Event {event_type} dispatched asynchronously")
-    
-    @staticmethod
-    async def publish_to_task_service(event_type: str, payload: Dict[Any, Any]) -> bool:
+                logger.warning(f"⚠️ Publish of {len(batch)} events failed (expected in choreography): {str(e)}")
+
+    @classmethod
+    def client(cls) -> httpx.Client:
+        if cls._client is None:
+            cls._client = httpx.Client(timeout=EVENT_BUS_TIMEOUT_SECONDS)
+        return cls._client
+
+    @classmethod
+    def async_client(cls) -> httpx.AsyncClient:
+        if cls._async_client is None:
+            cls._async_client = httpx.AsyncClient(timeout=EVENT_BUS_TIMEOUT_SECONDS)
+        return cls._async_client
+
+    @classmethod
+    async def publish_to_task_service(cls, event_type: str, payload: Dict[Any, Any]) -> bool:
         """
         Publica eventos HACIA el Task Service (para compensaciones)
         Usado por otros servicios para notificar al Task Service
         """
+        return await cls.publish_many_to_task_service([{"type": event_type, "payload": payload}])
+
+    @classmethod
+    async def publish_many_to_task_service(cls, events: list) -> bool:
+        """Varios eventos en una sola petición NDJSON"""
         try:
-            logger.info(f"📤 Publishing to Task Service: {event_type}")
-            
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.post(
-                    "http://task_service:8000/events",
-                    json={
-                        "type": event_type,
-                        "payload": payload
-                    }
-                )
-                
-                if response.status_code == 200:
-                    logger.info(f"✅ Event {event_type} delivered to Task Service")
-                    return True
-                else:
-                    logger.error(f"❌ Failed to deliver {event_type}: {response.status_code}")
-                    return False
-                    
+            logger.info(f"📤 Publishing {len(events)} events to Task Service")
+
+            response = await cls.async_client().post(
+                f"{cls.TASK_SERVICE_URL}/tasks/events",
+                content=to_ndjson(events),
+                headers=NDJSON_HEADERS
+            )
+
+            if response.status_code == 200:
+                logger.info(f"✅ {len(events)} events delivered to Task Service")
+                return True
+            else:
+                logger.error(f"❌ Failed to deliver {len(events)} events: {response.status_code}")
+                return False
+
         except Exception as e:
             logger.error(f"💥 Error publishing to Task Service: {str(e)}")
-            return False
\ No newline at end of file
+            return False
@@ -1,2 +1,42 @@
+import logging
+from .rabbitmq_client import get_rabbitmq_client
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_EXCHANGE = "task_events"
+
+
+def serialize_task(task) -> dict:
+    """Representación de una tarea para los payloads de eventos"""
+    return {
+        "task_id": task.id,
+        "id": task.id,
+        "user_id": task.user_id,
+        "title": task.title,
+        "description": task.description,
+        "status": task.status,
+        "category": task.category,
+        "priority": task.priority,
+        "code": task.code,
+        "saga_id": task.saga_id,
+        "version": task.version,
+        "created_at": task.created_at.isoformat() if task.created_at else None,
+        "updated_at": task.updated_at.isoformat() if task.updated_at else None
+    }
+
+
 def publish_event(event_type: str, payload: dict):
-    print(f"📢 EVENT: {event_type} | DATA: {payload}")
+    """
+    Publica un evento de dominio en task_events (ej: task_updated -> task.updated)
+    Best effort: la operación ya se confirmó en la DB, un fallo del broker no la revierte
+    """
+    routing_key = event_type.replace("_", ".", 1)
+
+    try:
+        get_rabbitmq_client().publish(
+            exchange=TASK_EVENTS_EXCHANGE,
+            routing_key=routing_key,
+            message={"type": event_type, "payload": payload}
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ Could not publish {event_type}: {str(e)}")
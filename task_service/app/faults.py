@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import time
+from fnmatch import fnmatchcase
+from threading import Lock
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Inyección de fallos y latencia para pruebas de carga (desactivada por defecto)
+FAULTS_ENABLED = os.getenv("FAULTS_ENABLED", "false").lower() == "true"
+
+# Configuración inicial en JSON (la misma que acepta PUT /config/faults)
+FAULTS_CONFIG = os.getenv("FAULTS_CONFIG", "")
+
+# z del percentil 99 de una normal: para pasar de (mediana, p99) a sigma
+P99_Z = 2.326
+
+
+class InjectedFault(Exception):
+    """Fallo provocado por una regla de inyección"""
+
+
+class LatencyDistribution:
+    """
+    Retardo en segundos según una distribución
+    - fixed: {"ms"}
+    - uniform: {"min_ms", "max_ms"}
+    - long_tail: log-normal con {"median_ms", "p99_ms"} y tope opcional "max_ms"
+    """
+
+    def __init__(self, config: dict):
+        self.kind = config.get("distribution", "fixed")
+        if self.kind == "fixed":
+            self.ms = float(config.get("ms", 0))
+        elif self.kind == "uniform":
+            self.min_ms = float(config.get("min_ms", 0))
+            self.max_ms = float(config["max_ms"])
+            if self.max_ms < self.min_ms:
+                raise ValueError("max_ms must be >= min_ms")
+        elif self.kind == "long_tail":
+            median, p99 = float(config["median_ms"]), float(config["p99_ms"])
+            if not 0 < median <= p99:
+                raise ValueError("long_tail needs 0 < median_ms <= p99_ms")
+            self.mu = math.log(median)
+            self.sigma = math.log(p99 / median) / P99_Z
+            self.max_ms = float(config.get("max_ms", p99 * 10))
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.kind}")
+        self.config = config
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            ms = self.ms
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.min_ms, self.max_ms)
+        else:
+            ms = min(self.max_ms, rng.lognormvariate(self.mu, self.sigma))
+        return ms / 1000
+
+
+class FaultRule:
+    """
+    Regla de inyección
+    - match: "route:POST /tasks*" o "event:task_created" (patrones fnmatch)
+    - failure_rate: probabilidad de fallo (0 a 1)
+    - latency: distribución del retardo añadido (ver LatencyDistribution)
+    - status_code: respuesta de las rutas que fallan (503 por defecto)
+    - window: {"start_s", "duration_s", "every_s"} relativo al momento de la
+      configuración; con every_s la ventana se repite periódicamente
+    """
+
+    def __init__(self, config: dict, seed, index: int):
+        self.match = config["match"]
+        if not self.match.startswith(("route:", "event:")):
+            raise ValueError(f"Rule match must start with 'route:' or 'event:': {self.match}")
+        self.failure_rate = float(config.get("failure_rate", 0))
+        if not 0 <= self.failure_rate <= 1:
+            raise ValueError("failure_rate must be between 0 and 1")
+        self.latency = LatencyDistribution(config["latency"]) if config.get("latency") else None
+        self.status_code = int(config.get("status_code", 503))
+        window = config.get("window") or {}
+        self.start = float(window.get("start_s", 0))
+        self.duration = float(window["duration_s"]) if "duration_s" in window else None
+        self.every = float(window["every_s"]) if "every_s" in window else None
+        self.config = config
+        # Un generador por regla: con semilla, cada regla repite su secuencia
+        # aunque cambie el orden en que llegan rutas y eventos
+        self.rng = random.Random(f"{seed}:{index}:{self.match}" if seed is not None else None)
+        self.injected = 0
+        self.delayed = 0
+
+    def matches(self, target: str) -> bool:
+        return fnmatchcase(target, self.match)
+
+    def active(self, elapsed: float) -> bool:
+        """¿Está dentro de su ventana, elapsed segundos después de configurarse?"""
+        offset = elapsed - self.start
+        if offset < 0:
+            return False
+        if self.every:
+            offset %= self.every
+        return self.duration is None or offset < self.duration
+
+    def decide(self) -> tuple:
+        """(retardo en segundos, falla)"""
+        delay = self.latency.sample(self.rng) if self.latency else 0.0
+        fail = self.failure_rate > 0 and self.rng.random() < self.failure_rate
+        self.delayed += delay > 0
+        self.injected += fail
+        return delay, fail
+
+
+class FaultInjector:
+    """
+    Reglas de fallos y latencia por ruta y por tipo de evento
+    Para cada ruta o evento se aplica la primera regla activa que coincide
+    """
+
+    def __init__(self, enabled: bool = FAULTS_ENABLED, clock=time.monotonic):
+        self.enabled = enabled
+        self.clock = clock
+        self.seed = None
+        self.rules = []
+        self.configured_at = clock()
+        self._lock = Lock()
+
+    def configure(self, config: dict):
+        """Reemplaza las reglas; lanza ValueError si la configuración no es válida"""
+        seed = config.get("seed")
+        try:
+            rules = [FaultRule(rule, seed, index) for index, rule in enumerate(config.get("rules", []))]
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid fault rule: {str(e)}")
+        with self._lock:
+            self.seed, self.rules, self.configured_at = seed, rules, self.clock()
+        logger.warning(f"🧪 Fault injection configured: {len(rules)} rules (seed={seed})")
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "seed": self.seed,
+            "elapsed_s": round(self.clock() - self.configured_at, 3),
+            "rules": [
+                dict(rule.config, injected=rule.injected, delayed=rule.delayed)
+                for rule in self.rules
+            ]
+        }
+
+    def decide(self, target: str):
+        """(retardo, falla, regla) para "route:..." o "event:..."; None si no aplica ninguna"""
+        if not self.enabled or not self.rules:
+            return None
+        with self._lock:
+            elapsed = self.clock() - self.configured_at
+            for rule in self.rules:
+                if rule.matches(target) and rule.active(elapsed):
+                    delay, fail = rule.decide()
+                    return delay, fail, rule
+        return None
+
+    def inject_event(self, event_type: str):
+        """
+        Para consumidores síncronos: espera el retardo y lanza InjectedFault
+        si la regla decide que el evento falla
+        """
+        decision = self.decide(f"event:{event_type}")
+        if decision is None:
+            return
+        delay, fail, rule = decision
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise InjectedFault(f"Injected fault for event {event_type} ({rule.match})")
+
+    async def inject_route(self, method: str, path: str):
+        """Para rutas: espera sin bloquear el event loop; retorna la regla si la petición falla"""
+        decision = self.decide(f"route:{method} {path}")
+        if decision is None:
+            return None
+        delay, fail, rule = decision
+        if delay:
+            await asyncio.sleep(delay)
+        return rule if fail else None
+
+
+class FaultInjectionMiddleware(BaseHTTPMiddleware):
+    """Aplica las reglas "route:" antes de llegar al endpoint"""
+
+    async def dispatch(self, request: Request, call_next):
+        # La propia configuración nunca se ve afectada
+        if request.url.path != "/config/faults":
+            rule = await get_fault_injector().inject_route(request.method, request.url.path)
+            if rule is not None:
+                return JSONResponse(
+                    status_code=rule.status_code,
+                    content={"detail": f"Injected fault ({rule.match})"}
+                )
+        return await call_next(request)
+
+
+router = APIRouter()
+
+
+@router.get("/config/faults")
+def get_faults():
+    return get_fault_injector().snapshot()
+
+
+@router.put("/config/faults")
+def set_faults(config: dict):
+    """
+    Reemplaza las reglas en caliente. Ejemplo:
+    {"seed": 42, "rules": [
+        {"match": "event:task_created", "failure_rate": 0.5, "window": {"duration_s": 30, "every_s": 120}},
+        {"match": "route:GET /tasks*", "latency": {"distribution": "long_tail", "median_ms": 20, "p99_ms": 800}}
+    ]}
+    """
+    injector = get_fault_injector()
+    if not injector.enabled:
+        raise HTTPException(status_code=403, detail="Fault injection is disabled (FAULTS_ENABLED)")
+    try:
+        injector.configure(config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return injector.snapshot()
+
+
+# ========== Singleton Global ==========
+_fault_injector = None
+
+def get_fault_injector() -> FaultInjector:
+    """Obtener la instancia singleton del inyector de fallos"""
+    global _fault_injector
+    if _fault_injector is None:
+        _fault_injector = FaultInjector()
+        if FAULTS_ENABLED and FAULTS_CONFIG:
+            _fault_injector.configure(json.loads(FAULTS_CONFIG))
+    return _fault_injector
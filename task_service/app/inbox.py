@@ -0,0 +1,207 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import ProcessedMessage
+
+logger = logging.getLogger(__name__)
+
+INBOX_TTL_SECONDS = int(os.getenv("INBOX_TTL_SECONDS", "604800"))  # 7 días
+INBOX_CACHE_SIZE = int(os.getenv("INBOX_CACHE_SIZE", "10000"))
+INBOX_PURGE_INTERVAL_SECONDS = int(os.getenv("INBOX_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+class LRUCache:
+    """Conjunto LRU acotado de IDs de mensajes, seguro entre threads"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return True
+            return False
+
+    def add(self, key: str):
+        with self._lock:
+            self._items[key] = None
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+# Filas del inbox pendientes en una sesión (ver MessageInbox.stage)
+INBOX_PENDING = "inbox_pending"
+
+
+class DuplicateMessage(Exception):
+    """Otro consumidor ya registró el mensaje: el efecto del handler se revirtió"""
+
+
+def commit_processed(db: Session):
+    """
+    Commit del efecto de un handler junto con las filas del inbox que la
+    sesión tenga pendientes: o se confirman las dos cosas o ninguna
+    Un IntegrityError en esas filas significa que el mensaje ya se procesó
+    (p. ej. una redelivery concurrente): se revierte y lanza DuplicateMessage
+    """
+    rows = db.info.pop(INBOX_PENDING, [])
+    try:
+        if rows:
+            db.execute(insert(ProcessedMessage), rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if rows:
+            raise DuplicateMessage(f"Messages already processed: {[row['message_id'] for row in rows]}")
+        raise
+
+
+class MessageInbox:
+    """
+    Dedup store para consumidores idempotentes
+    LRU en memoria delante de la tabla processed_messages (con TTL):
+    un duplicado reciente cuesta una búsqueda en memoria, sin ir a la DB
+    """
+
+    def __init__(
+        self,
+        consumer: str,
+        cache_size: int = INBOX_CACHE_SIZE,
+        ttl_seconds: int = INBOX_TTL_SECONDS
+    ):
+        self.consumer = consumer
+        self.ttl_seconds = ttl_seconds
+        self.cache = LRUCache(cache_size)
+        self._last_purge = time.monotonic()
+
+    def already_processed(self, db: Session, message_id: str) -> bool:
+        """Indica si el mensaje ya fue procesado (memoria primero, luego DB)"""
+        if not message_id:
+            return False
+
+        if message_id in self.cache:
+            return True
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        found = db.query(ProcessedMessage.message_id).filter(
+            ProcessedMessage.message_id == message_id,
+            ProcessedMessage.processed_at >= cutoff
+        ).first()
+
+        if found:
+            self.cache.add(message_id)
+            return True
+        return False
+
+    def stage(self, db: Session, messages: list):
+        """
+        Deja los mensajes pendientes de registrar en la sesión (sin escribir):
+        el handler los confirma con commit_processed en la misma transacción
+        que su efecto, así un fallo entre ambos no lo ejecuta dos veces
+        """
+        now = datetime.utcnow()
+        db.info.setdefault(INBOX_PENDING, []).extend(
+            {
+                "message_id": message["message_id"],
+                "consumer": self.consumer,
+                "user_id": (message.get("payload") or {}).get("user_id"),
+                "processed_at": now
+            }
+            for message in messages if message.get("message_id")
+        )
+
+    def discard(self, db: Session):
+        """El handler falló: los mensajes no se registran y su reintento se procesa"""
+        db.info.pop(INBOX_PENDING, None)
+
+    def complete(self, db: Session, messages: list) -> bool:
+        """
+        El handler terminó bien: confirma las filas que no hayan salido con su
+        commit (p. ej. un resultado tardío ignorado sin escribir nada)
+        Retorna False si ya estaban registradas (duplicado concurrente)
+        """
+        try:
+            commit_processed(db)
+        except DuplicateMessage:
+            return False
+        finally:
+            for message in messages:
+                if message.get("message_id"):
+                    self.cache.add(message["message_id"])
+        self._maybe_purge(db)
+        return True
+
+    def filter_unprocessed(self, db: Session, messages: list) -> list:
+        """
+        Versión por lotes de already_processed: descarta duplicados en memoria
+        y resuelve el resto con una sola consulta IN contra el inbox
+        """
+        fresh = []
+        batch_ids = set()
+        for message in messages:
+            message_id = message.get("message_id")
+            if message_id:
+                if message_id in self.cache or message_id in batch_ids:
+                    continue
+                batch_ids.add(message_id)
+            fresh.append(message)
+
+        if not batch_ids:
+            return fresh
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        processed = {
+            message_id for (message_id,) in db.query(ProcessedMessage.message_id).filter(
+                ProcessedMessage.message_id.in_(batch_ids),
+                ProcessedMessage.processed_at >= cutoff
+            )
+        }
+        for message_id in processed:
+            self.cache.add(message_id)
+
+        return [message for message in fresh if message.get("message_id") not in processed]
+
+    def purge_expired(self, db: Session) -> int:
+        """Elimina las filas del inbox cuyo TTL ya expiró"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        deleted = db.query(ProcessedMessage).filter(
+            ProcessedMessage.processed_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        if deleted:
+            logger.info(f"🧹 Purged {deleted} expired inbox entries")
+        return deleted
+
+    def _maybe_purge(self, db: Session):
+        now = time.monotonic()
+        if now - self._last_purge < INBOX_PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+
+        try:
+            self.purge_expired(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to purge inbox: {str(e)}")
+
+
+# ========== Singleton Global ==========
+_inbox = None
+
+def get_inbox() -> MessageInbox:
+    """Obtener instancia singleton del inbox del Task Service"""
+    global _inbox
+    if _inbox is None:
+        _inbox = MessageInbox(consumer="task_service_notifications")
+    return _inbox
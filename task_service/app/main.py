@@ -1,19 +1,61 @@
 from fastapi import FastAPI
-from .database import Base, engine, SessionLocal
-from .routes import router
+from fastapi.responses import JSONResponse
+from .database import Base, engine, shard_engines, get_shard_router, upgrade_existing_tables
+from .routes import router, process_event_batch
 from .rabbitmq_client import get_rabbitmq_client
+from .consumer_metrics import QueueProbe, consumer_report
 from .saga import SagaCompensationHandler
+from .inbox import DuplicateMessage, get_inbox
+from .sweeper import SagaTimeoutSweeper
+from .partitions import SagaLogPartitionManager, prepare_saga_logs_table
+from .cache import CacheInvalidationListener, get_task_cache
+from .archive import TaskArchiver
+from .faults import FAULTS_ENABLED, FaultInjectionMiddleware, get_fault_injector
+from .faults import router as faults_router
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
+# Modo de consumo por lotes (1 = mensaje a mensaje)
+CONSUMER_BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "1"))
+CONSUMER_BATCH_TIMEOUT = float(os.getenv("CONSUMER_BATCH_TIMEOUT", "0.2"))
+
+SAGA_SWEEPER_ENABLED = os.getenv("SAGA_SWEEPER_ENABLED", "true").lower() == "true"
+SAGA_LOG_MAINTENANCE_ENABLED = os.getenv("SAGA_LOG_MAINTENANCE_ENABLED", "true").lower() == "true"
+TASK_ARCHIVE_ENABLED = os.getenv("TASK_ARCHIVE_ENABLED", "true").lower() == "true"
+
+NOTIFICATION_QUEUE = "task_service_notifications"
+
+NOTIFICATION_ROUTING_KEYS = [
+    ("notification_events", "notification.failed"),
+    ("notification_events", "notification.sent")
+]
+
+# Crear tablas en cada shard y en el directorio (saga_logs particionada en PostgreSQL)
+for shard_engine in dict.fromkeys([engine, *shard_engines]):
+    prepare_saga_logs_table(shard_engine)
+    Base.metadata.create_all(bind=shard_engine)
+    upgrade_existing_tables(shard_engine, Base.metadata)
 
 app = FastAPI(title="Task Service")
 
 app.include_router(router)
+app.include_router(faults_router)
+if FAULTS_ENABLED:
+    app.add_middleware(FaultInjectionMiddleware)
+
+# Cliente del consumidor y sonda de la cola (los lee /health); None sin RabbitMQ
+consumer_client = None
+queue_probe = None
+
+# Los trabajos de fondo corren una instancia por shard
+shard_sessions = get_shard_router().session_factories
+saga_sweepers = [SagaTimeoutSweeper(factory) for factory in shard_sessions]
+saga_log_maintenances = [SagaLogPartitionManager(factory) for factory in shard_sessions]
+cache_invalidation = CacheInvalidationListener(get_task_cache())
+task_archivers = [TaskArchiver(factory) for factory in shard_sessions]
 
 
 # ========== Consumidor de RabbitMQ ==========
@@ -21,54 +63,125 @@ def process_notification_event(message: dict):
     """
     Callback para procesar eventos del Notification Service
     """
+    if "items" in message.get("payload", {}):
+        process_notification_batch([message])
+        return
+    
     event_type = message.get("type")
     payload = message.get("payload", {})
+    message_id = message.get("message_id")
     
     logger.info(f"📨 Processing event from RabbitMQ: {event_type}")
     
-    # Crear una sesión de DB para este procesamiento
-    db = SessionLocal()
+    # 🧪 Un fallo inyectado hace que el mensaje vuelva a la cola (NACK con requeue)
+    get_fault_injector().inject_event(event_type)
+    
+    # Sesión en el shard del usuario de la saga (si está migrando, el
+    # mensaje vuelve a la cola y se reintenta)
+    db = get_shard_router().session(payload.get("user_id"), write=True)
+    inbox = get_inbox()
     
     try:
-        if event_type == "notification_failed":
-            SagaCompensationHandler.handle_notification_failed(db, payload)
-            
-        elif event_type == "notification_sent":
-            SagaCompensationHandler.handle_notification_sent(db, payload)
-            
-        else:
-            logger.warning(f"⚠️ Unknown event type: {event_type}")
+        # Consumidor idempotente: ignorar redeliveries ya procesadas
+        if inbox.already_processed(db, message_id):
+            logger.info(f"♻️ Duplicate message {message_id} ignored ({event_type})")
+            return
+        
+        # El inbox se confirma en la misma transacción que el efecto del handler
+        inbox.stage(db, [message])
+        try:
+            if event_type == "notification_failed":
+                success = SagaCompensationHandler.handle_notification_failed(db, payload)
+            elif event_type == "notification_sent":
+                success = SagaCompensationHandler.handle_notification_sent(db, payload)
+            else:
+                logger.warning(f"⚠️ Unknown event type: {event_type}")
+                success = True
+        except DuplicateMessage:
+            logger.info(f"♻️ Duplicate message {message_id} ignored ({event_type})")
+            return
+        
+        if not success:
+            # Sin registrar en el inbox: el mensaje vuelve a la cola y se reintenta
+            inbox.discard(db)
+            raise RuntimeError(f"Handling {event_type} failed, message will be retried")
+        inbox.complete(db, [message])
     
     finally:
         db.close()
 
 
+def process_notification_batch(messages: list):
+    """
+    Callback para procesar micro-lotes de eventos del Notification Service
+    Compensa o confirma N sagas con operaciones masivas, una sesión por shard
+    """
+    logger.info(f"📨 Processing batch of {len(messages)} events from RabbitMQ")
+    
+    # 🧪 Un fallo inyectado devuelve el lote entero a la cola
+    for message in messages:
+        get_fault_injector().inject_event(message.get("type"))
+    
+    process_event_batch(messages)
+
+
 @app.on_event("startup")
 def startup_event():
     """
     Iniciar consumidor de RabbitMQ al arrancar FastAPI
     """
+    # Las particiones del día deben existir antes de las primeras escrituras
+    if SAGA_LOG_MAINTENANCE_ENABLED:
+        for maintenance in saga_log_maintenances:
+            maintenance.ensure_partitions()
+    
+    global consumer_client, queue_probe
+    
     try:
         logger.info("🚀 Starting Task Service...")
         
         # Obtener cliente de RabbitMQ
         rabbitmq = get_rabbitmq_client()
+        consumer_client = rabbitmq
+        queue_probe = QueueProbe(rabbitmq.rabbitmq_url)
         
         # Iniciar consumidor en background (no bloquea FastAPI)
-        rabbitmq.start_consuming_background(
-            queue_name="task_service_notifications",
-            callback=process_notification_event,
-            routing_keys=[
-                ("notification_events", "notification.failed"),
-                ("notification_events", "notification.sent")
-            ]
-        )
+        if CONSUMER_BATCH_SIZE > 1:
+            rabbitmq.start_batch_consuming_background(
+                queue_name=NOTIFICATION_QUEUE,
+                callback=process_notification_batch,
+                routing_keys=NOTIFICATION_ROUTING_KEYS,
+                batch_size=CONSUMER_BATCH_SIZE,
+                batch_timeout=CONSUMER_BATCH_TIMEOUT
+            )
+        else:
+            rabbitmq.start_consuming_background(
+                queue_name=NOTIFICATION_QUEUE,
+                callback=process_notification_event,
+                routing_keys=NOTIFICATION_ROUTING_KEYS
+            )
         
         logger.info("✅ RabbitMQ consumer started successfully")
         
     except Exception as e:
         logger.error(f"💥 Failed to start RabbitMQ consumer: {str(e)}")
         logger.warning("⚠️ Task Service running WITHOUT RabbitMQ consumer")
+    
+    # El sweeper cierra sagas sin respuesta aunque RabbitMQ no esté disponible
+    if SAGA_SWEEPER_ENABLED:
+        for sweeper in saga_sweepers:
+            sweeper.start_background()
+    
+    if SAGA_LOG_MAINTENANCE_ENABLED:
+        for maintenance in saga_log_maintenances:
+            maintenance.start_background()
+    
+    if get_task_cache().enabled:
+        cache_invalidation.start_background()
+    
+    if TASK_ARCHIVE_ENABLED:
+        for archiver in task_archivers:
+            archiver.start_background()
 
 
 @app.on_event("shutdown")
@@ -76,7 +189,13 @@ def shutdown_event():
     """
     Cerrar conexiones al detener FastAPI
     """
+    for job in [*saga_sweepers, *saga_log_maintenances, *task_archivers]:
+        job.stop()
+    cache_invalidation.stop()
+    
     try:
+        if queue_probe:
+            queue_probe.close()
         rabbitmq = get_rabbitmq_client()
         rabbitmq.close()
         logger.info("👋 RabbitMQ connection closed")
@@ -84,6 +203,35 @@ def shutdown_event():
         logger.error(f"Error during shutdown: {str(e)}")
 
 
+def consumer_status() -> dict:
+    """Profundidad, consumidores, throughput, latencias y unacked de la cola de notificaciones"""
+    if consumer_client is None:
+        return None
+    return consumer_report(
+        consumer_client.consumer_metrics(NOTIFICATION_QUEUE),
+        queue_probe.queue_state(NOTIFICATION_QUEUE),
+        consumer_client.is_consuming
+    )
+
+
 @app.get("/health")
 def health():
-    return {"status": "task service running", "rabbitmq": "connected"}
\ No newline at end of file
+    connected = consumer_client is not None and consumer_client.connection is not None and not consumer_client.connection.is_closed
+    return {
+        "status": "task service running",
+        "rabbitmq": "connected" if connected else "disconnected",
+        "consumer": consumer_status()
+    }
+
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness: falla (503) sin consumidor o si la cola acumula más lag del
+    permitido (CONSUMER_LAG_MAX_MESSAGES / CONSUMER_LAG_MAX_SECONDS)
+    """
+    status = consumer_status()
+    if status is None or not status["ready"]:
+        reasons = status["not_ready_reasons"] if status else ["RabbitMQ consumer not started"]
+        return JSONResponse(status_code=503, content={"ready": False, "reasons": reasons, "consumer": status})
+    return {"ready": True, "consumer": status}
\ No newline at end of file
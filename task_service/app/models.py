@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index, text
 from datetime import datetime
 from .database import Base
 
@@ -19,6 +19,38 @@ class Task(Base):
     saga_id = Column(String, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # concurrencia optimista
+
+    __table_args__ = (
+        # Candidatas al archivado: índice parcial, solo cubre las tareas hechas
+        Index(
+            "ix_tasks_done_updated_at", "updated_at",
+            postgresql_where=text("status = 'done'"),
+            sqlite_where=text("status = 'done'")
+        ),
+    )
+
+
+class TaskArchive(Base):
+    """
+    Tareas hechas movidas fuera de la tabla caliente por el job de archivado
+    Mismas columnas que tasks (conserva id y código) más archived_at
+    """
+    __tablename__ = "tasks_archive"
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String, nullable=False)
+    description = Column(String)
+    status = Column(String)
+    category = Column(String)
+    priority = Column(String)
+    code = Column(String, unique=True, index=True)
+    user_id = Column(Integer, index=True)
+    saga_id = Column(String)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))
+    archived_at = Column(DateTime, default=datetime.utcnow)
 
 
 class SagaLog(Base):
@@ -32,7 +64,148 @@ class SagaLog(Base):
     saga_id = Column(String, nullable=False, index=True)
     status = Column(String, nullable=False)
     details = Column(Text)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        # Timeline de una saga y paginación keyset filtrada por saga
+        Index("ix_saga_logs_saga_id_id", "saga_id", "id"),
+    )
     
     def __repr__(self):
-        return f"<SagaLog {self.saga_id} - {self.status}>"
\ No newline at end of file
+        return f"<SagaLog {self.saga_id} - {self.status}>"
+
+
+class SagaLogPartition(Base):
+    """
+    Registro de particiones por tiempo de saga_logs
+    En PostgreSQL cada fila es una tabla PARTITION OF saga_logs; en otros
+    motores es un rango lógico de timestamp (partición simulada)
+    """
+    __tablename__ = "saga_log_partitions"
+
+    name = Column(String, primary_key=True)
+    range_start = Column(DateTime, nullable=False)
+    range_end = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<SagaLogPartition {self.name}>"
+
+
+class Saga(Base):
+    """
+    Estado actual de cada SAGA (una fila por saga, actualizada en sitio)
+    saga_logs conserva el historial; esta tabla evita recorrerlo
+    """
+    __tablename__ = "sagas"
+
+    saga_id = Column(String, primary_key=True)
+    task_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True)
+    state = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    # Límite para cerrar la saga; NULL cuando ya terminó (o fue reclamada por el sweeper)
+    deadline = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_sagas_state_updated_at", "state", "updated_at"),
+        # Índice parcial: solo las sagas pendientes, el sweeper nunca hace full scan
+        Index(
+            "ix_sagas_deadline",
+            "deadline",
+            postgresql_where=text("deadline IS NOT NULL"),
+            sqlite_where=text("deadline IS NOT NULL")
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Saga {self.saga_id} - {self.state}>"
+
+class ProcessedMessage(Base):
+    """
+    Inbox de mensajes ya procesados (deduplicación de consumidores)
+    Las filas expiran tras INBOX_TTL_SECONDS y se purgan periódicamente
+    user_id es el usuario de la saga: sus filas migran con él entre shards
+    """
+    __tablename__ = "processed_messages"
+
+    message_id = Column(String, primary_key=True)
+    consumer = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=True, index=True)
+    processed_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<ProcessedMessage {self.message_id} - {self.consumer}>"
+
+
+class TaskStat(Base):
+    """
+    Contadores de tareas por usuario, mantenidos de forma incremental
+    dimension: total | status | category | priority
+    """
+    __tablename__ = "task_stats"
+
+    user_id = Column(Integer, primary_key=True)
+    dimension = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TaskStat {self.user_id} {self.dimension}={self.value}: {self.count}>"
+
+
+class TaskChange(Base):
+    """
+    Registro de cambios de tareas para sincronización incremental
+    El id ordena los cambios al insertarse, no al confirmarse (ver
+    TASK_CHANGES_SETTLE_SECONDS en sync.py); las filas "delete" son tombstones
+    """
+    __tablename__ = "task_changes"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)  # upsert | delete
+    changed_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # Posición en el shard anterior si la fila llegó al migrar al usuario
+    origin_shard = Column(Integer, nullable=True)
+    origin_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_task_changes_user_id_id", "user_id", "id"),
+        {"sqlite_autoincrement": True}  # los ids no se reutilizan tras una purga
+    )
+
+    def __repr__(self):
+        return f"<TaskChange {self.id} {self.operation} task {self.task_id}>"
+
+
+class UserShard(Base):
+    """
+    Directorio de shards: ubicación explícita de un usuario (tras un resharding)
+    Los usuarios sin fila viven en el shard que indica el hash estable
+    state: active | moving (durante una migración se rechazan escrituras)
+    """
+    __tablename__ = "user_shards"
+
+    user_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, nullable=False)
+    state = Column(String, nullable=False, default="active")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<UserShard {self.user_id} → {self.shard} ({self.state})>"
+
+
+class IdBlock(Base):
+    """
+    Asignador de ids globales por bloques (hi/lo) para tablas repartidas en shards
+    next_id es el primer id aún no reservado por ningún proceso
+    """
+    __tablename__ = "id_blocks"
+
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<IdBlock {self.name}: {self.next_id}>"
@@ -0,0 +1,243 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from sqlalchemy import func, inspect, text, update
+from .models import Saga, SagaLog, SagaLogPartition
+from .saga import TERMINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+SAGA_LOG_PARTITION_DAYS = int(os.getenv("SAGA_LOG_PARTITION_DAYS", "1"))
+SAGA_LOG_RETENTION_DAYS = int(os.getenv("SAGA_LOG_RETENTION_DAYS", "30"))
+SAGA_LOG_PRECREATE_PARTITIONS = int(os.getenv("SAGA_LOG_PRECREATE_PARTITIONS", "2"))
+SAGA_LOG_COMPACTION_ENABLED = os.getenv("SAGA_LOG_COMPACTION_ENABLED", "false").lower() == "true"
+SAGA_LOG_COMPACT_AFTER_SECONDS = int(os.getenv("SAGA_LOG_COMPACT_AFTER_SECONDS", "3600"))
+SAGA_LOG_COMPACTION_BATCH_SIZE = int(os.getenv("SAGA_LOG_COMPACTION_BATCH_SIZE", "500"))
+SAGA_LOG_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("SAGA_LOG_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+
+EPOCH = datetime(1970, 1, 1)
+
+# La PK de una tabla particionada debe incluir la columna de partición
+PARTITIONED_SAGA_LOGS_DDL = [
+    """
+    CREATE TABLE saga_logs (
+        id SERIAL,
+        saga_id VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        details TEXT,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "CREATE INDEX ix_saga_logs_saga_id_id ON saga_logs (saga_id, id)",
+    # Red de seguridad: filas fuera de las particiones creadas
+    "CREATE TABLE saga_logs_default PARTITION OF saga_logs DEFAULT"
+]
+
+
+def prepare_saga_logs_table(engine):
+    """
+    En PostgreSQL crea saga_logs particionada por rango de timestamp antes
+    de create_all (que la encuentra y no la vuelve a crear)
+    Una saga_logs existente sin particionar se deja como está
+    """
+    if engine.dialect.name != "postgresql" or inspect(engine).has_table("saga_logs"):
+        return
+
+    with engine.begin() as conn:
+        for statement in PARTITIONED_SAGA_LOGS_DDL:
+            conn.execute(text(statement))
+    logger.info("🗂️ saga_logs created as a partitioned table")
+
+
+def partition_bounds(moment: datetime, width_days: int = SAGA_LOG_PARTITION_DAYS) -> tuple:
+    """Rango [inicio, fin) de la partición que contiene el instante"""
+    start = EPOCH + timedelta(days=(moment - EPOCH).days // width_days * width_days)
+    return start, start + timedelta(days=width_days)
+
+
+def partition_name(start: datetime) -> str:
+    return f"saga_logs_p{start:%Y%m%d}"
+
+
+class SagaLogPartitionManager:
+    """
+    Mantenimiento de saga_logs: particiones por tiempo, retención y compactación
+    En PostgreSQL con saga_logs particionada, la retención es un DROP TABLE por
+    partición; en cualquier otro caso la partición es simulada y la retención
+    borra el rango de timestamp con un DELETE
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        width_days: int = SAGA_LOG_PARTITION_DAYS,
+        retention_days: int = SAGA_LOG_RETENTION_DAYS,
+        precreate: int = SAGA_LOG_PRECREATE_PARTITIONS,
+        compaction_enabled: bool = SAGA_LOG_COMPACTION_ENABLED,
+        compact_after_seconds: int = SAGA_LOG_COMPACT_AFTER_SECONDS,
+        compaction_batch_size: int = SAGA_LOG_COMPACTION_BATCH_SIZE,
+        interval: float = SAGA_LOG_MAINTENANCE_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.width_days = width_days
+        self.retention_days = retention_days
+        self.precreate = precreate
+        self.compaction_enabled = compaction_enabled
+        self.compact_after_seconds = compact_after_seconds
+        self.compaction_batch_size = compaction_batch_size
+        self.interval = interval
+        self._native = None
+        self._stop = Event()
+        self._thread = None
+
+    def is_native(self, db) -> bool:
+        """True si saga_logs es una tabla particionada de PostgreSQL"""
+        if self._native is None:
+            self._native = db.get_bind().dialect.name == "postgresql" and db.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'saga_logs'::regclass"
+            )).first() is not None
+        return self._native
+
+    def ensure_partitions(self, now: datetime = None) -> list:
+        """Crea la partición actual y las siguientes. Retorna las nuevas"""
+        now = now or datetime.utcnow()
+        db = self.session_factory()
+        created = []
+        try:
+            existing = {name for (name,) in db.query(SagaLogPartition.name)}
+            for offset in range(self.precreate + 1):
+                start, end = partition_bounds(now + timedelta(days=offset * self.width_days), self.width_days)
+                name = partition_name(start)
+                if name in existing:
+                    continue
+
+                if self.is_native(db):
+                    db.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF saga_logs "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    ))
+                db.add(SagaLogPartition(name=name, range_start=start, range_end=end))
+                db.commit()
+                created.append(name)
+
+            if created:
+                logger.info(f"🗂️ Saga log partitions created: {created}")
+            return created
+        except Exception as e:
+            # Típicamente: la partición default ya tiene filas de ese rango
+            db.rollback()
+            logger.error(f"💥 Failed to create saga log partitions: {str(e)}")
+            return created
+        finally:
+            db.close()
+
+    def drop_expired(self, now: datetime = None) -> list:
+        """Elimina las particiones cuyo rango terminó antes de la retención"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        db = self.session_factory()
+        dropped = []
+        try:
+            expired = db.query(SagaLogPartition).filter(
+                SagaLogPartition.range_end <= cutoff
+            ).order_by(SagaLogPartition.range_end).all()
+
+            native = self.is_native(db)
+            for partition in expired:
+                if native:
+                    db.execute(text(f"DROP TABLE IF EXISTS {partition.name}"))
+                else:
+                    db.query(SagaLog).filter(
+                        SagaLog.timestamp < partition.range_end
+                    ).delete(synchronize_session=False)
+                db.delete(partition)
+                db.commit()
+                dropped.append(partition.name)
+
+            if native:
+                # Lo que cayó en la partición default no tiene DROP posible
+                db.execute(
+                    text("DELETE FROM saga_logs_default WHERE timestamp < :cutoff"),
+                    {"cutoff": cutoff}
+                )
+                db.commit()
+
+            if dropped:
+                logger.info(f"🧹 Saga log partitions dropped: {dropped}")
+            return dropped
+        except Exception as e:
+            db.rollback()
+            logger.error(f"💥 Failed to drop saga log partitions: {str(e)}")
+            return dropped
+        finally:
+            db.close()
+
+    def compact(self, now: datetime = None) -> int:
+        """
+        Colapsa el historial de cada saga terminada en una sola fila resumen
+        Se conserva la última fila (mismo id y timestamp, así no cambia de
+        partición ni de posición en la paginación) y se borran las anteriores
+        Retorna el número de sagas compactadas
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.compact_after_seconds)
+        db = self.session_factory()
+        try:
+            saga_ids = [saga_id for (saga_id,) in db.query(SagaLog.saga_id).join(
+                Saga, Saga.saga_id == SagaLog.saga_id
+            ).filter(
+                Saga.state.in_(TERMINAL_STATES),
+                Saga.updated_at < cutoff
+            ).group_by(SagaLog.saga_id).having(func.count() > 1).limit(self.compaction_batch_size)]
+
+            if not saga_ids:
+                return 0
+
+            timelines = {}
+            for log in db.query(SagaLog.id, SagaLog.saga_id, SagaLog.status, SagaLog.details).filter(
+                SagaLog.saga_id.in_(saga_ids)
+            ).order_by(SagaLog.saga_id, SagaLog.id):
+                timelines.setdefault(log.saga_id, []).append(log)
+
+            summaries = []
+            obsolete = []
+            for saga_id, logs in timelines.items():
+                last = logs[-1]
+                steps = " → ".join(log.status for log in logs)
+                summaries.append({"id": last.id, "details": f"[{steps}] {last.details or ''}".strip()})
+                obsolete.extend(log.id for log in logs[:-1])
+
+            db.execute(update(SagaLog), summaries)
+            db.query(SagaLog).filter(SagaLog.id.in_(obsolete)).delete(synchronize_session=False)
+            db.commit()
+
+            logger.info(f"🗜️ Compacted {len(summaries)} sagas ({len(obsolete)} log rows removed)")
+            return len(summaries)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"💥 Saga log compaction failed: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def run_once(self, now: datetime = None):
+        self.ensure_partitions(now)
+        self.drop_expired(now)
+        if self.compaction_enabled:
+            while self.compact(now) >= self.compaction_batch_size and not self._stop.is_set():
+                pass
+
+    def run(self):
+        """Bucle de mantenimiento de saga_logs"""
+        logger.info(f"🗂️ Saga log maintenance running every {self.interval}s")
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start_background(self):
+        """Iniciar el mantenimiento en thread separado (no bloquea FastAPI)"""
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
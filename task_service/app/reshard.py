@@ -0,0 +1,243 @@
+import logging
+import os
+import time
+from sqlalchemy import delete, insert, select, union
+from .database import get_shard_router, hashed_shard
+from .models import Task, TaskArchive, TaskStat, TaskChange, Saga, SagaLog, ProcessedMessage, UserShard
+
+logger = logging.getLogger(__name__)
+
+RESHARD_BATCH_SIZE = int(os.getenv("RESHARD_BATCH_SIZE", "1000"))
+
+
+class ShardMover:
+    """
+    Migra en línea las tareas y sagas de un usuario entre shards
+
+    1. El directorio marca al usuario como "moving": las escrituras responden
+       503 (y los eventos vuelven a la cola); las lecturas siguen en el origen
+    2. Se espera el TTL del directorio para que todos los procesos lo vean
+    3. Se copian tasks, tasks_archive, task_stats, sagas, saga_logs,
+       task_changes y el inbox (processed_messages) al destino en una
+       transacción (los ids de tareas son globales y se conservan)
+    4. El directorio apunta al destino y, pasado otro TTL, se borra el origen
+
+    Si la copia falla el usuario vuelve a quedar activo en el origen
+    Los cursores de sincronización del shard anterior se traducen con la
+    posición original de cada cambio copiado (ver sync.moved_cursor)
+    """
+
+    def __init__(self, router=None, batch_size: int = RESHARD_BATCH_SIZE, settle_seconds: float = None):
+        self.router = router or get_shard_router()
+        self.batch_size = batch_size
+        self.settle_seconds = self.router.ttl if settle_seconds is None else settle_seconds
+
+    def set_placement(self, user_id: int, shard: int, state: str = "active"):
+        """Escribe la ubicación en el directorio (sin fila si coincide con el hash)"""
+        db = self.router.directory()
+        try:
+            row = db.get(UserShard, user_id)
+            if state == "active" and shard == hashed_shard(user_id, len(self.router.session_factories)):
+                if row is not None:
+                    db.delete(row)
+            elif row is not None:
+                row.shard, row.state = shard, state
+            else:
+                db.add(UserShard(user_id=user_id, shard=shard, state=state))
+            db.commit()
+        finally:
+            db.close()
+        self.router.forget(user_id)
+
+    def move_user(self, user_id: int, target: int) -> dict:
+        """Mueve al usuario al shard target. Retorna las filas copiadas por tabla"""
+        if not 0 <= target < len(self.router.session_factories):
+            raise ValueError(f"Unknown shard {target}")
+
+        self.router.forget(user_id)
+        source, state = self.router.placement(user_id)
+        if state == "moving":
+            raise RuntimeError(f"User {user_id} is already being moved")
+        if source == target:
+            return {}
+
+        logger.info(f"🚚 Moving user {user_id} from shard {source} to shard {target}")
+        self.set_placement(user_id, source, "moving")
+        time.sleep(self.settle_seconds)
+
+        try:
+            copied = self._copy(user_id, source, target)
+        except Exception as e:
+            logger.error(f"💥 Move of user {user_id} failed, staying on shard {source}: {str(e)}")
+            self.set_placement(user_id, source, "active")
+            raise
+
+        self.set_placement(user_id, target, "active")
+        time.sleep(self.settle_seconds)
+        self._purge(self.router.session_factories[source](), user_id)
+
+        logger.info(f"✅ User {user_id} moved to shard {target}: {copied}")
+        return copied
+
+    def _copy(self, user_id: int, source: int, target: int) -> dict:
+        src = self.router.session_factories[source]()
+        dst = self.router.session_factories[target]()
+        try:
+            # Restos de una migración anterior interrumpida
+            self._purge(dst, user_id, commit=False)
+            self._check_codes(src, dst, user_id)
+
+            user_sagas = select(Saga.saga_id).where(Saga.user_id == user_id)
+            copied = {
+                "tasks": self._copy_rows(src, dst, Task, Task.user_id == user_id),
+                "tasks_archive": self._copy_rows(src, dst, TaskArchive, TaskArchive.user_id == user_id),
+                "task_stats": self._copy_rows(src, dst, TaskStat, TaskStat.user_id == user_id),
+                "sagas": self._copy_rows(src, dst, Saga, Saga.user_id == user_id),
+                # Los ids de saga_logs son locales de cada shard: se reasignan
+                "saga_logs": self._copy_rows(src, dst, SagaLog, SagaLog.saga_id.in_(user_sagas), exclude=("id",)),
+                "task_changes": self._copy_changes(src, dst, user_id, source),
+                # Los redeliveries ya procesados siguen descartándose en el destino
+                "processed_messages": self._copy_rows(src, dst, ProcessedMessage, ProcessedMessage.user_id == user_id)
+            }
+            dst.commit()
+            return copied
+        except Exception:
+            dst.rollback()
+            raise
+        finally:
+            src.close()
+            dst.close()
+
+    def _copy_rows(self, src, dst, model, condition, exclude: tuple = ()) -> int:
+        """Copia por lotes (cursor del lado del servidor en el origen)"""
+        names = [column.name for column in model.__table__.columns if column.name not in exclude]
+        result = src.execute(
+            select(*[model.__table__.c[name] for name in names]).where(condition),
+            execution_options={"stream_results": True, "yield_per": self.batch_size}
+        )
+        total = 0
+        for rows in result.partitions():
+            dst.execute(insert(model), [dict(zip(names, row)) for row in rows])
+            total += len(rows)
+        return total
+
+    def _copy_changes(self, src, dst, user_id: int, source: int) -> int:
+        """
+        Copia el registro de cambios en orden con ids nuevos del destino
+        (los ids son locales de cada shard) y guarda la posición original
+        """
+        result = src.execute(
+            select(TaskChange.id, TaskChange.task_id, TaskChange.operation, TaskChange.changed_at)
+            .where(TaskChange.user_id == user_id).order_by(TaskChange.id),
+            execution_options={"stream_results": True, "yield_per": self.batch_size}
+        )
+        total = 0
+        for rows in result.partitions():
+            dst.execute(insert(TaskChange), [{
+                "user_id": user_id,
+                "task_id": row.task_id,
+                "operation": row.operation,
+                "changed_at": row.changed_at,
+                "origin_shard": source,
+                "origin_id": row.id
+            } for row in rows])
+            total += len(rows)
+        return total
+
+    def _check_codes(self, src, dst, user_id: int):
+        """Los códigos son únicos por shard: no mover si alguno ya existe en el destino"""
+        codes = list(src.scalars(union(
+            select(Task.code).where(Task.user_id == user_id, Task.code.isnot(None)),
+            select(TaskArchive.code).where(TaskArchive.user_id == user_id, TaskArchive.code.isnot(None))
+        )))
+        for start in range(0, len(codes), self.batch_size):
+            chunk = codes[start:start + self.batch_size]
+            taken = list(dst.scalars(union(
+                select(Task.code).where(Task.code.in_(chunk)),
+                select(TaskArchive.code).where(TaskArchive.code.in_(chunk))
+            )))
+            if taken:
+                raise RuntimeError(f"Task codes already used on target shard: {', '.join(taken[:10])}")
+
+    def _purge(self, db, user_id: int, commit: bool = True):
+        """Borra los datos del usuario de un shard"""
+        try:
+            user_sagas = select(Saga.saga_id).where(Saga.user_id == user_id)
+            db.execute(delete(SagaLog).where(SagaLog.saga_id.in_(user_sagas)), execution_options={"synchronize_session": False})
+            for model in (Saga, Task, TaskArchive, TaskStat, TaskChange, ProcessedMessage):
+                db.execute(delete(model).where(model.user_id == user_id), execution_options={"synchronize_session": False})
+            if commit:
+                db.commit()
+        finally:
+            if commit:
+                db.close()
+
+    def user_ids(self, shard: int) -> list:
+        """Usuarios con datos en un shard"""
+        db = self.router.session_factories[shard]()
+        try:
+            return sorted(db.scalars(union(
+                select(Task.user_id), select(TaskArchive.user_id), select(Saga.user_id)
+            )))
+        finally:
+            db.close()
+
+    def pin_before_resize(self, shard_count: int) -> int:
+        """
+        Antes de desplegar con shard_count shards: fija en el directorio a los
+        usuarios cuyo hash cambiaría, así siguen donde están sus datos
+        """
+        pinned = 0
+        for shard in range(len(self.router.session_factories)):
+            for user_id in self.user_ids(shard):
+                if user_id is None:
+                    continue
+                self.router.forget(user_id)
+                if self.router.placement(user_id) == (shard, "active") and hashed_shard(user_id, shard_count) != shard:
+                    db = self.router.directory()
+                    try:
+                        db.merge(UserShard(user_id=user_id, shard=shard, state="active"))
+                        db.commit()
+                    finally:
+                        db.close()
+                    pinned += 1
+        logger.info(f"📌 Pinned {pinned} users ahead of resizing to {shard_count} shards")
+        return pinned
+
+    def rebalance(self, apply: bool = False) -> list:
+        """Usuarios fijados fuera de su shard por hash; con apply=True se mueven"""
+        db = self.router.directory()
+        try:
+            placements = db.query(UserShard).filter(UserShard.state == "active").all()
+            plan = [
+                (row.user_id, row.shard, hashed_shard(row.user_id, len(self.router.session_factories)))
+                for row in placements
+            ]
+        finally:
+            db.close()
+
+        plan = [(user_id, source, target) for user_id, source, target in plan if source != target]
+        if apply:
+            for user_id, _, target in plan:
+                self.move_user(user_id, target)
+        return plan
+
+
+if __name__ == "__main__":
+    # python -m app.reshard move <user_id> <shard>
+    # python -m app.reshard pin <shard_count>       →  antes de agregar shards
+    # python -m app.reshard rebalance [--apply]     →  después de agregarlos
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    command, args = sys.argv[1], sys.argv[2:]
+    mover = ShardMover()
+    if command == "move":
+        mover.move_user(int(args[0]), int(args[1]))
+    elif command == "pin":
+        mover.pin_before_resize(int(args[0]))
+    elif command == "rebalance":
+        for user_id, source, target in mover.rebalance(apply="--apply" in args):
+            logger.info(f"User {user_id}: shard {source} → {target}")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, delete, literal, or_, select, union_all, update
 from sqlalchemy.orm import Session
-from .database import SessionLocal
-from .models import Task, SagaLog
+from .database import ShardMovingError, get_shard_router, mark_user_write, read_session, read_sessions
+from .models import Task, TaskArchive, SagaLog, Saga
 from .schemas import TaskCreate, TaskUpdate
 from .dependencies import get_current_user_id
 from .saga import TaskCreationSaga, SagaCompensationHandler
+from .inbox import DuplicateMessage, get_inbox
+from .events import publish_event, serialize_task
+from .stats import apply_stat_deltas, stat_deltas, task_row, get_user_stats
+from .sync import record_task_changes, get_changes
+from .cache import get_task_cache, task_snapshot
+from .bulk import TaskImporter, export_tasks, iter_records
+from datetime import datetime
 import logging
+import os
 import random
 import string
 
@@ -13,13 +24,58 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/tasks")
 
-def get_db():
-    db = SessionLocal()
+SHARD_MOVE_RETRY_AFTER = "5"
+
+# Ingesta HTTP de eventos en NDJSON
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", "500"))
+EVENTS_MAX_ERRORS = int(os.getenv("EVENTS_MAX_ERRORS", "100"))
+
+def shard_write_session(user_id: int):
+    """Sesión de escritura en el shard del usuario (503 si está migrando de shard)"""
+    try:
+        return get_shard_router().session(user_id, write=True)
+    except ShardMovingError:
+        raise HTTPException(
+            status_code=503,
+            detail="Tasks are being moved, retry shortly",
+            headers={"Retry-After": SHARD_MOVE_RETRY_AFTER}
+        )
+
+def get_db(user_id: int = Depends(get_current_user_id)):
+    db = shard_write_session(user_id)
     try:
         yield db
     finally:
         db.close()
 
+def get_read_db(
+    user_id: int = Depends(get_current_user_id),
+    x_last_write: str = Header(None)
+):
+    """Sesión de lectura con read-your-writes para el usuario autenticado"""
+    db = read_session(user_id, x_last_write)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_primary_db(user_id: int = Depends(get_current_user_id)):
+    """Sesión de lectura en el primario del shard del usuario (sin lag de réplica)"""
+    db = get_shard_router().session(user_id)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_replica_dbs():
+    """Sesiones de lectura de todos los shards para vistas no ligadas a un usuario (monitoreo de sagas)"""
+    dbs = read_sessions()
+    try:
+        yield dbs
+    finally:
+        for db in dbs:
+            db.close()
+
 def generate_task_code():
     """Genera un código único para la tarea (ej: TASK-A1B2C3)"""
     return f"TASK-{''.join(random.choices(string.ascii_uppercase + string.digits, k=6))}"
@@ -27,6 +83,7 @@ def generate_task_code():
 @router.post("/")
 def create_task(
     task: TaskCreate,
+    response: Response,
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id)
 ):
@@ -43,53 +100,127 @@ def create_task(
             detail=result["message"]
         )
     
+    mark_user_write(user_id, response)
     logger.info(f"✅ Task {result['task'].id} created (saga_id: {result['saga_id']})")
     return result["task"]
 
 @router.get("/")
 def list_tasks(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user_id: int = Depends(get_current_user_id),
     status: str = Query(None, description="Filtrar por estado"),
     category: str = Query(None, description="Filtrar por categoría"),
     priority: str = Query(None, description="Filtrar por prioridad"),
-    search: str = Query(None, description="Buscar por título o descripción")
+    search: str = Query(None, description="Buscar por título o descripción"),
+    include_archived: bool = Query(False, description="Incluir tareas archivadas")
 ):
     """Lista tareas con filtros opcionales"""
-    query = db.query(Task).filter(Task.user_id == user_id)
-    
-    if status:
-        query = query.filter(Task.status == status)
-    if category:
-        query = query.filter(Task.category == category)
-    if priority:
-        query = query.filter(Task.priority == priority)
-    if search:
-        query = query.filter(
-            (Task.title.ilike(f"%{search}%")) | 
-            (Task.description.ilike(f"%{search}%"))
-        )
+    def task_filters(model):
+        conditions = [model.user_id == user_id]
+        if status:
+            conditions.append(model.status == status)
+        if category:
+            conditions.append(model.category == category)
+        if priority:
+            conditions.append(model.priority == priority)
+        if search:
+            conditions.append(
+                (model.title.ilike(f"%{search}%")) | 
+                (model.description.ilike(f"%{search}%"))
+            )
+        return conditions
     
-    return query.order_by(Task.created_at.desc()).all()
+    if not include_archived:
+        return db.query(Task).filter(*task_filters(Task)).order_by(Task.created_at.desc()).all()
+    
+    # Una sola consulta sobre ambas tablas; la caliente no crece con el histórico
+    columns = [column.name for column in Task.__table__.columns]
+    combined = union_all(
+        select(*[getattr(Task, name) for name in columns], literal(False).label("archived")).where(*task_filters(Task)),
+        select(*[getattr(TaskArchive, name) for name in columns], literal(True).label("archived")).where(*task_filters(TaskArchive))
+    ).subquery()
+    rows = db.execute(select(combined).order_by(combined.c.created_at.desc())).mappings()
+    return [dict(row) for row in rows]
+
+
+def serialize_saga_log(log: SagaLog) -> dict:
+    return {
+        "id": log.id,
+        "saga_id": log.saga_id,
+        "status": log.status,
+        "details": log.details,
+        "timestamp": log.timestamp.isoformat()
+    }
+
+
+def serialize_saga(saga: Saga) -> dict:
+    return {
+        "saga_id": saga.saga_id,
+        "task_id": saga.task_id,
+        "user_id": saga.user_id,
+        "state": saga.state,
+        "created_at": saga.created_at.isoformat(),
+        "updated_at": saga.updated_at.isoformat()
+    }
+
+
+def saga_log_cursor(shard: int, log: SagaLog) -> str:
+    return f"{log.timestamp.isoformat()}|{shard}|{log.id}"
+
+
+def parse_saga_log_cursor(cursor: str) -> tuple:
+    """(timestamp, shard, id) de un cursor de /saga-logs"""
+    try:
+        timestamp, shard, log_id = cursor.split("|")
+        return datetime.fromisoformat(timestamp), int(shard), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def saga_logs_before(shard: int, cursor: tuple):
+    """Logs de este shard posteriores al cursor en el orden (timestamp, shard, id) descendente"""
+    timestamp, cursor_shard, log_id = cursor
+    if shard < cursor_shard:
+        return SagaLog.timestamp <= timestamp
+    if shard > cursor_shard:
+        return SagaLog.timestamp < timestamp
+    return or_(SagaLog.timestamp < timestamp, and_(SagaLog.timestamp == timestamp, SagaLog.id < log_id))
 
 
 # ← CORREGIDO: Este endpoint debe ir ANTES de /code/{code} y /{task_id}
 @router.get("/saga-logs")
-def get_saga_logs(db: Session = Depends(get_db)):
-    """Endpoint para ver los logs de SAGAs - NO requiere user_id"""
+def get_saga_logs(
+    dbs: list = Depends(get_replica_dbs),
+    status: str = Query(None, description="Filtrar por estado del paso"),
+    saga_id: str = Query(None, description="Filtrar por saga"),
+    before: str = Query(None, description="Cursor: campo cursor del último log recibido"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Endpoint para ver los logs de SAGAs - NO requiere user_id
+    Paginación keyset por (timestamp, shard, id): los ids son locales a cada
+    shard (y cambian al migrar un usuario), así que solo desempatan en su shard
+    Con varios shards se consulta cada uno y se mezclan sus páginas
+    """
+    cursor = parse_saga_log_cursor(before) if before else None
     try:
         logger.info("📊 Fetching SAGA logs")
-        logs = db.query(SagaLog).order_by(SagaLog.timestamp.desc()).limit(50).all()
+        logs = []
+        for shard, db in enumerate(dbs):
+            query = db.query(SagaLog)
+            
+            if status:
+                query = query.filter(SagaLog.status == status)
+            if saga_id:
+                query = query.filter(SagaLog.saga_id == saga_id)
+            if cursor:
+                query = query.filter(saga_logs_before(shard, cursor))
+            
+            rows = query.order_by(SagaLog.timestamp.desc(), SagaLog.id.desc()).limit(limit).all()
+            logs.extend((shard, log) for log in rows)
         
-        result = [
-            {
-                "saga_id": log.saga_id,
-                "status": log.status,
-                "details": log.details,
-                "timestamp": log.timestamp.isoformat()
-            }
-            for log in logs
-        ]
+        logs = sorted(logs, key=lambda entry: (entry[1].timestamp, entry[0], entry[1].id), reverse=True)[:limit]
+        result = [dict(serialize_saga_log(log), cursor=saga_log_cursor(shard, log)) for shard, log in logs]
         
         logger.info(f"✅ Returning {len(result)} SAGA logs")
         return result
@@ -101,31 +232,180 @@ def get_saga_logs(db: Session = Depends(get_db)):
         )
 
 
+@router.get("/sagas")
+def list_sagas(
+    dbs: list = Depends(get_replica_dbs),
+    state: str = Query(None, description="Filtrar por estado actual"),
+    before: str = Query(None, description="Cursor: updated_at ISO de la última saga recibida"),
+    before_saga_id: str = Query(None, description="Cursor: saga_id de la última saga recibida"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """
+    Lista sagas por estado actual (índice (state, updated_at)) con paginación keyset
+    El cursor (updated_at, saga_id) es global: con varios shards se mezclan sus páginas
+    """
+    cursor = None
+    if before:
+        try:
+            cursor = datetime.fromisoformat(before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    sagas = []
+    for db in dbs:
+        query = db.query(Saga)
+        
+        if state:
+            query = query.filter(Saga.state == state)
+        if cursor:
+            if before_saga_id:
+                # Desempate por saga_id: las actualizaciones en lote comparten updated_at
+                query = query.filter(or_(
+                    Saga.updated_at < cursor,
+                    and_(Saga.updated_at == cursor, Saga.saga_id < before_saga_id)
+                ))
+            else:
+                query = query.filter(Saga.updated_at < cursor)
+        
+        sagas.extend(query.order_by(Saga.updated_at.desc(), Saga.saga_id.desc()).limit(limit).all())
+    
+    sagas = sorted(sagas, key=lambda saga: (saga.updated_at, saga.saga_id), reverse=True)[:limit]
+    return [serialize_saga(saga) for saga in sagas]
+
+
+@router.get("/sagas/{saga_id}")
+def get_saga_timeline(saga_id: str, dbs: list = Depends(get_replica_dbs)):
+    """Estado actual de una saga y su timeline completo de pasos (del shard que la tenga)"""
+    for db in dbs:
+        saga = db.query(Saga).filter(Saga.saga_id == saga_id).first()
+        logs = db.query(SagaLog).filter(SagaLog.saga_id == saga_id).order_by(SagaLog.id).all()
+        if saga or logs:
+            break
+    else:
+        raise HTTPException(status_code=404, detail="Saga not found")
+    
+    return {
+        "saga": serialize_saga(saga) if saga else None,
+        "timeline": [serialize_saga_log(log) for log in logs]
+    }
+
+
+@router.get("/stats")
+def get_task_stats(
+    db: Session = Depends(get_read_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Contadores de tareas por estado, categoría y prioridad (O(1), sin recorrer tasks)"""
+    return get_user_stats(db, user_id)
+
+
+@router.get("/changes")
+def get_task_changes(
+    since: str = Query("0", description="Cursor de la respuesta anterior"),
+    limit: int = Query(500, ge=1, le=2000),
+    db: Session = Depends(get_primary_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    Sincronización incremental: tareas creadas o actualizadas desde el cursor
+    y tombstones de las eliminadas. Con reset=true el cliente debe recargar todo
+    Se lee del primario: con el lag de una réplica el cursor podría saltar cambios
+    """
+    try:
+        return get_changes(db, user_id, since, limit, shard=get_shard_router().shard_for(user_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/export")
+def export_user_tasks(
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    user_id: int = Depends(get_current_user_id),
+    x_last_write: str = Header(None)
+):
+    """Exporta las tareas del usuario en streaming (NDJSON o CSV)"""
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_tasks(user_id, fmt, last_write=x_last_write),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{fmt}"'}
+    )
+
+
+@router.post("/import")
+async def import_user_tasks(
+    request: Request,
+    response: Response,
+    fmt: str = Query(None, alias="format", pattern="^(ndjson|csv)$"),
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    Importa tareas desde un cuerpo NDJSON o CSV leído en streaming
+    Las filas válidas se cargan por lotes; las inválidas se reportan por número de fila
+    """
+    fmt = fmt or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    importer = TaskImporter(user_id)
+    
+    async for number, data in iter_records(request.stream(), fmt):
+        if isinstance(data, Exception):
+            importer.add_error(number, str(data))
+        elif importer.add(number, data):
+            await run_in_threadpool(importer.flush)
+    await run_in_threadpool(importer.flush)
+    
+    if importer.imported:
+        mark_user_write(user_id, response)
+    logger.info(f"📥 Imported {importer.imported} tasks for user {user_id} ({importer.failed} failed)")
+    return importer.summary()
+
+
 @router.get("/code/{code}")
 def get_task_by_code(
     code: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Consulta una tarea por su código único"""
+    cache = get_task_cache()
+    cached = cache.get_by_code(code.upper())
+    # Los códigos son únicos por shard: uno cacheado de otro usuario no descarta este
+    if cached is not None and cached["user_id"] == user_id:
+        return cached
+    
     task = db.query(Task).filter(
         Task.code == code.upper(),
         Task.user_id == user_id
     ).first()
     
     if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+        # Los códigos siguen siendo consultables después del archivado
+        archived = db.query(TaskArchive).filter(
+            TaskArchive.code == code.upper(),
+            TaskArchive.user_id == user_id
+        ).first()
+        if not archived:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return dict(task_snapshot(archived), archived=True)
     
-    return task
+    snapshot = task_snapshot(task)
+    cache.put(snapshot)
+    return snapshot
 
 
 @router.get("/{task_id}")
 def get_task(
     task_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Obtiene una tarea específica"""
+    cache = get_task_cache()
+    cached = cache.get(task_id)
+    if cached is not None:
+        if cached["user_id"] != user_id:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return cached
+    
     task = db.query(Task).filter(
         Task.id == task_id,
         Task.user_id == user_id
@@ -134,88 +414,340 @@ def get_task(
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return task
+    snapshot = task_snapshot(task)
+    cache.put(snapshot)
+    return snapshot
+
+
+def parse_if_match(if_match: str):
+    """Versión esperada del header If-Match (ETag "3", W/"3" o *)"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+
+def raise_write_conflict(db: Session, task_id: int, user_id: int, models: tuple = (Task,)):
+    """Sin fila afectada: 404 si la tarea no es del usuario, 409 si cambió de versión"""
+    exists = any(
+        db.query(model.id).filter(model.id == task_id, model.user_id == user_id).first()
+        for model in models
+    )
+    if not exists:
+        raise HTTPException(status_code=404, detail="Task not found")
+    raise HTTPException(status_code=409, detail="Task was modified by another request")
+
+
+def delete_task_returning(db: Session, model, task_id: int, user_id: int, expected_version: int = None):
+    """DELETE ... RETURNING en tasks o tasks_archive; retorna la fila para los contadores o None"""
+    conditions = [model.id == task_id, model.user_id == user_id]
+    if expected_version is not None:
+        conditions.append(model.version == expected_version)
+    return db.execute(
+        delete(model).where(*conditions).returning(model.user_id, model.status, model.category, model.priority),
+        execution_options={"synchronize_session": False}
+    ).first()
+
+
+def update_task_returning(db: Session, task_id: int, user_id: int, values: dict, expected_version: int = None):
+    """
+    UPDATE ... RETURNING acotado por user_id y versión
+    Retorna (fila nueva, fila anterior para los contadores) o None si no hubo fila.
+    En PostgreSQL los valores anteriores salen de un CTE FOR UPDATE en la misma
+    sentencia (un round trip); otros motores leen la fila antes y condicionan
+    el UPDATE a la versión leída (compare-and-swap)
+    """
+    values = dict(values, version=Task.version + 1)
+    columns = list(Task.__table__.columns)
+
+    if db.get_bind().dialect.name == "postgresql":
+        old = select(Task.id, Task.status, Task.category, Task.priority).where(
+            Task.id == task_id,
+            Task.user_id == user_id
+        ).with_for_update().cte("old")
+        conditions = [Task.id == old.c.id]
+        if expected_version is not None:
+            conditions.append(Task.version == expected_version)
+
+        row = db.execute(
+            update(Task).where(*conditions).values(**values).returning(
+                *columns,
+                old.c.status.label("old_status"),
+                old.c.category.label("old_category"),
+                old.c.priority.label("old_priority")
+            ),
+            execution_options={"synchronize_session": False}
+        ).first()
+        if row is None:
+            return None
+        return row, (user_id, row.old_status, row.old_category, row.old_priority)
+
+    current = db.query(Task.status, Task.category, Task.priority, Task.version).filter(
+        Task.id == task_id,
+        Task.user_id == user_id
+    ).first()
+    if current is None or (expected_version is not None and current.version != expected_version):
+        return None
+
+    row = db.execute(
+        update(Task).where(
+            Task.id == task_id,
+            Task.user_id == user_id,
+            Task.version == current.version
+        ).values(**values).returning(*columns),
+        execution_options={"synchronize_session": False}
+    ).first()
+    if row is None:
+        return None
+    return row, (user_id, current.status, current.category, current.priority)
 
 
 @router.put("/{task_id}")
 def update_task(
     task_id: int,
     task: TaskUpdate,
+    response: Response,
+    if_match: str = Header(None),
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id)
 ):
-    """Actualiza una tarea"""
-    db_task = db.query(Task).filter(
-        Task.id == task_id,
-        Task.user_id == user_id
-    ).first()
-
-    if not db_task:
-        raise HTTPException(status_code=404, detail="Task not found")
-
-    for key, value in task.dict(exclude_unset=True).items():
-        setattr(db_task, key, value)
+    """Actualiza una tarea (If-Match con la versión evita pisar cambios concurrentes)"""
+    result = update_task_returning(db, task_id, user_id, task.dict(exclude_unset=True), parse_if_match(if_match))
+    if result is None:
+        db.rollback()
+        raise_write_conflict(db, task_id, user_id)
 
+    row, before = result
+    apply_stat_deltas(db, stat_deltas(removed=[before], added=[task_row(row)]))
+    record_task_changes(db, [(user_id, task_id, "upsert")])
     db.commit()
-    db.refresh(db_task)
-    return db_task
+    mark_user_write(user_id, response)
+    get_task_cache().invalidate(task_id)
+    
+    publish_event("task_updated", serialize_task(row))
+    response.headers["ETag"] = f'"{row.version}"'
+    return task_snapshot(row)
 
 
 @router.delete("/{task_id}")
 def delete_task(
     task_id: int,
+    response: Response,
+    if_match: str = Header(None),
     db: Session = Depends(get_db),
     user_id: int = Depends(get_current_user_id)
 ):
-    """Elimina una tarea"""
-    task = db.query(Task).filter(
-        Task.id == task_id,
-        Task.user_id == user_id
-    ).first()
-
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    """
+    Elimina una tarea con un solo DELETE ... RETURNING
+    Una tarea archivada se elimina de tasks_archive (sigue contando en stats hasta entonces)
+    """
+    expected_version = parse_if_match(if_match)
+    row = delete_task_returning(db, Task, task_id, user_id, expected_version)
+    if row is None:
+        row = delete_task_returning(db, TaskArchive, task_id, user_id, expected_version)
+    if row is None:
+        db.rollback()
+        raise_write_conflict(db, task_id, user_id, models=(Task, TaskArchive))
 
-    db.delete(task)
+    apply_stat_deltas(db, stat_deltas(removed=[tuple(row)]))
+    record_task_changes(db, [(user_id, task_id, "delete")])
     db.commit()
+    mark_user_write(user_id, response)
+    get_task_cache().invalidate(task_id)
+    
+    publish_event("task_deleted", {"task_id": task_id, "user_id": user_id})
     return {"message": "Task deleted"}
 
 
 @router.post("/events")
-def handle_event(event: dict, db: Session = Depends(get_db)):
-    """Endpoint para RECIBIR eventos de otros servicios"""
+async def handle_event(request: Request):
+    """
+    Endpoint para RECIBIR eventos de otros servicios
+    - JSON: un evento, en el shard del usuario del evento; un resultado
+      agrupado (payload.items) va por el camino de los lotes
+    - NDJSON (application/x-ndjson): un evento por línea, leído en streaming
+      y procesado por lotes de EVENTS_BATCH_SIZE con los handlers masivos
+    """
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            event = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        if (event.get("payload") or {}).get("items") is not None:
+            return await run_in_threadpool(handle_grouped_event, event)
+        return await run_in_threadpool(handle_single_event, event)
+    
+    received, batch, errors = 0, [], []
+    try:
+        async for number, data in iter_records(request.stream()):
+            if isinstance(data, Exception):
+                if len(errors) < EVENTS_MAX_ERRORS:
+                    errors.append({"line": number, "error": str(data)})
+                continue
+            batch.append(data)
+            if len(batch) >= EVENTS_BATCH_SIZE:
+                received += len(batch)
+                await run_in_threadpool(process_event_batch, batch)
+                batch = []
+        received += len(batch)
+        await run_in_threadpool(process_event_batch, batch)
+    except ShardMovingError:
+        # Los lotes ya procesados los descarta el inbox cuando se reenvíe el cuerpo
+        raise HTTPException(
+            status_code=503,
+            detail="Tasks are being moved, retry shortly",
+            headers={"Retry-After": SHARD_MOVE_RETRY_AFTER}
+        )
+    
+    logger.info(f"📥 Ingested {received} events via HTTP ({len(errors)} invalid lines)")
+    return {"status": "batch processed", "received": received, "errors": errors}
+
+
+def handle_single_event(event: dict):
+    db = shard_write_session((event.get("payload") or {}).get("user_id"))
+    try:
+        return process_event(db, event)
+    finally:
+        db.close()
+
+
+def handle_grouped_event(event: dict):
+    """Un mensaje con los resultados de varias sagas: se expande y se procesa como lote"""
+    try:
+        process_event_batch([event])
+    except ShardMovingError:
+        raise HTTPException(
+            status_code=503,
+            detail="Tasks are being moved, retry shortly",
+            headers={"Retry-After": SHARD_MOVE_RETRY_AFTER}
+        )
+    return {"status": "batch processed", "received": len(event["payload"]["items"]), "errors": []}
+
+
+def process_event(db: Session, event: dict):
     event_type = event.get("type")
     payload = event.get("payload")
+    message_id = event.get("message_id")
     
     logger.info(f"📨 Task Service received event: {event_type}")
     
-    if event_type == "notification_failed":
-        success = SagaCompensationHandler.handle_notification_failed(db, payload)
-        
-        if success:
-            return {"status": "compensation executed", "event": event_type}
+    inbox = get_inbox()
+    if inbox.already_processed(db, message_id):
+        logger.info(f"♻️ Duplicate event {message_id} ignored ({event_type})")
+        return {"status": "duplicate ignored", "event": event_type}
+    
+    if event_type not in ("notification_failed", "notification_sent"):
+        logger.warning(f"⚠️ Unknown event type: {event_type}")
+        return {"status": "event ignored", "event": event_type}
+    
+    # El inbox se registra con el efecto del handler y solo si tuvo éxito:
+    # un fallo responde 500 y el reintento del emisor se vuelve a procesar
+    inbox.stage(db, [event])
+    try:
+        if event_type == "notification_failed":
+            success = SagaCompensationHandler.handle_notification_failed(db, payload)
         else:
-            raise HTTPException(
-                status_code=500,
-                detail="Compensation failed"
-            )
+            success = SagaCompensationHandler.handle_notification_sent(db, payload)
+    except DuplicateMessage:
+        return {"status": "duplicate ignored", "event": event_type}
     
-    elif event_type == "notification_sent":
-        task_id = payload.get("task_id")
-        saga_id = payload.get("saga_id")
+    if not success:
+        inbox.discard(db)
+        raise HTTPException(
+            status_code=500,
+            detail="Compensation failed"
+        )
+    inbox.complete(db, [event])
+    
+    if event_type == "notification_failed":
+        return {"status": "compensation executed", "event": event_type}
+    return {"status": "event processed", "event": event_type}
+
+
+# ========== Eventos por lotes ==========
+def expand_grouped_results(messages: list) -> list:
+    """
+    El Notification Service agrupa resultados de varias sagas en un mensaje
+    (payload.items): se procesan como mensajes individuales, cada uno con
+    su propio message_id para el inbox
+    """
+    expanded = []
+    for message in messages:
+        items = message.get("payload", {}).get("items")
+        if items is None:
+            expanded.append(message)
+            continue
+        for index, item in enumerate(items):
+            item = dict(item)
+            expanded.append({
+                "type": message.get("type"),
+                "message_id": item.pop("message_id", None) or f"{message.get('message_id')}.{index}",
+                "payload": item
+            })
+    return expanded
+
+
+def process_event_batch(messages: list):
+    """
+    Procesa un lote de eventos del Notification Service (cola o HTTP)
+    Compensa o confirma N sagas con operaciones masivas, una sesión por shard
+    """
+    messages = expand_grouped_results(messages)
+    
+    shards = get_shard_router()
+    by_shard = {}
+    for message in messages:
+        user_id = (message.get("payload") or {}).get("user_id")
+        by_shard.setdefault(shards.placement(user_id), []).append(message)
+    
+    # Si algún usuario está migrando el lote entero se reintenta
+    # (lo ya procesado en un reintento lo descarta el inbox)
+    if any(state == "moving" for _, state in by_shard):
+        raise ShardMovingError("Shard move in progress, batch will be retried")
+    
+    for (shard, _), shard_messages in by_shard.items():
+        process_shard_batch(shards.session_factories[shard](), shard_messages)
+
+
+def process_shard_batch(db, messages: list):
+    """Procesa los eventos de un lote que pertenecen a un mismo shard"""
+    inbox = get_inbox()
+    
+    try:
+        fresh = inbox.filter_unprocessed(db, messages)
+        if len(fresh) < len(messages):
+            logger.info(f"♻️ {len(messages) - len(fresh)} duplicate messages ignored")
         
-        logger.info(f"✅ Notification confirmed for task {task_id}")
+        failed, sent, unknown = [], [], []
+        for message in fresh:
+            event_type = message.get("type")
+            if event_type == "notification_failed":
+                failed.append(message)
+            elif event_type == "notification_sent":
+                sent.append(message)
+            else:
+                logger.warning(f"⚠️ Unknown event type: {event_type}")
+                unknown.append(message)
         
-        log = SagaLog(
-            saga_id=saga_id,
-            status="COMPLETED",
-            details=f"Task {task_id} - Notification sent successfully"
-        )
-        db.add(log)
-        db.commit()
+        # Cada handler confirma el inbox de sus mensajes en su propia
+        # transacción; si falla, el lote se relanza y se reintenta
+        for handler, group in (
+            (SagaCompensationHandler.handle_notification_failed_batch, failed),
+            (SagaCompensationHandler.handle_notification_sent_batch, sent)
+        ):
+            inbox.stage(db, group)
+            try:
+                handler(db, [message.get("payload", {}) for message in group])
+            except Exception:
+                inbox.discard(db)
+                raise
+            inbox.complete(db, group)
         
-        return {"status": "event processed", "event": event_type}
+        if unknown:
+            inbox.stage(db, unknown)
+            inbox.complete(db, unknown)
     
-    else:
-        logger.warning(f"⚠️ Unknown event type: {event_type}")
-        return {"status": "event ignored", "event": event_type}
\ No newline at end of file
+    finally:
+        db.close()
@@ -1,10 +1,19 @@
 import logging
+from sqlalchemy import and_, delete, insert, or_, update
 from sqlalchemy.orm import Session
-from .models import Task, SagaLog
+from .database import get_shard_router, mark_user_write
+from .models import Task, TaskArchive, SagaLog, Saga
 from .rabbitmq_client import get_rabbitmq_client
-from datetime import datetime
+from .events import publish_event, serialize_task
+from .stats import apply_stat_deltas, stat_deltas, task_row
+from .sync import record_task_changes
+from .cache import get_task_cache
+from .inbox import DuplicateMessage, commit_processed
+from datetime import datetime, timedelta
+import os
 import random
 import string
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -12,35 +21,89 @@ def generate_task_code():
     """Genera un código único para la tarea"""
     return f"TASK-{''.join(random.choices(string.ascii_uppercase + string.digits, k=6))}"
 
+def allocate_task_ids(count: int = 1) -> list:
+    """Ids globales de tareas entre shards (None con un solo shard: autoincremento)"""
+    return get_shard_router().allocate_ids("tasks", count, seed_tables=("tasks", "tasks_archive"))
+
+SAGA_TIMEOUT_SECONDS = int(os.getenv("SAGA_TIMEOUT_SECONDS", "300"))
+
+# Estados finales: una saga en estos estados ya no cambia ni tiene deadline
+TERMINAL_STATES = ("COMPLETED", "COMPENSATED", "COMPENSATION_FAILED", "FAILED")
+
+
+def update_saga_state(db: Session, saga_ids: list, state: str, **fields):
+    """
+    Actualiza en sitio el estado actual de una o varias sagas (sin commit)
+    Un solo UPDATE ... WHERE saga_id IN, en la misma transacción que el log
+    Una saga que ya terminó no retrocede (p. ej. un evento tardío tras el timeout)
+    """
+    if state in TERMINAL_STATES:
+        fields.setdefault("deadline", None)
+    
+    db.execute(
+        update(Saga)
+        .where(Saga.saga_id.in_(saga_ids), Saga.state.notin_(TERMINAL_STATES))
+        .values(state=state, updated_at=datetime.utcnow(), **fields),
+        execution_options={"synchronize_session": False}
+    )
+
+def open_sagas(db: Session, saga_ids: list) -> set:
+    """
+    De saga_ids, las que todavía aceptan un resultado: sin fila en sagas
+    (anteriores a la tabla) o en un estado no final
+    Bloquea las filas (FOR UPDATE): un resultado tardío espera a que el
+    sweeper termine de cerrar la saga y luego la ve en estado final
+    """
+    known = [saga_id for saga_id in saga_ids if saga_id is not None]
+    closed = {
+        row.saga_id
+        for row in db.query(Saga.saga_id, Saga.state).filter(Saga.saga_id.in_(known)).with_for_update()
+        if row.state in TERMINAL_STATES
+    } if known else set()
+    return set(saga_ids) - closed
+
+
+def task_match(items: list):
+    """
+    Condición para las tareas de items: (id, user_id) cuando el item trae
+    el usuario (los ids se pueden reutilizar entre usuarios), si no solo id
+    """
+    with_user = [(item["task_id"], item["user_id"]) for item in items if item.get("user_id") is not None]
+    without_user = [item["task_id"] for item in items if item.get("user_id") is None]
+    conditions = [and_(Task.id == task_id, Task.user_id == user_id) for task_id, user_id in with_user]
+    if without_user:
+        conditions.append(Task.id.in_(without_user))
+    return or_(*conditions)
+
+
 class TaskCreationSaga:
     """SAGA con RabbitMQ Message Broker"""
     
     def __init__(self, db: Session):
         self.db = db
-        self.rabbitmq = get_rabbitmq_client()
+    
+    @property
+    def rabbitmq(self):
+        # Solo el paso de publicación lo necesita; las compensaciones no conectan
+        return get_rabbitmq_client()
     
     def execute(self, task_data: dict, user_id: int) -> dict:
         """Ejecuta PASO 1: Crear tarea y publicar evento"""
-        saga_id = f"task_creation_{datetime.utcnow().timestamp()}"
+        # saga_id es clave primaria de sagas: un timestamp se repite entre creaciones concurrentes
+        saga_id = uuid.uuid4().hex
         
-        self._log_saga(saga_id, "STARTED", "Task creation SAGA started (RabbitMQ)")
+        self._log_saga(saga_id, "STARTED", "Task creation SAGA started (RabbitMQ)", user_id=user_id)
         
         try:
             logger.info(f"🔵 SAGA {saga_id} | STEP 1: Creating task")
             task = self._create_task(task_data, user_id, saga_id)
-            self._log_saga(saga_id, "TASK_CREATED", f"Task {task.id} created with code {task.code}")
+            self._log_saga(saga_id, "TASK_CREATED", f"Task {task.id} created with code {task.code}", task_id=task.id)
             
             logger.info(f"🔵 SAGA {saga_id} | STEP 2: Publishing to RabbitMQ")
             
             message = {
                 "type": "task_created",
-                "payload": {
-                    "task_id": task.id,
-                    "user_id": user_id,
-                    "title": task.title,
-                    "description": task.description,
-                    "saga_id": saga_id
-                }
+                "payload": serialize_task(task)
             }
             
             success = self.rabbitmq.publish(
@@ -52,6 +115,7 @@ class TaskCreationSaga:
             if not success:
                 logger.error(f"❌ SAGA {saga_id} | Failed to publish to RabbitMQ")
                 self._compensate_task_creation(task.id, saga_id, "Failed to publish event")
+                self._log_saga(saga_id, "FAILED", f"Failed to publish event for task {task.id}")
                 
                 return {
                     "success": False,
@@ -79,43 +143,144 @@ class TaskCreationSaga:
                 "message": f"Task creation failed: {str(e)}"
             }
     
-    def compensate(self, task_id: int, saga_id: str, reason: str):
+    def compensate(self, task_id: int, saga_id: str, reason: str, user_id: int = None):
         """Compensación ejecutada cuando se recibe un evento de fallo desde RabbitMQ"""
         try:
             logger.warning(f"🔄 SAGA {saga_id} | COMPENSATING: Deleting task {task_id}")
             logger.warning(f"   Reason: {reason}")
             
-            task = self.db.query(Task).filter(Task.id == task_id).first()
+            task = self.db.query(Task).filter(task_match([{"task_id": task_id, "user_id": user_id}])).first()
             
             if not task:
                 logger.error(f"❌ SAGA {saga_id} | Task {task_id} not found for compensation")
                 self._log_saga(saga_id, "COMPENSATION_FAILED", f"Task {task_id} not found")
                 return False
             
+            user_id = task.user_id
             self.db.delete(task)
-            self.db.commit()
+            apply_stat_deltas(self.db, stat_deltas(removed=[task_row(task)]))
+            record_task_changes(self.db, [(user_id, task_id, "delete")])
+            commit_processed(self.db)
+            # Solo se marca en este proceso: sin un cliente no hay marca X-Last-Write
+            mark_user_write(user_id)
+            get_task_cache().invalidate(task_id)
             
             self._log_saga(
                 saga_id, 
                 "COMPENSATED", 
                 f"Task {task_id} deleted (RabbitMQ triggered). Reason: {reason}"
             )
+            publish_event("task_compensated", {
+                "task_id": task_id,
+                "user_id": user_id,
+                "saga_id": saga_id,
+                "reason": reason
+            })
             
             logger.info(f"✅ SAGA {saga_id} | Compensation completed for task {task_id}")
             return True
             
+        except DuplicateMessage:
+            raise
         except Exception as e:
+            # Error transitorio: la saga sigue abierta para el reintento (o el sweeper)
+            self.db.rollback()
             logger.error(f"💥 SAGA {saga_id} | COMPENSATION FAILED: {str(e)}")
-            self._log_saga(saga_id, "COMPENSATION_FAILED", str(e))
+            self._log_saga(saga_id, "COMPENSATION_FAILED", f"{str(e)} (will retry)", update_state=False)
             return False
     
+    def compensate_batch(self, items: list) -> dict:
+        """
+        Compensación por lotes: un único DELETE y un único INSERT masivo de
+        SagaLog para N sagas, en una sola transacción
+        items: dicts con task_id, saga_id, reason y user_id (opcional: con él
+        solo se borra la tarea de ese usuario). Retorna {saga_id: success}
+        Un error transitorio revierte el lote, deja las sagas abiertas y se relanza
+        """
+        task_ids = [item["task_id"] for item in items]
+        
+        try:
+            logger.warning(f"🔄 Compensating {len(items)} SAGAs in batch: deleting tasks {task_ids}")
+            
+            deleted_rows = self.db.execute(
+                delete(Task)
+                .where(task_match(items))
+                .returning(Task.id, Task.user_id, Task.status, Task.category, Task.priority),
+                execution_options={"synchronize_session": False}
+            ).all()
+            deleted = {(row.id, row.user_id) for row in deleted_rows}
+            deleted_ids = {row.id for row in deleted_rows}
+            owners = {row.id: row.user_id for row in deleted_rows}
+
+            def was_deleted(item: dict) -> bool:
+                if item.get("user_id") is None:
+                    return item["task_id"] in deleted_ids
+                return (item["task_id"], item["user_id"]) in deleted
+            apply_stat_deltas(self.db, stat_deltas(removed=[tuple(row)[1:] for row in deleted_rows]))
+            record_task_changes(self.db, [(row.user_id, row.id, "delete") for row in deleted_rows])
+            
+            now = datetime.utcnow()
+            results = {}
+            logs = []
+            for item in items:
+                task_id, saga_id = item["task_id"], item["saga_id"]
+                success = was_deleted(item)
+                results[saga_id] = success
+                logs.append({
+                    "saga_id": saga_id,
+                    "status": "COMPENSATED" if success else "COMPENSATION_FAILED",
+                    "details": (
+                        f"Task {task_id} deleted (RabbitMQ triggered). Reason: {item['reason']}"
+                        if success else f"Task {task_id} not found"
+                    ),
+                    "timestamp": now
+                })
+            
+            self.db.execute(insert(SagaLog), logs)
+            
+            compensated = [saga_id for saga_id, success in results.items() if success]
+            not_found = [saga_id for saga_id, success in results.items() if not success]
+            if compensated:
+                update_saga_state(self.db, compensated, "COMPENSATED")
+            if not_found:
+                update_saga_state(self.db, not_found, "COMPENSATION_FAILED")
+            commit_processed(self.db)
+            for user_id in set(owners.values()):
+                mark_user_write(user_id)
+            for task_id in deleted_ids:
+                get_task_cache().invalidate(task_id)
+            
+            logger.info(f"✅ Batch compensation completed: {len(deleted_ids)}/{len(items)} tasks deleted")
+            
+            for item in items:
+                if was_deleted(item):
+                    publish_event("task_compensated", {
+                        "task_id": item["task_id"],
+                        "user_id": item.get("user_id") or owners[item["task_id"]],
+                        "saga_id": item["saga_id"],
+                        "reason": item["reason"]
+                    })
+            return results
+            
+        except DuplicateMessage:
+            raise
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"💥 BATCH COMPENSATION FAILED: {str(e)}")
+            for item in items:
+                self._log_saga(item["saga_id"], "COMPENSATION_FAILED", f"{str(e)} (will retry)", update_state=False)
+            raise
+    
     def _compensate_task_creation(self, task_id: int, saga_id: str, reason: str):
         """Compensación interna en caso de error al publicar"""
         try:
             task = self.db.query(Task).filter(Task.id == task_id).first()
             if task:
                 self.db.delete(task)
+                apply_stat_deltas(self.db, stat_deltas(removed=[task_row(task)]))
+                record_task_changes(self.db, [(task.user_id, task_id, "delete")])
                 self.db.commit()
+                get_task_cache().invalidate(task_id)
                 logger.warning(f"🔄 Task {task_id} deleted (publish failed)")
         except Exception as e:
             logger.error(f"💥 Failed to compensate task {task_id}: {str(e)}")
@@ -124,35 +289,61 @@ class TaskCreationSaga:
         """Paso 1: Crear tarea en la base de datos con saga_id y código único"""
         code = generate_task_code()
         
-        # Verificar que el código sea único
-        while self.db.query(Task).filter(Task.code == code).first():
+        # Verificar que el código sea único (también frente a las tareas archivadas)
+        while (
+            self.db.query(Task.id).filter(Task.code == code).first()
+            or self.db.query(TaskArchive.id).filter(TaskArchive.code == code).first()
+        ):
             code = generate_task_code()
         
         task = Task(
             **task_data, 
+            id=allocate_task_ids()[0],
             user_id=user_id, 
             saga_id=saga_id,
             code=code,
             status="todo"  # Estado inicial
         )
         self.db.add(task)
+        self.db.flush()  # aplica los defaults de columna antes de contar
+        apply_stat_deltas(self.db, stat_deltas(added=[task_row(task)]))
+        record_task_changes(self.db, [(user_id, task.id, "upsert")])
         self.db.commit()
         self.db.refresh(task)
         logger.info(f"✅ Task {task.id} created with code {code}")
         return task
     
-    def _log_saga(self, saga_id: str, status: str, details: str):
-        """Registrar cada paso del SAGA para auditoría"""
+    def _log_saga(self, saga_id: str, status: str, details: str, update_state: bool = True, **fields):
+        """
+        Registrar cada paso del SAGA para auditoría y actualizar su estado actual
+        (update_state=False solo agrega el log: p. ej. un fallo que se reintentará)
+        """
         try:
+            now = datetime.utcnow()
             log = SagaLog(
                 saga_id=saga_id,
                 status=status,
                 details=details,
-                timestamp=datetime.utcnow()
+                timestamp=now
             )
             self.db.add(log)
+            
+            if status == "STARTED":
+                self.db.add(Saga(
+                    saga_id=saga_id,
+                    state=status,
+                    created_at=now,
+                    updated_at=now,
+                    deadline=now + timedelta(seconds=SAGA_TIMEOUT_SECONDS),
+                    **fields
+                ))
+            elif update_state:
+                update_saga_state(self.db, [saga_id], status, **fields)
+            
             self.db.commit()
         except Exception as e:
+            # Sin rollback la sesión queda en una transacción fallida y la siguiente sentencia falla
+            self.db.rollback()
             logger.error(f"Failed to log SAGA: {str(e)}")
 
 
@@ -168,8 +359,14 @@ class SagaCompensationHandler:
         
         logger.warning(f"🔴 Received NOTIFICATION_FAILED from RabbitMQ for task {task_id}")
         
+        # Un fallo tardío (la saga ya se cerró, p. ej. completada por timeout) no borra la tarea
+        if saga_id not in open_sagas(db, [saga_id]):
+            db.rollback()
+            logger.warning(f"⏭️ SAGA {saga_id} already closed: late NOTIFICATION_FAILED ignored")
+            return True
+        
         saga = TaskCreationSaga(db)
-        success = saga.compensate(task_id, saga_id, reason)
+        success = saga.compensate(task_id, saga_id, reason, user_id=payload.get("user_id"))
         
         if success:
             logger.info(f"✅ Compensation completed for task {task_id}")
@@ -186,12 +383,91 @@ class SagaCompensationHandler:
         
         logger.info(f"✅ Notification confirmed via RabbitMQ for task {task_id}")
         
+        # Una confirmación tardía (la saga ya se compensó) no confirma una tarea borrada
+        if saga_id not in open_sagas(db, [saga_id]):
+            db.rollback()
+            logger.warning(f"⏭️ SAGA {saga_id} already closed: late NOTIFICATION_SENT ignored")
+            return True
+        
         log = SagaLog(
             saga_id=saga_id,
             status="COMPLETED",
             details=f"Task {task_id} - Notification sent successfully (RabbitMQ)"
         )
         db.add(log)
-        db.commit()
+        update_saga_state(db, [saga_id], "COMPLETED")
+        commit_processed(db)
+        
+        publish_event("task_confirmed", {
+            "task_id": task_id,
+            "user_id": payload.get("user_id"),
+            "saga_id": saga_id
+        })
+        return True
+    
+    @staticmethod
+    def handle_notification_failed_batch(db: Session, payloads: list) -> dict:
+        """Versión por lotes de handle_notification_failed"""
+        if not payloads:
+            return {}
+        
+        logger.warning(f"🔴 Received {len(payloads)} NOTIFICATION_FAILED events from RabbitMQ")
+        
+        payloads = SagaCompensationHandler._skip_closed(db, payloads, "NOTIFICATION_FAILED")
+        if not payloads:
+            return {}
+        
+        items = [
+            {
+                "task_id": payload.get("task_id"),
+                "saga_id": payload.get("saga_id"),
+                "user_id": payload.get("user_id"),
+                "reason": payload.get("reason", "Notification service failed")
+            }
+            for payload in payloads
+        ]
         
-        return True
\ No newline at end of file
+        saga = TaskCreationSaga(db)
+        return saga.compensate_batch(items)
+    
+    @staticmethod
+    def handle_notification_sent_batch(db: Session, payloads: list) -> bool:
+        """Versión por lotes de handle_notification_sent: un solo INSERT masivo"""
+        if not payloads:
+            return True
+        
+        logger.info(f"✅ {len(payloads)} notifications confirmed via RabbitMQ")
+        
+        payloads = SagaCompensationHandler._skip_closed(db, payloads, "NOTIFICATION_SENT")
+        if not payloads:
+            return True
+        
+        now = datetime.utcnow()
+        db.execute(insert(SagaLog), [
+            {
+                "saga_id": payload.get("saga_id"),
+                "status": "COMPLETED",
+                "details": f"Task {payload.get('task_id')} - Notification sent successfully (RabbitMQ)",
+                "timestamp": now
+            }
+            for payload in payloads
+        ])
+        update_saga_state(db, [payload.get("saga_id") for payload in payloads], "COMPLETED")
+        commit_processed(db)
+        
+        for payload in payloads:
+            publish_event("task_confirmed", {
+                "task_id": payload.get("task_id"),
+                "user_id": payload.get("user_id"),
+                "saga_id": payload.get("saga_id")
+            })
+        return True
+    
+    @staticmethod
+    def _skip_closed(db: Session, payloads: list, event: str) -> list:
+        """Descarta los resultados de sagas ya cerradas (sin log, estado ni evento)"""
+        still_open = open_sagas(db, [payload.get("saga_id") for payload in payloads])
+        late = [payload for payload in payloads if payload.get("saga_id") not in still_open]
+        if late:
+            logger.warning(f"⏭️ {len(late)} late {event} events ignored: sagas already closed")
+        return [payload for payload in payloads if payload.get("saga_id") in still_open]
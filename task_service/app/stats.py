@@ -0,0 +1,135 @@
+import logging
+from collections import Counter
+from sqlalchemy import func, literal, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from .models import Task, TaskArchive, TaskStat
+
+logger = logging.getLogger(__name__)
+
+STAT_DIMENSIONS = ("status", "category", "priority")
+
+
+def task_stat_keys(user_id: int, status: str, category: str, priority: str) -> list:
+    """Claves de contador que una tarea suma: total y una por dimensión"""
+    return [
+        (user_id, "total", ""),
+        (user_id, "status", status or ""),
+        (user_id, "category", category or ""),
+        (user_id, "priority", priority or "")
+    ]
+
+
+def stat_deltas(removed: list = (), added: list = ()) -> Counter:
+    """
+    Diferencia de contadores entre tareas que salen y tareas que entran
+    Cada tarea es una tupla (user_id, status, category, priority)
+    """
+    deltas = Counter()
+    for task in removed:
+        for key in task_stat_keys(*task):
+            deltas[key] -= 1
+    for task in added:
+        for key in task_stat_keys(*task):
+            deltas[key] += 1
+    return deltas
+
+
+def task_row(task) -> tuple:
+    return (task.user_id, task.status, task.category, task.priority)
+
+
+def apply_stat_deltas(db: Session, deltas: Counter):
+    """
+    Aplica los deltas con un único upsert (sin commit), dentro de la
+    transacción de la escritura que los origina
+    """
+    rows = [
+        {"user_id": user_id, "dimension": dimension, "value": value, "count": delta}
+        for (user_id, dimension, value), delta in deltas.items()
+        if delta != 0
+    ]
+    if not rows:
+        return
+
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(TaskStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "dimension", "value"],
+        set_={"count": TaskStat.count + stmt.excluded.count}
+    )
+    db.execute(stmt, rows)
+
+
+def get_user_stats(db: Session, user_id: int) -> dict:
+    """Contadores del usuario: una lectura por clave primaria, sin tocar tasks"""
+    result = {"total": 0, "status": {}, "category": {}, "priority": {}}
+
+    rows = db.query(TaskStat).filter(TaskStat.user_id == user_id, TaskStat.count > 0)
+    for stat in rows:
+        if stat.dimension == "total":
+            result["total"] = stat.count
+        else:
+            result[stat.dimension][stat.value] = stat.count
+
+    return result
+
+
+def rebuild_stats(db: Session, user_id: int = None) -> int:
+    """
+    Job de reparación: reconstruye los contadores a partir de tasks y
+    tasks_archive (archivar no descuenta la tarea)
+    Retorna el número de filas de contadores escritas
+    """
+    delete_query = db.query(TaskStat)
+    if user_id is not None:
+        delete_query = delete_query.filter(TaskStat.user_id == user_id)
+    delete_query.delete(synchronize_session=False)
+
+    sources = []
+    for model in (Task, TaskArchive):
+        source = select(model.user_id, model.status, model.category, model.priority).where(model.user_id.isnot(None))
+        if user_id is not None:
+            source = source.where(model.user_id == user_id)
+        sources.append(source)
+    tasks = union_all(*sources).subquery()
+
+    written = 0
+    for dimension in ("total",) + STAT_DIMENSIONS:
+        value = literal("") if dimension == "total" else func.coalesce(tasks.c[dimension], "")
+        query = select(
+            tasks.c.user_id,
+            literal(dimension).label("dimension"),
+            value.label("value"),
+            func.count().label("count")
+        )
+
+        group_by = [tasks.c.user_id] if dimension == "total" else [tasks.c.user_id, value]
+        query = query.group_by(*group_by)
+
+        result = db.execute(
+            TaskStat.__table__.insert().from_select(["user_id", "dimension", "value", "count"], query)
+        )
+        written += result.rowcount or 0
+
+    db.commit()
+    logger.info(f"📊 Task stats rebuilt ({written} counters)")
+    return written
+
+
+if __name__ == "__main__":
+    # python -m app.stats [user_id]  →  reconstruye los contadores
+    import sys
+    from .database import get_shard_router
+
+    logging.basicConfig(level=logging.INFO)
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    router = get_shard_router()
+    factories = [router.session_factories[router.shard_for(user_id)]] if user_id else router.session_factories
+    for factory in factories:
+        db = factory()
+        try:
+            rebuild_stats(db, user_id)
+        finally:
+            db.close()
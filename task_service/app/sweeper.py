@@ -0,0 +1,126 @@
+import logging
+import os
+from datetime import datetime
+from threading import Event, Thread
+from sqlalchemy import insert, update
+from .models import Saga, SagaLog
+from .saga import TaskCreationSaga, update_saga_state
+from .events import publish_event
+
+logger = logging.getLogger(__name__)
+
+SAGA_SWEEP_INTERVAL_SECONDS = float(os.getenv("SAGA_SWEEP_INTERVAL_SECONDS", "30"))
+SAGA_SWEEP_BATCH_SIZE = int(os.getenv("SAGA_SWEEP_BATCH_SIZE", "100"))
+SAGA_TIMEOUT_ACTION = os.getenv("SAGA_TIMEOUT_ACTION", "compensate")  # compensate | complete
+
+
+class SagaTimeoutSweeper:
+    """
+    Cierra las sagas cuyo deadline expiró sin recibir notification.sent/failed
+    Recorre el índice parcial de deadline por lotes; las filas se reclaman con
+    FOR UPDATE SKIP LOCKED y un UPDATE condicional, así varias réplicas pueden
+    ejecutar el sweeper a la vez sin procesar dos veces la misma saga
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = SAGA_SWEEP_BATCH_SIZE,
+        interval: float = SAGA_SWEEP_INTERVAL_SECONDS,
+        action: str = SAGA_TIMEOUT_ACTION
+    ):
+        if action not in ("compensate", "complete"):
+            raise ValueError("action must be 'compensate' or 'complete'")
+
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.action = action
+        self._stop = Event()
+        self._thread = None
+
+    def sweep_once(self) -> int:
+        """Procesa un lote de sagas expiradas. Retorna cuántas se cerraron"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            expired = db.query(Saga.saga_id, Saga.task_id, Saga.user_id).filter(
+                Saga.deadline.isnot(None),
+                Saga.deadline <= now
+            ).order_by(Saga.deadline).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+            if not expired:
+                db.rollback()
+                return 0
+
+            # Reclamar: solo gana la réplica que encuentra el deadline todavía presente
+            claimed = set(db.execute(
+                update(Saga)
+                .where(Saga.saga_id.in_([row.saga_id for row in expired]), Saga.deadline.isnot(None))
+                .values(deadline=None)
+                .returning(Saga.saga_id),
+                execution_options={"synchronize_session": False}
+            ).scalars())
+            expired = [tuple(row) for row in expired if row.saga_id in claimed]
+
+            if not expired:
+                db.rollback()
+                return 0
+
+            logger.warning(f"⏰ {len(expired)} SAGAs timed out, action: {self.action}")
+
+            db.execute(insert(SagaLog), [
+                {
+                    "saga_id": saga_id,
+                    "status": "TIMED_OUT",
+                    "details": f"Task {task_id} - No notification received before deadline",
+                    "timestamp": now
+                }
+                for saga_id, task_id, _ in expired
+            ])
+
+            if self.action == "compensate":
+                TaskCreationSaga(db).compensate_batch([
+                    {"task_id": task_id, "saga_id": saga_id, "user_id": user_id, "reason": "Saga timed out"}
+                    for saga_id, task_id, user_id in expired
+                ])
+            else:
+                db.execute(insert(SagaLog), [
+                    {
+                        "saga_id": saga_id,
+                        "status": "COMPLETED",
+                        "details": f"Task {task_id} - Completed by timeout (no confirmation received)",
+                        "timestamp": now
+                    }
+                    for saga_id, task_id, _ in expired
+                ])
+                update_saga_state(db, [saga_id for saga_id, _, _ in expired], "COMPLETED")
+                db.commit()
+
+                for saga_id, task_id, user_id in expired:
+                    publish_event("task_confirmed", {"task_id": task_id, "user_id": user_id, "saga_id": saga_id})
+
+            return len(expired)
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"💥 Saga sweep failed: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def run(self):
+        """Bucle del sweeper: vacía los lotes expirados y espera el intervalo"""
+        logger.info(f"⏰ Saga timeout sweeper running every {self.interval}s")
+        while not self._stop.is_set():
+            while self.sweep_once() >= self.batch_size and not self._stop.is_set():
+                pass
+            self._stop.wait(self.interval)
+
+    def start_background(self):
+        """Iniciar el sweeper en thread separado (no bloquea FastAPI)"""
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,160 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from .models import Task, TaskChange
+from .events import serialize_task
+
+logger = logging.getLogger(__name__)
+
+TASK_CHANGES_RETENTION_DAYS = int(os.getenv("TASK_CHANGES_RETENTION_DAYS", "30"))
+
+# Margen para que un cambio se considere asentado: el id se asigna al insertar
+# pero la fila se ve al hacer commit, así que una transacción que tomó el id N
+# puede confirmar después de que N+1 ya sea visible. El cursor no avanza sobre
+# cambios más recientes que este margen (debe superar la transacción de
+# escritura más larga); esos cambios se entregan igual y se repiten en la
+# siguiente consulta
+TASK_CHANGES_SETTLE_SECONDS = float(os.getenv("TASK_CHANGES_SETTLE_SECONDS", "5"))
+
+
+def record_task_changes(db: Session, changes: list):
+    """
+    Registra cambios de tareas (sin commit), en la misma transacción que la escritura
+    Cada cambio es una tupla (user_id, task_id, operation) con operation upsert | delete
+    """
+    rows = [
+        {"user_id": user_id, "task_id": task_id, "operation": operation, "changed_at": datetime.utcnow()}
+        for user_id, task_id, operation in changes
+        if user_id is not None
+    ]
+    if rows:
+        db.execute(insert(TaskChange), rows)
+
+
+def parse_cursor(cursor: str) -> tuple:
+    """Cursor "seq" (shard 0, el formato de siempre) o "shard:seq". Lanza ValueError"""
+    shard, _, since = str(cursor).rpartition(":")
+    shard, since = int(shard or 0), int(since)
+    if shard < 0 or since < 0:
+        raise ValueError("Invalid cursor")
+    return shard, since
+
+
+def format_cursor(shard: int, since: int) -> str:
+    return f"{shard}:{since}" if shard else str(since)
+
+
+def moved_cursor(db: Session, user_id: int, origin_shard: int, since: int):
+    """
+    Posición en este shard de un cursor del shard del que migró el usuario:
+    el último cambio copiado con origin_id <= since
+    None si no hay cambios copiados de ese shard o el cursor es anterior a ellos
+    """
+    copied = (TaskChange.user_id == user_id, TaskChange.origin_shard == origin_shard)
+    first = db.query(TaskChange.id, TaskChange.origin_id).filter(*copied).order_by(TaskChange.id).first()
+    if first is None or since < first.origin_id - 1:
+        return None
+    last_seen = db.query(func.max(TaskChange.id)).filter(*copied, TaskChange.origin_id <= since).scalar()
+    return last_seen if last_seen is not None else first.id - 1
+
+
+def get_changes(
+    db: Session,
+    user_id: int,
+    cursor: str = "0",
+    limit: int = 500,
+    shard: int = 0,
+    settle_seconds: float = None
+) -> dict:
+    """
+    Cambios del usuario posteriores al cursor: tareas creadas o actualizadas
+    (estado actual) y tombstones de las eliminadas
+    Un cursor de otro shard (el usuario migró) se traduce a este; si no se
+    puede, o es anterior a lo que conserva el registro, pide resync completo
+    y entrega un cursor nuevo
+    El cursor solo avanza hasta el último cambio asentado (ver
+    TASK_CHANGES_SETTLE_SECONDS): los ids no siguen el orden de commit
+    """
+    if settle_seconds is None:
+        settle_seconds = TASK_CHANGES_SETTLE_SECONDS
+    cursor_shard, since = parse_cursor(cursor)
+    if since > 0 and cursor_shard != shard:
+        translated = moved_cursor(db, user_id, cursor_shard, since)
+        if translated is not None:
+            cursor_shard, since = shard, translated
+    if since > 0:
+        oldest = db.query(func.min(TaskChange.id)).scalar()
+        if cursor_shard != shard or (oldest is not None and since < oldest - 1):
+            latest = db.query(func.max(TaskChange.id)).scalar() or 0
+            return {
+                "cursor": format_cursor(shard, latest),
+                "reset": True,
+                "has_more": False,
+                "changes": [],
+                "tombstones": []
+            }
+
+    rows = db.query(TaskChange.id, TaskChange.task_id, TaskChange.operation, TaskChange.changed_at).filter(
+        TaskChange.user_id == user_id,
+        TaskChange.id > since
+    ).order_by(TaskChange.id).limit(limit).all()
+
+    # El cursor se detiene antes del primer cambio sin asentar: un id menor
+    # que aún no confirmó su transacción aparecerá en la próxima consulta
+    settled_before = datetime.utcnow() - timedelta(seconds=settle_seconds)
+    next_cursor = since
+    for row in rows:
+        if row.changed_at is None or row.changed_at > settled_before:
+            break
+        next_cursor = row.id
+
+    # Solo cuenta la última operación de cada tarea dentro de la página
+    latest = {}
+    for row in rows:
+        latest[row.task_id] = row
+
+    upserted = [task_id for task_id, row in latest.items() if row.operation == "upsert"]
+    tasks = []
+    if upserted:
+        tasks = db.query(Task).filter(Task.id.in_(upserted), Task.user_id == user_id).all()
+
+    tombstones = [
+        {"id": task_id, "deleted_at": row.changed_at.isoformat() if row.changed_at else None}
+        for task_id, row in latest.items()
+        if row.operation == "delete"
+    ]
+
+    return {
+        "cursor": format_cursor(shard, next_cursor),
+        "reset": False,
+        "has_more": len(rows) == limit,
+        "changes": [serialize_task(task) for task in tasks],
+        "tombstones": tombstones
+    }
+
+
+def purge_task_changes(db: Session, retention_days: int = TASK_CHANGES_RETENTION_DAYS) -> int:
+    """
+    Elimina cambios más antiguos que la retención
+    Los clientes con un cursor anterior reciben reset y resincronizan completo
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = db.query(TaskChange).filter(TaskChange.changed_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    logger.info(f"🧹 Purged {deleted} task changes older than {retention_days} days")
+    return deleted
+
+
+if __name__ == "__main__":
+    # python -m app.sync  →  purga el registro de cambios según la retención
+    from .database import get_shard_router
+
+    logging.basicConfig(level=logging.INFO)
+    for factory in get_shard_router().session_factories:
+        db = factory()
+        try:
+            purge_task_changes(db)
+        finally:
+            db.close()